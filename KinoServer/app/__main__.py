@@ -1,4 +1,7 @@
+import asyncio
+
 import uvicorn
+from anyio import to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
@@ -6,6 +9,19 @@ import os
 from app.api import routers
 from app.models import init_all_databases
 from app.config.config_reader import config
+from app.services.catalogue import (
+    catalogue_cache_headers_middleware,
+    catalogue_version_loop,
+)
+from app.services.event_partitions import event_partition_maintenance_loop
+from app.services.image_cache import (
+    compaction_loop as image_cache_compaction_loop,
+    tmdb_image_cache,
+)
+from app.services.image_upstream import close_client as close_image_client
+from app.services.image_variants import shutdown_pool as shutdown_image_variant_pool
+from app.services.photo_emotion import shutdown_pool as shutdown_photo_emotion_pool
+from app.services.session_store import sweep_loop as session_sweep_loop
 
 app = FastAPI()
 
@@ -53,11 +69,35 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Курсор keyset-пагинации списков (см. /movies/by-genre, /movies/by-emotion)
+    # и валидаторы HTTP-кэша каталога (app.services.catalogue).
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"],
 )
 
+app.middleware("http")(catalogue_cache_headers_middleware)
+
+_background_tasks: list[asyncio.Task] = []
+
+
 @app.on_event("startup")
 async def startup() -> None:
     await init_all_databases()
+    # Индекс кэша картинок строим до приёма запросов и не на event loop.
+    await to_thread.run_sync(tmdb_image_cache.load)
+    _background_tasks.append(asyncio.create_task(event_partition_maintenance_loop()))
+    _background_tasks.append(asyncio.create_task(session_sweep_loop()))
+    _background_tasks.append(asyncio.create_task(catalogue_version_loop()))
+    _background_tasks.append(asyncio.create_task(image_cache_compaction_loop()))
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    await close_image_client()
+    shutdown_image_variant_pool()
+    shutdown_photo_emotion_pool()
 
 for router in routers:
     app.include_router(router)
@@ -1,19 +1,18 @@
-import asyncio
-import os
-import time
 import hashlib
+import logging
 from pathlib import Path
 from typing import Final
 from urllib.parse import urljoin, urlparse
-from urllib.request import Request as UrlRequest, urlopen
-from urllib.error import HTTPError, URLError
 
-from fastapi import APIRouter, HTTPException
-from starlette.responses import FileResponse, Response
-from anyio import to_thread
+from fastapi import APIRouter, HTTPException, Query, Request
+from starlette.responses import FileResponse, Response, StreamingResponse
 
 from app.config.config_reader import config
+from app.services.image_cache import tmdb_image_cache
+from app.services import image_variants
+from app.services.image_upstream import UpstreamDownload, downloads
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/images", tags=["Images"])
 
@@ -33,16 +32,8 @@ ALLOWED_SIZES: Final[set[str]] = {
     "original",
 }
 
-_LOCKS: dict[str, asyncio.Lock] = {}
-
-
-def _get_lock(key: str) -> asyncio.Lock:
-    """Лок на ключ картинки (чтобы не качать один файл параллельно)."""
-    lock = _LOCKS.get(key)
-    if lock is None:
-        lock = asyncio.Lock()
-        _LOCKS[key] = lock
-    return lock
+# Сколько раз докачивать оригинал для варианта, если его вытеснили из кэша.
+VARIANT_SOURCE_ATTEMPTS = 2
 
 
 def _media_type_from_suffix(suffix: str) -> str:
@@ -55,9 +46,23 @@ def _media_type_from_suffix(suffix: str) -> str:
         return "image/webp"
     if suffix == ".gif":
         return "image/gif"
+    if suffix == ".avif":
+        return "image/avif"
     return "application/octet-stream"
 
 
+def _tmdb_source_size(size: str, width: int) -> str:
+    """Наименьший размер TMDB шириной >= width, но не больше запрошенного size."""
+    fixed = sorted(int(s[1:]) for s in ALLOWED_SIZES if s != "original")
+    limit = int(size[1:]) if size != "original" else None
+    for candidate in fixed:
+        if limit is not None and candidate > limit:
+            break
+        if candidate >= width:
+            return f"w{candidate}"
+    return size
+
+
 def _safe_cache_path(size: str, file_path: str, cache_root: Path) -> Path:
     """Безопасное имя файла в кэше (sha256 от size+file_path)."""
     ext = Path(file_path).suffix or ".jpg"
@@ -66,151 +71,178 @@ def _safe_cache_path(size: str, file_path: str, cache_root: Path) -> Path:
     return cache_root / f"{digest}{ext}"
 
 
-def _cleanup_cache_if_needed(cache_root: Path) -> None:
-    """Чистим кэш по TTL и лимиту размера (простая LRU по mtime)."""
-    cache_root.mkdir(parents=True, exist_ok=True)
+def _cached_file_response(path: Path, headers: dict[str, str] | None = None) -> FileResponse:
+    return FileResponse(
+        path=str(path),
+        media_type=_media_type_from_suffix(path.suffix),
+        headers={"Cache-Control": "public, max-age=86400", **(headers or {})},
+    )
 
-    max_bytes = int(config.TMDB_IMAGE_CACHE_MAX_BYTES)
-    max_age_days = int(config.TMDB_IMAGE_CACHE_MAX_AGE_DAYS)
-    max_age_seconds = max_age_days * 86400 if max_age_days > 0 else 0
-    now = time.time()
 
-    files: list[tuple[Path, int, float]] = []
-    total = 0
+def _proxy_cache_path(url: str, cache_root: Path) -> Path:
+    """Имя файла в кэше для /images/proxy (sha256 от URL, расширение — из пути)."""
+    ext = Path(urlparse(url).path).suffix.lower()
+    if ext not in {".jpg", ".jpeg", ".png", ".webp", ".gif"}:
+        ext = ".jpg"
+    digest = hashlib.sha256(f"proxy/{url}".encode("utf-8", errors="ignore")).hexdigest()
+    return cache_root / f"{digest}{ext}"
 
-    for p in cache_root.glob("*"):
-        if not p.is_file():
-            continue
-        try:
-            st = p.stat()
-        except OSError:
-            continue
 
-        size_bytes = int(st.st_size)
-        mtime = float(st.st_mtime)
+def _start_download(
+    dest_path: Path, remote_url: str, *, user_agent: str, source: str
+) -> UpstreamDownload:
+    return downloads.start(
+        dest_path.name,
+        lambda: UpstreamDownload(
+            remote_url,
+            dest_path=dest_path,
+            max_bytes=config.TMDB_IMAGE_CACHE_MAX_FILE_BYTES,
+            user_agent=user_agent,
+            source=source,
+            # Регистрируем файл в индексе; лишнее вытесняется с головы LRU за
+            # O(1) на файл, без обхода каталога.
+            on_stored=lambda path, size: tmdb_image_cache.add(path.name, size),
+        ),
+    )
 
-        if max_age_seconds and (now - mtime) > max_age_seconds:
-            try:
-                p.unlink(missing_ok=True)
-            except OSError:
-                pass
-            continue
 
-        files.append((p, size_bytes, mtime))
-        total += size_bytes
+async def _variant_or_original(
+    request: Request,
+    width: int,
+    source_path: Path,
+    remote_url: str,
+    *,
+    user_agent: str,
+    source: str,
+) -> Response:
+    """
+    Вариант ширины `width` в формате по Accept (см. app.services.image_variants).
 
-    if total <= max_bytes:
-        return
+    Оригинал сначала докачивается в кэш, затем кодируется в пуле процессов.
+    Если кодирование не удалось или готовый вариант уже вытеснен — отдаём
+    оригинал. Если оригинал успели вытеснить из кэша, он докачивается снова;
+    не удержался и после VARIANT_SOURCE_ATTEMPTS попыток (кэш переполнен) —
+    503 с Retry-After.
+    """
+    bucket = image_variants.width_bucket(width)
+    fmt = image_variants.negotiate_format(request.headers.get("accept"))
+    dest_path = image_variants.variant_path(source_path, bucket, fmt)
+    # Разный формат на один URL: кэши (браузер, nginx) должны учитывать Accept.
+    vary = {"Vary": "Accept"}
+
+    cached = tmdb_image_cache.lookup(dest_path.name)
+    if cached is not None:
+        return _cached_file_response(cached, vary)
+
+    for _ in range(VARIANT_SOURCE_ATTEMPTS):
+        original = tmdb_image_cache.lookup(source_path.name)
+        if original is None:
+            download = _start_download(source_path, remote_url, user_agent=user_agent, source=source)
+            await download.wait_done()
+            original = source_path
 
-    files.sort(key=lambda x: x[2])  # старые -> новые
-    for p, size_bytes, _mtime in files:
-        if total <= max_bytes:
-            break
         try:
-            p.unlink(missing_ok=True)
-            total -= size_bytes
-        except OSError:
-            # если не смогли удалить, идём дальше
+            await image_variants.render_variant(
+                original,
+                dest_path,
+                bucket,
+                fmt,
+                on_stored=lambda path, size: tmdb_image_cache.add(path.name, size),
+            )
+        except Exception:
+            if original.exists():
+                logger.warning("image variant %s: отдаём оригинал", dest_path.name, exc_info=True)
+                return _cached_file_response(original, vary)
+            # Оригинал вытеснили из кэша между докачкой и кодированием — качаем заново.
+            logger.info("image variant %s: оригинал вытеснен из кэша", dest_path.name)
             continue
-
-
-def _download_to_file(remote_url: str, dest_path: Path) -> None:
-    """
-    Скачиваем картинку в temp-файл и затем атомарно переносим в dest_path.
-    """
-    cache_root = dest_path.parent
-    cache_root.mkdir(parents=True, exist_ok=True)
-
-    tmp_path = dest_path.with_suffix(dest_path.suffix + ".tmp")
-
-    # User-Agent иногда помогает CDN/защитам, плюс полезно для логов на стороне TMDB.
-    req = UrlRequest(
-        remote_url,
-        headers={
-            "User-Agent": "KinoServer/1.0 (TMDB image cache proxy)",
-            "Accept": "image/*,*/*;q=0.8",
-        },
+        # FileResponse откроет файл только при отправке: проверяем, что
+        # только что записанный вариант ещё в кэше, иначе отдаём оригинал.
+        rendered = tmdb_image_cache.lookup(dest_path.name)
+        if rendered is not None:
+            return _cached_file_response(rendered, vary)
+        original = tmdb_image_cache.lookup(source_path.name)
+        if original is not None:
+            logger.info("image variant %s: вариант вытеснен из кэша, отдаём оригинал", dest_path.name)
+            return _cached_file_response(original, vary)
+        logger.info("image variant %s: вариант и оригинал вытеснены из кэша", dest_path.name)
+
+    raise HTTPException(
+        status_code=503,
+        detail="Кэш картинок переполнен, попробуйте позже",
+        headers={"Retry-After": "1"},
     )
 
-    max_file_bytes = int(config.TMDB_IMAGE_CACHE_MAX_FILE_BYTES)
-    downloaded = 0
-
-    try:
-        with urlopen(req, timeout=20) as resp:
-            status = getattr(resp, "status", 200)
-            if status >= 400:
-                raise HTTPException(status_code=404, detail="Постер не найден в TMDB")
-
-            with open(tmp_path, "wb") as f:
-                while True:
-                    chunk = resp.read(64 * 1024)
-                    if not chunk:
-                        break
-                    downloaded += len(chunk)
-                    if downloaded > max_file_bytes:
-                        raise HTTPException(
-                            status_code=413,
-                            detail="Файл слишком большой для кэширования",
-                        )
-                    f.write(chunk)
-
-        # Атомарная замена: если файл уже есть — перезапишем его безопасно.
-        os.replace(tmp_path, dest_path)
-    except HTTPError as e:
-        # 404/403 и т.п.
-        raise HTTPException(status_code=404, detail=f"TMDB вернул ошибку: {getattr(e, 'code', 'unknown')}") from e
-    except URLError as e:
-        raise HTTPException(status_code=502, detail="Не удалось скачать постер (ошибка сети)") from e
-    finally:
-        try:
-            tmp_path.unlink(missing_ok=True)
-        except OSError:
-            pass
 
+async def _cached_or_download(
+    dest_path: Path,
+    remote_url: str,
+    *,
+    user_agent: str,
+    source: str,
+    media_type: str | None = None,
+) -> Response:
+    """
+    Файл из кэша или скачивание с записью в кэш.
 
-def _fetch_image_bytes(remote_url: str) -> tuple[bytes, str]:
-    req = UrlRequest(
-        remote_url,
-        headers={
-            "User-Agent": "KinoServer/1.0 (image proxy)",
-        },
+    Промах качает картинку (или подключается к уже идущей загрузке того же
+    файла) и отдаёт тело клиенту по мере прихода, параллельно записывая его
+    в кэш.
+    """
+    # Попадание: индекс отмечает доступ в памяти (для LRU), без utime файла.
+    cached = tmdb_image_cache.lookup(dest_path.name)
+    if cached is not None:
+        return _cached_file_response(cached)
+
+    download = _start_download(dest_path, remote_url, user_agent=user_agent, source=source)
+    await download.wait_ready()
+    if media_type is None:
+        media_type = (download.content_type or "").split(";")[0].strip()
+    return StreamingResponse(
+        download.iter_chunks(),
+        media_type=media_type or _media_type_from_suffix(dest_path.suffix),
+        headers={"Cache-Control": "public, max-age=86400"},
     )
-    try:
-        with urlopen(req, timeout=20) as resp:
-            content_type = resp.headers.get("Content-Type") or "image/jpeg"
-            return resp.read(), content_type
-    except HTTPError as e:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Источник вернул ошибку: {getattr(e, 'code', 'unknown')}",
-        ) from e
-    except URLError as e:
-        raise HTTPException(status_code=502, detail="Не удалось скачать изображение") from e
 
 
 @router.get("/proxy")
-async def proxy_external_image(url: str):
-    """Same-origin прокси для rgbaster и других клиентских запросов к постерам."""
+async def proxy_external_image(
+    request: Request,
+    url: str,
+    w: int | None = Query(None, ge=1, le=4096),
+):
+    """
+    Same-origin прокси для постеров с внешних хостов.
+
+    - **w**: нужная ширина — отдаётся уменьшенный WebP/AVIF/JPEG (по Accept)
+    """
     parsed = urlparse((url or "").strip())
     if parsed.scheme not in {"http", "https"}:
         raise HTTPException(status_code=400, detail="Некорректный URL")
     if parsed.netloc not in ALLOWED_PROXY_HOSTS:
         raise HTTPException(status_code=400, detail="Хост изображения не разрешён")
 
-    data, content_type = await to_thread.run_sync(_fetch_image_bytes, url)
-    return Response(
-        content=data,
-        media_type=content_type.split(";")[0].strip() or "image/jpeg",
-        headers={"Cache-Control": "public, max-age=86400"},
-    )
+    # Тот же дисковый кэш, что и у /images/tmdb: карточки перерисовываются
+    # часто, а постеры не меняются.
+    source_path = _proxy_cache_path(url, tmdb_image_cache.root)
+    download_kwargs = {"user_agent": "KinoServer/1.0 (image proxy)", "source": "Источник"}
+    if w is not None:
+        return await _variant_or_original(request, w, source_path, url, **download_kwargs)
+    return await _cached_or_download(source_path, url, **download_kwargs)
 
 
 @router.get("/tmdb/{size}/{file_path:path}", name="tmdb_image")
-async def tmdb_image(size: str, file_path: str):
+async def tmdb_image(
+    request: Request,
+    size: str,
+    file_path: str,
+    w: int | None = Query(None, ge=1, le=4096),
+):
     """
     Прокси для картинок TMDB с дисковым кэшем и ограничением по размеру.
 
-    Пример: /images/tmdb/w780/abcd123.jpg
+    Пример: /images/tmdb/w780/abcd123.jpg, /images/tmdb/original/abcd123.jpg?w=320
+    - **w**: нужная ширина — отдаётся уменьшенный WebP/AVIF/JPEG (по Accept)
     """
     if size not in ALLOWED_SIZES:
         raise HTTPException(status_code=404, detail="Неизвестный размер картинки")
@@ -220,48 +252,18 @@ async def tmdb_image(size: str, file_path: str):
     if not normalized or ".." in normalized.split("/"):
         raise HTTPException(status_code=400, detail="Некорректный путь к файлу")
 
-    cache_root = Path(config.TMDB_IMAGE_CACHE_DIR)
-    dest_path = _safe_cache_path(size=size, file_path=normalized, cache_root=cache_root)
-
-    # Если уже есть в кэше — отдаём сразу и “трогаем” mtime (для LRU)
-    if dest_path.exists():
-        try:
-            os.utime(dest_path, None)
-        except OSError:
-            pass
-        return FileResponse(
-            path=str(dest_path),
-            media_type=_media_type_from_suffix(dest_path.suffix),
-            headers={"Cache-Control": "public, max-age=86400"},
-        )
-
-    key = f"{size}/{normalized}"
-    lock = _get_lock(key)
-
-    async with lock:
-        # Пока ждали лок, файл мог уже скачать другой запрос.
-        if dest_path.exists():
-            try:
-                os.utime(dest_path, None)
-            except OSError:
-                pass
-            return FileResponse(
-                path=str(dest_path),
-                media_type=_media_type_from_suffix(dest_path.suffix),
-                headers={"Cache-Control": "public, max-age=86400"},
-            )
-
-        remote_url = urljoin(config.TMDB_IMAGE_BASE_URL.rstrip("/") + "/", f"{size}/{normalized}")
-
-        # Скачивание делаем в thread, чтобы не блокировать event loop.
-        await to_thread.run_sync(_download_to_file, remote_url, dest_path)
-
-        # После скачивания — подчистим кэш, если он вышел за лимит.
-        await to_thread.run_sync(_cleanup_cache_if_needed, cache_root)
-
-        return FileResponse(
-            path=str(dest_path),
-            media_type=_media_type_from_suffix(dest_path.suffix),
-            headers={"Cache-Control": "public, max-age=86400"},
-        )
-
+    download_kwargs = {"user_agent": "KinoServer/1.0 (TMDB image cache proxy)", "source": "TMDB"}
+    if w is not None:
+        # Оригинал для варианта — наименьший размер TMDB не уже нужного.
+        size = _tmdb_source_size(size, image_variants.width_bucket(w))
+
+    dest_path = _safe_cache_path(size=size, file_path=normalized, cache_root=tmdb_image_cache.root)
+    remote_url = urljoin(config.TMDB_IMAGE_BASE_URL.rstrip("/") + "/", f"{size}/{normalized}")
+    if w is not None:
+        return await _variant_or_original(request, w, dest_path, remote_url, **download_kwargs)
+    return await _cached_or_download(
+        dest_path,
+        remote_url,
+        media_type=_media_type_from_suffix(dest_path.suffix),
+        **download_kwargs,
+    )
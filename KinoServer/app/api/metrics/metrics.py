@@ -0,0 +1,38 @@
+from fastapi import APIRouter
+
+from app.db.db import db_engine, db_read_engine
+from app.db.pool_metrics import pool_snapshot
+from app.services.image_cache import tmdb_image_cache
+from app.services.response_cache import response_cache
+
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("/db-pool")
+async def db_pool_metrics():
+    """
+    Состояние пула соединений: занято/свободно/overflow и гистограмма
+    времени ожидания checkout (накопительные бакеты в миллисекундах).
+    Если настроена read-реплика, её пул — в поле `replica`.
+    """
+    data = pool_snapshot(db_engine) or {}
+    if db_read_engine is not db_engine:
+        data["replica"] = pool_snapshot(db_read_engine)
+    return data
+
+
+@router.get("/response-cache")
+async def response_cache_metrics():
+    """
+    In-process кэш ответов списков (этого воркера): число записей и по
+    каждому маршруту hits / misses / coalesced (ждали чужой запрос в БД) и
+    hit_ratio.
+    """
+    return response_cache.snapshot()
+
+
+@router.get("/image-cache")
+async def image_cache_metrics():
+    """Индекс дискового кэша постеров TMDB (этого воркера): файлы и занятые байты."""
+    return tmdb_image_cache.snapshot()
@@ -4,21 +4,30 @@ import os
 # Добавляем путь к корню проекта для импорта embedding
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..'))
 
-import tempfile
+import json
 
-from fastapi import APIRouter, Depends, Query, HTTPException, Request, File, UploadFile
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.db import get_session
-from urllib.parse import urlparse
+from app.db.db import db_sessionmaker, get_read_session, get_session
 
 from app.api.emotion import get_emotion_genres
+from app.posters import proxify_tmdb_image_url
+from app.responses import card_list_response
+from app.services.catalogue import catalogue_cache
+from app.services.photo_emotion import analyze_photo, read_photo_upload
+from app.services.poster_colors import public_poster_colors
+from app.services.response_cache import response_cache
 from app.schemas.schemas import (
     Movie,
+    MoviePosterColors,
     ReviewCreate,
+    ReviewCreatedResponse,
     ReviewRequest,
     ReviewResponse,
     EmbeddingRequest,
     EmbeddingResponse,
+    EmotionStats,
     MovieIdsRequest,
     ReviewEmotionRequest,
     ReviewEmotionResponse,
@@ -29,9 +38,13 @@ from app.crud.crud import (
     get_movies,
     add_review,
     get_reviews,
+    stream_reviews,
     get_emotion_ratings,
+    get_emotion_stats,
+    get_emotion_stats_by_ids,
     get_avg_emotion_ratings,
     get_avg_emotion_ratings_by_ids,
+    get_poster_colors,
     get_movies_by_emotion,
     get_movies_by_genre,
     get_movies_by_word,
@@ -45,6 +58,10 @@ from embedding.embedding import to_embedding
 
 router = APIRouter(prefix="/movies", tags=["Фильмы"])
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+REVIEWS_PAGE_SIZE = 50
+
 def _review_to_response_dict(review) -> dict:
     """
     Приводим ORM Review к JSON-совместимому dict для ответа.
@@ -74,35 +91,12 @@ def _review_to_response_dict(review) -> dict:
 
 
 
-def _proxify_tmdb_image_url(request: Request, url: str | None) -> str | None:
-    """
-    Если url ведёт на image.tmdb.org — переписываем на наш эндпоинт /images/tmdb/...
-    """
-    if not url:
-        return None
-
-    try:
-        parsed = urlparse(url)
-    except Exception:
-        return url
-
-    if parsed.netloc != "image.tmdb.org":
-        return url
-
-    parts = (parsed.path or "").strip("/").split("/")
-    if len(parts) < 4:
-        return url
-    if parts[0] != "t" or parts[1] != "p":
-        return url
-
-    size = parts[2]
-    file_path = "/".join(parts[3:])
-    try:
-        # Стабильный путь для reverse-proxy (настраивается через PUBLIC_API_PREFIX).
-        prefix = (os.getenv("PUBLIC_API_PREFIX") or "/api").rstrip("/")
-        return f"{prefix}/images/tmdb/{size}/{file_path}"
-    except Exception:
-        return url
+def _poster_url(movie_obj, column: str) -> str | None:
+    """Готовый публичный URL из БД; для строк без него — переписываем на лету."""
+    public_url = getattr(movie_obj, f"{column}_public_url", None)
+    if public_url:
+        return public_url
+    return proxify_tmdb_image_url(getattr(movie_obj, column, None))
 
 
 def _movie_to_response_dict(request: Request, movie_obj) -> dict:
@@ -127,8 +121,8 @@ def _movie_to_response_dict(request: Request, movie_obj) -> dict:
         "writers": getattr(movie_obj, "writers", None),
         "actors": movie_obj.actors,
         "description": movie_obj.description,
-        "horizontal_poster_url": _proxify_tmdb_image_url(request, getattr(movie_obj, "horizontal_poster_url", None)),
-        "vertical_poster_url": _proxify_tmdb_image_url(request, getattr(movie_obj, "vertical_poster_url", None)),
+        "horizontal_poster_url": _poster_url(movie_obj, "horizontal_poster_url"),
+        "vertical_poster_url": _poster_url(movie_obj, "vertical_poster_url"),
         "country": movie_obj.country,
         "rating": movie_obj.rating,
         "tmdb_id": movie_obj.tmdb_id,
@@ -136,12 +130,13 @@ def _movie_to_response_dict(request: Request, movie_obj) -> dict:
         "title_foreign": bool(getattr(movie_obj, "title_foreign", False)),
         "tags": getattr(movie_obj, "tags", None) or [],
         "total_reviews": int(getattr(movie_obj, "total_reviews", 0) or 0),
+        "poster_colors": public_poster_colors(getattr(movie_obj, "poster_colors", None)),
     }
 
 
-@router.get("/all", response_model=list[int])
+@router.get("/all", response_model=list[int], dependencies=[Depends(catalogue_cache)])
 async def read_all_movies_id(
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Список kinopoisk_id всех фильмов (для rating/update_avg и т.п.).
@@ -154,7 +149,7 @@ async def read_movies(
     skip: int = Query(0, ge=0),
     user_id: str = "1",
     limit: int = Query(10, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Получить список фильмов с пагинацией.
@@ -163,10 +158,10 @@ async def read_movies(
     - **limit**: Сколько фильмов вернуть
     """
     movies = await get_movies(skip=skip, user_id=user_id, limit=limit, session=session)
-    return [_movie_to_response_dict(request, m) for m in movies]
+    return card_list_response([_movie_to_response_dict(request, m) for m in movies])
 
 
-@router.post("/{movie_id}/review", response_model=list[ReviewResponse])
+@router.post("/{movie_id}/review", response_model=ReviewCreatedResponse)
 async def add_movie_review(
     movie_id: int,
     body: ReviewRequest,
@@ -174,25 +169,66 @@ async def add_movie_review(
 ):
     """
     Добавить отзыв к фильму. movie_id = kinopoisk_id.
+    Возвращает созданный отзыв и число отзывов фильма (список — GET /reviews).
     """
-    review = await add_review(movie_id, body.text, session, body.username,
+    review, review_count = await add_review(movie_id, body.text, session, body.username,
                              body.sadness_rating, body.optimism_rating,
                              body.fear_rating, body.anger_rating, body.neutral_rating,
                              body.worry_rating, body.love_rating, body.fun_rating,
                              body.boredom_rating)
-    reviews = await get_reviews(movie_id, session)
-    return [_review_to_response_dict(r) for r in reviews]
+    return {"review": _review_to_response_dict(review), "review_count": review_count}
+
+
+def _parse_review_cursor(cursor: str | None) -> int | None:
+    """Курсор отзывов — id последнего полученного отзыва (из X-Next-Cursor)."""
+    if not cursor:
+        return None
+    try:
+        return int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+async def _reviews_ndjson(movie_id: int, limit: int | None, before_id: int | None):
+    # Своя сессия: генератор работает уже после выхода из обработчика,
+    # когда сессия из Depends может быть закрыта.
+    async with db_sessionmaker() as session:
+        async for review in stream_reviews(movie_id, session, limit=limit, before_id=before_id):
+            yield json.dumps(_review_to_response_dict(review), ensure_ascii=False) + "\n"
 
 
 @router.get("/{movie_id}/reviews", response_model=list[ReviewResponse])
 async def read_movie_reviews(
+    request: Request,
+    response: Response,
     movie_id: int,
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = None,
+    format: str | None = Query(None, pattern="^(json|ndjson)$"),
     session: AsyncSession = Depends(get_session),
 ):
     """
-    Отзывы по фильму. movie_id = kinopoisk_id.
+    Отзывы по фильму, от новых к старым. movie_id = kinopoisk_id.
+
+    - **limit**: размер страницы (по умолчанию 50); следующая страница —
+      с `cursor` из заголовка X-Next-Cursor
+    - **format=ndjson** (или `Accept: application/x-ndjson`): по отзыву на
+      строку, потоком; без limit — все отзывы начиная с cursor
     """
-    reviews = await get_reviews(movie_id, session)
+    before_id = _parse_review_cursor(cursor)
+
+    wants_ndjson = format == "ndjson" or (
+        format is None and NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+    )
+    if wants_ndjson:
+        return StreamingResponse(
+            _reviews_ndjson(movie_id, limit, before_id), media_type=NDJSON_MEDIA_TYPE
+        )
+
+    limit = limit or REVIEWS_PAGE_SIZE
+    reviews = await get_reviews(movie_id, session, limit=limit, before_id=before_id)
+    if len(reviews) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(reviews[-1].id)
     return [_review_to_response_dict(r) for r in reviews]
 
 @router.get("/search", response_model=list[Movie])
@@ -202,7 +238,7 @@ async def read_movies(
     skip: int = Query(0, ge=0),
     user_id: str = "1",
     limit: int = Query(10, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Поиск фильмов по слову в названии (с пагинацией).
@@ -212,7 +248,7 @@ async def read_movies(
     - **limit**: Сколько фильмов вернуть
     """
     movies = await get_movies_by_word(search=search, skip=skip, user_id=user_id, limit=limit, session=session)
-    return [_movie_to_response_dict(request, m) for m in movies]
+    return card_list_response([_movie_to_response_dict(request, m) for m in movies])
 
 
 @router.get("/semantic-search", response_model=list[Movie])
@@ -223,7 +259,7 @@ async def semantic_search_movies(
     user_id: str = "1",
     exclude_favorites: bool = True,
     limit: int = Query(10, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Семантический поиск фильмов по текстовому запросу.
@@ -256,7 +292,7 @@ async def semantic_search_movies(
     )
 
     paginated = movies[skip:skip + limit]
-    return [_movie_to_response_dict(request, m) for m in paginated]
+    return card_list_response([_movie_to_response_dict(request, m) for m in paginated])
 
 
 @router.post("/embedding", response_model=EmbeddingResponse)
@@ -297,31 +333,33 @@ async def get_review_emotion(request: ReviewEmotionRequest):
     )
 
 
-@router.post("/emotion-from-photo", response_model=PhotoEmotionResponse)
-async def get_emotion_from_photo(file: UploadFile = File(...)):
-    """Определить эмоцию по загруженному фото."""
-    if not file.content_type or not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail='Нужно загрузить изображение')
-
-    suffix = os.path.splitext(file.filename or '')[1] or '.jpg'
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail='Файл пустой')
-
-    from anyio import to_thread
-    from face_recognition.face_recognition import analyze_photo_emotion
+# Тело читает read_photo_upload (потоком, с лимитом), а не параметр File(...),
+# поэтому форма описана для Swagger вручную.
+_PHOTO_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(data)
-        temp_path = tmp.name
 
-    try:
-        result = await to_thread.run_sync(analyze_photo_emotion, temp_path)
-    finally:
-        try:
-            os.remove(temp_path)
-        except OSError:
-            pass
+@router.post(
+    "/emotion-from-photo",
+    response_model=PhotoEmotionResponse,
+    openapi_extra=_PHOTO_UPLOAD_OPENAPI,
+)
+async def get_emotion_from_photo(request: Request):
+    """Определить эмоцию по загруженному фото (multipart, поле file)."""
+    data = await read_photo_upload(request)
+    result = await analyze_photo(data)
 
     if not result:
         raise HTTPException(
@@ -340,7 +378,7 @@ async def get_emotion_from_photo(file: UploadFile = File(...)):
 async def get_movies_by_ids_endpoint(
     request: Request,
     body: MovieIdsRequest,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Получить фильмы по списку ID.
@@ -348,28 +386,85 @@ async def get_movies_by_ids_endpoint(
     - **movie_ids**: Список ID фильмов
     """
     movies = await get_movies_by_ids(body.movie_ids, session)
-    return [_movie_to_response_dict(request, m) for m in movies]
+    return card_list_response([_movie_to_response_dict(request, m) for m in movies])
 
 
 @router.get("/{movie_id}/emotion-ratings", response_model=dict[str, list[int]])
 async def get_movie_emotion_ratings(
     movie_id: int,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Рейтинги эмоций по отзывам. movie_id = kinopoisk_id.
+
+    Ответ растёт вместе с числом отзывов — для агрегатов используйте
+    /movies/{movie_id}/emotion-stats.
     """
     ratings = await get_emotion_ratings(movie_id, session)
     return ratings
 
 
-@router.get("/{movie_id}/avg-emotion-ratings", response_model=dict[str, float] | None)
+@router.get(
+    "/{movie_id}/emotion-stats",
+    response_model=dict[str, EmotionStats],
+    dependencies=[Depends(catalogue_cache)],
+)
+async def get_movie_emotion_stats(
+    movie_id: int,
+    session: AsyncSession = Depends(get_read_session),
+):
+    """
+    count/sum/mean/гистограмма оценок по каждой эмоции. movie_id = kinopoisk_id.
+    Считается в БД одним запросом; размер ответа не зависит от числа отзывов.
+    """
+    return await get_emotion_stats(movie_id, session)
+
+
+@router.post("/emotion-stats/by-ids", response_model=dict[int, dict[str, EmotionStats]])
+async def get_movie_emotion_stats_by_ids(
+    body: MovieIdsRequest,
+    session: AsyncSession = Depends(get_read_session),
+):
+    """
+    Батч-версия emotion-stats: один запрос на весь список.
+
+    - **movie_ids**: список kinopoisk_id
+    """
+    return await get_emotion_stats_by_ids(body.movie_ids, session)
+
+
+@router.get(
+    "/{movie_id}/poster-colors",
+    response_model=MoviePosterColors,
+    dependencies=[Depends(catalogue_cache)],
+)
+async def read_movie_poster_colors(
+    movie_id: int,
+    session: AsyncSession = Depends(get_read_session),
+):
+    """
+    Доминантный и акцентный цвет постеров (`#rrggbb`) для темизации карточки.
+    movie_id = kinopoisk_id. Считаются бэкфиллом (python -m
+    app.services.poster_colors); пока цвета постера не посчитаны, его ключа
+    в ответе нет.
+    """
+    colors = await get_poster_colors(movie_id, session)
+    if colors is None:
+        raise HTTPException(status_code=404, detail="Фильм не найден")
+    return colors
+
+
+@router.get(
+    "/{movie_id}/avg-emotion-ratings",
+    response_model=dict[str, float] | None,
+    dependencies=[Depends(catalogue_cache)],
+)
 async def get_movie_avg_emotion_ratings(
     movie_id: int,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
-    Средние рейтинги из таблицы ratings. movie_id = kinopoisk_id.
+    Средние рейтинги из movie_emotion_profiles. movie_id = kinopoisk_id.
     """
     ratings = await get_avg_emotion_ratings(movie_id, session)
     return ratings
@@ -381,41 +476,77 @@ async def get_movie_avg_emotion_ratings(
 )
 async def get_movie_avg_emotion_ratings_by_ids(
     body: MovieIdsRequest,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Батч-версия: средние рейтинги эмоций сразу для списка фильмов.
-    Возвращает только те id, для которых нашлась запись в `ratings`.
+    Возвращает только те id, для которых нашлась запись в `movie_emotion_profiles`.
 
     - **movie_ids**: список kinopoisk_id
     """
     return await get_avg_emotion_ratings_by_ids(body.movie_ids, session)
 
 
-@router.get("/by-genre/{genre}", response_model=list[Movie])
+def _parse_listing_cursor(cursor: str | None) -> tuple[float, int] | None:
+    """Курсор keyset-пагинации: "<sort_key>:<kinopoisk_id>" из X-Next-Cursor."""
+    if not cursor:
+        return None
+    try:
+        sort_key, movie_id = cursor.rsplit(":", 1)
+        return float(sort_key), int(movie_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+def _listing_response(request: Request, rows, limit: int) -> Response:
+    """Карточки + X-Next-Cursor, если страница заполнена целиком."""
+    headers = None
+    if len(rows) == limit:
+        last = rows[-1]
+        headers = {NEXT_CURSOR_HEADER: f"{last.sort_key!r}:{last.kinopoisk_id}"}
+    return card_list_response([_movie_to_response_dict(request, m) for m in rows], headers)
+
+
+@router.get(
+    "/by-genre/{genre}",
+    response_model=list[Movie],
+    dependencies=[Depends(catalogue_cache)],
+)
 async def get_movies_by_genre_endpoint(
     request: Request,
     genre: str,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Получить фильмы с тегом жанра (genre_* в поле tags), по убыванию рейтинга.
 
     - **genre**: slug жанра (drama, comedy) или полный тег (genre_drama)
+    - **cursor**: значение заголовка X-Next-Cursor предыдущей страницы (вместо skip)
     """
-    movies = await get_movies_by_genre(genre, skip, limit, session)
-    return [_movie_to_response_dict(request, m) for m in movies]
+    after = _parse_listing_cursor(cursor)
+
+    async def compute() -> Response:
+        movies = await get_movies_by_genre(genre, skip, limit, session, after=after)
+        return _listing_response(request, movies, limit)
+
+    return await response_cache.get_or_compute("by-genre", (genre, skip, limit, after), compute)
 
 
-@router.get("/by-emotion/{emotion}", response_model=list[Movie])
+@router.get(
+    "/by-emotion/{emotion}",
+    response_model=list[Movie],
+    dependencies=[Depends(catalogue_cache)],
+)
 async def get_movies_by_emotion_endpoint(
     request: Request,
     emotion: str,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Получить фильмы, отсортированные по рейтингу указанной эмоции (от большего к меньшему).
@@ -423,10 +554,16 @@ async def get_movies_by_emotion_endpoint(
     - **emotion**: Название эмоции (sadness, optimism, fear, anger, worry, love, fun, boredom)
     - **skip**: Сколько фильмов пропустить (offset)
     - **limit**: Сколько фильмов вернуть
+    - **cursor**: значение заголовка X-Next-Cursor предыдущей страницы (вместо skip)
     Возвращает только фильмы с рейтингом выбранной эмоции > 0
     """
-    movies = await get_movies_by_emotion(emotion, skip, limit, session)
-    return [_movie_to_response_dict(request, m) for m in movies]
+    after = _parse_listing_cursor(cursor)
+
+    async def compute() -> Response:
+        movies = await get_movies_by_emotion(emotion, skip, limit, session, after=after)
+        return _listing_response(request, movies, limit)
+
+    return await response_cache.get_or_compute("by-emotion", (emotion, skip, limit, after), compute)
 
 ######
 
@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.movie.movie import _movie_to_response_dict
-from app.db.db import get_session
+from app.db.db import get_session, mark_user_write, read_session_for
 from app.schemas.schemas import (
     RecommendationEventCreate,
     RecommendationRequest,
@@ -46,9 +46,11 @@ async def create_or_update_session(
 async def read_recommendations(
     request: Request,
     body: RecommendationRequest,
-    session: AsyncSession = Depends(get_session),
 ):
-    scored_movies = await recommend_movies(body, session)
+    # Скоринг только читает — идёт на реплику (user_id приходит в теле запроса,
+    # поэтому сессию открываем здесь, а не через Depends(get_read_session)).
+    async with read_session_for(body.user_id) as session:
+        scored_movies = await recommend_movies(body, session)
 
     response = []
     for item in scored_movies:
@@ -79,6 +81,7 @@ async def rebuild_profile(
         return {"ok": False, "detail": "Пользователь не найден"}
 
     await session.commit()
+    mark_user_write(user_id)
     await session.refresh(profile)
     return {
         "ok": True,
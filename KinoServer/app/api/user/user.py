@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text
+from app.crud import queries
 from app.db.db import get_session
 
 from app.schemas.schemas import MovieAction, FavoriteResponse
@@ -23,10 +23,7 @@ router = APIRouter(prefix="/favorite", tags=["Favorite"])
 @router.get("/user-exists/{user_id}")
 async def user_exists(user_id: str, session: AsyncSession = Depends(get_session)):
     """Проверка, что user_id существует в таблице `favorite`."""
-    result = await session.execute(
-        text("SELECT * FROM favorite WHERE user_id = :user_id LIMIT 1"),
-        {"user_id": user_id},
-    )
+    result = await session.execute(queries.USER_EXISTS, {"user_id": user_id})
     exists = result.scalar_one_or_none() is not None
     return {"exists": exists}
 
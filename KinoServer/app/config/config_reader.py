@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -9,6 +10,27 @@ class Settings(BaseSettings):
     APP_PORT: int
     DATABASE_URL: str
 
+    # Пул соединений SQLAlchemy (на один процесс uvicorn).
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # Сколько ждать свободное соединение, прежде чем упасть (в секундах).
+    DB_POOL_TIMEOUT: float = 30.0
+    # Переоткрывать соединения старше N секунд (-1 — никогда).
+    DB_POOL_RECYCLE: int = 1800
+    # Проверять соединение перед выдачей из пула (лишний SELECT 1, зато без
+    # ошибок после рестарта Postgres / обрыва по idle-таймауту).
+    DB_POOL_PRE_PING: bool = True
+    # Размер кэша prepared statements asyncpg (0 — для pgbouncer transaction mode).
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Read-реплика для read-only эндпоинтов (пусто — всё идёт в DATABASE_URL).
+    READ_DATABASE_URL: str | None = None
+    # Сколько секунд после лайка/дизлайка читать данные пользователя с primary.
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+
+    # Публичный префикс API за reverse-proxy: постеры TMDB отдаются как
+    # {PUBLIC_API_PREFIX}/images/tmdb/{size}/{file}.
+    PUBLIC_API_PREFIX: str = "/api"
+
     # TMDB images proxy/cache
     TMDB_IMAGE_CACHE_DIR: str = "data/tmdb_image_cache"
     # Максимальный размер кэша на диске (в байтах).
@@ -19,6 +41,60 @@ class Settings(BaseSettings):
     TMDB_IMAGE_CACHE_MAX_AGE_DAYS: int = 30
     # Базовый URL для картинок TMDB.
     TMDB_IMAGE_BASE_URL: str = "https://image.tmdb.org/t/p"
+    # Сколько картинок одновременно качать с одного внешнего хоста.
+    IMAGE_UPSTREAM_MAX_CONCURRENCY_PER_HOST: int = 8
+    # Таймаут чтения при скачивании картинки (в секундах).
+    IMAGE_UPSTREAM_TIMEOUT_SECONDS: float = 20.0
+    # Максимум одновременно идущих (и ждущих хоста) загрузок на процесс.
+    IMAGE_UPSTREAM_MAX_INFLIGHT: int = 256
+    # Варианты постеров (?w=...): процессов для перекодирования и качество.
+    IMAGE_VARIANT_WORKERS: int = 2
+    IMAGE_VARIANT_WEBP_QUALITY: int = 80
+    IMAGE_VARIANT_JPEG_QUALITY: int = 82
+    # Как часто сверять индекс кэша картинок с диском (TTL, файлы других воркеров).
+    IMAGE_CACHE_COMPACT_INTERVAL_SECONDS: float = 600.0
+
+    # /movies/emotion-from-photo: потоков анализа (0 — по числу ядер; ядра
+    # делятся между ними поровну) и сколько фото на процесс может
+    # ждать/обрабатываться одновременно.
+    PHOTO_EMOTION_WORKERS: int = 2
+    PHOTO_EMOTION_MAX_PENDING: int = 32
+    # Максимальный размер загружаемого фото (в байтах).
+    PHOTO_EMOTION_MAX_UPLOAD_BYTES: int = 15_000_000
+    # Формат модели эмоций: pt, onnx или openvino (python -m face_recognition.export).
+    # Для onnx/openvino пул анализа — один поток: их сессия сама занимает все ядра.
+    PHOTO_EMOTION_MODEL_FORMAT: Literal["pt", "onnx", "openvino"] = "pt"
+
+    # recommendation_events: помесячные секции и retention
+    # Сколько будущих месяцев держать созданными заранее.
+    RECOMMENDATION_EVENTS_PARTITIONS_AHEAD: int = 2
+    # Сколько месяцев истории хранить (0 — хранить всё).
+    RECOMMENDATION_EVENTS_RETENTION_MONTHS: int = 12
+    # True — старые секции отсоединяются и переименовываются в *_archive_*,
+    # False — удаляются.
+    RECOMMENDATION_EVENTS_ARCHIVE: bool = False
+    # Период фонового обслуживания секций (в секундах).
+    RECOMMENDATION_EVENTS_MAINTENANCE_INTERVAL_SECONDS: int = 86400
+
+    # recommendation_sessions: кэш состояния и очистка
+    # Время жизни сессии без активности (в секундах).
+    RECOMMENDATION_SESSION_TTL_SECONDS: int = 6 * 3600
+    # Сколько сессий держать в памяти процесса.
+    RECOMMENDATION_SESSION_CACHE_MAX_ENTRIES: int = 10_000
+    # Сколько последних показанных фильмов помнить в сессии.
+    RECOMMENDATION_SESSION_MAX_SHOWN: int = 1000
+    # Период и размер пачки фоновой очистки протухших сессий.
+    RECOMMENDATION_SESSION_SWEEP_INTERVAL_SECONDS: int = 600
+    RECOMMENDATION_SESSION_SWEEP_BATCH_SIZE: int = 500
+
+    # HTTP-кэш каталожных эндпоинтов (ETag по версии каталога).
+    CATALOGUE_CACHE_MAX_AGE_SECONDS: int = 60
+    # Как часто процесс перечитывает версию каталога из БД.
+    CATALOGUE_VERSION_POLL_SECONDS: float = 5.0
+
+    # In-process кэш ответов горячих списков (by-genre / by-emotion); 0 — выключен.
+    RESPONSE_CACHE_TTL_SECONDS: float = 30.0
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
 
     _KINOSERVER_DIR = Path(__file__).resolve().parents[2]  # .../KinoServer
     _REPO_ROOT_DIR = Path(__file__).resolve().parents[3]   # .../vibemovie_project
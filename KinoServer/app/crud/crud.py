@@ -1,8 +1,12 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import case, literal, select, func, or_
-from app.emotions import is_output_emotion, strip_excluded_emotions
-from app.movie_filters import is_movie_deliverable, movie_deliverable_filter, movie_deliverable_sql
+from app.crud import queries
+from app.crud.emotion_profile_sql import review_totals
+from app.emotions import EMOTIONS, strip_excluded_emotions
+from app.movie_filters import is_movie_deliverable, movie_deliverable_filter
+from app.db.db import mark_user_write
 from app.models.models import Favorite, Movie, Review
+from app.services import poster_colors
 
 TITLE_SIM_THRESHOLD = 0.25
 
@@ -99,16 +103,49 @@ async def get_favorite_by_user(user_id: str, session: AsyncSession):
     result = await session.execute(stmt)
     return result.scalar_one_or_none()
 
-async def get_reviews(kinopoisk_movie_id: int, session: AsyncSession):
+# Сколько строк отзывов драйвер отдаёт за раз при потоковой выдаче.
+REVIEW_STREAM_BATCH = 100
+
+
+def _reviews_stmt(kinopoisk_movie_id: int, before_id: int | None, limit: int | None):
+    """Отзывы фильма от новых к старым; before_id — keyset-курсор (id последнего отзыва)."""
     stmt = (
         select(Review)
         .where(Review.movie_id == kinopoisk_movie_id)
         .order_by(Review.id.desc())
     )
-    result = await session.execute(stmt)
+    if before_id is not None:
+        stmt = stmt.where(Review.id < before_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+async def get_reviews(
+    kinopoisk_movie_id: int,
+    session: AsyncSession,
+    limit: int | None = None,
+    before_id: int | None = None,
+):
+    result = await session.execute(_reviews_stmt(kinopoisk_movie_id, before_id, limit))
     reviews = result.scalars().all()
     return reviews
 
+
+async def stream_reviews(
+    kinopoisk_movie_id: int,
+    session: AsyncSession,
+    limit: int | None = None,
+    before_id: int | None = None,
+):
+    """Как get_reviews, но без загрузки всех строк в память (серверный курсор)."""
+    stmt = _reviews_stmt(kinopoisk_movie_id, before_id, limit).execution_options(
+        yield_per=REVIEW_STREAM_BATCH
+    )
+    result = await session.stream_scalars(stmt)
+    async for review in result:
+        yield review
+
 async def get_emotion_ratings(kinopoisk_movie_id: int, session: AsyncSession) -> dict[str, list[int]]:
     """
     Рейтинги эмоций по отзывам. Review.movie_id = kinopoisk_id фильма.
@@ -166,36 +203,43 @@ async def get_emotion_ratings(kinopoisk_movie_id: int, session: AsyncSession) ->
 
     return emotion_ratings
 
-async def get_avg_emotion_ratings(kinopoisk_movie_id: int, session: AsyncSession) -> dict[str, float] | None:
-    """
-    Средние рейтинги из таблицы ratings; ratings.movie_id = kinopoisk_id.
+async def get_emotion_stats_by_ids(
+    movie_ids: list[int], session: AsyncSession
+) -> dict[int, dict[str, dict]]:
+    """count/sum/mean/гистограмма по каждой эмоции — один SQL-проход на весь батч.
+
+    Фильмы без отзывов тоже попадают в ответ (с нулями).
     """
-    from sqlalchemy import text
+    if not movie_ids:
+        return {}
+
+    result = await session.execute(
+        queries.EMOTION_HISTOGRAMS_BY_MOVIES, {"movie_ids": list(movie_ids)}
+    )
+    stats = queries.emotion_stats_from_rows(result.all())
+    return {
+        int(movie_id): stats.get(int(movie_id)) or queries.empty_emotion_stats()
+        for movie_id in movie_ids
+    }
+
 
-    # Используем raw SQL для запроса к таблице ratings
-    query = text("""
-        SELECT sadness_avg, optimism_avg, fear_avg, anger_avg, neutral_avg,
-               worry_avg, love_avg, fun_avg, boredom_avg
-        FROM ratings
-        WHERE movie_id = :movie_id
-    """)
+async def get_emotion_stats(kinopoisk_movie_id: int, session: AsyncSession) -> dict[str, dict]:
+    """Агрегаты оценок эмоций по отзывам одного фильма (movie_id = kinopoisk_id)."""
+    stats = await get_emotion_stats_by_ids([kinopoisk_movie_id], session)
+    return stats[kinopoisk_movie_id]
 
-    result = await session.execute(query, {"movie_id": kinopoisk_movie_id})
+
+async def get_avg_emotion_ratings(kinopoisk_movie_id: int, session: AsyncSession) -> dict[str, float] | None:
+    """
+    Средние рейтинги из movie_emotion_profiles (ключ — kinopoisk_id).
+    """
+    result = await session.execute(
+        queries.AVG_RATINGS_BY_MOVIE, {"movie_id": kinopoisk_movie_id}
+    )
     row = result.fetchone()
 
     if row:
-        sadness, optimism, fear, anger, neutral, worry, love, fun, boredom = row
-        return strip_excluded_emotions({
-            'sadness': float(sadness),
-            'optimism': float(optimism),
-            'fear': float(fear),
-            'anger': float(anger),
-            'neutral': float(neutral),
-            'worry': float(worry),
-            'love': float(love),
-            'fun': float(fun),
-            'boredom': float(boredom),
-        })
+        return strip_excluded_emotions(queries.profile_to_dict(row[0]))
 
     return None
 
@@ -207,114 +251,81 @@ async def get_avg_emotion_ratings_by_ids(
     if not movie_ids:
         return {}
 
-    from sqlalchemy import text
-
-    query = text("""
-        SELECT movie_id, sadness_avg, optimism_avg, fear_avg, anger_avg, neutral_avg,
-               worry_avg, love_avg, fun_avg, boredom_avg
-        FROM ratings
-        WHERE movie_id = ANY(:movie_ids)
-    """)
-
-    result = await session.execute(query, {"movie_ids": list(movie_ids)})
+    result = await session.execute(
+        queries.AVG_RATINGS_BY_MOVIES, {"movie_ids": list(movie_ids)}
+    )
 
     out: dict[int, dict[str, float]] = {}
     for row in result.fetchall():
-        movie_id, sadness, optimism, fear, anger, neutral, worry, love, fun, boredom = row
-        out[int(movie_id)] = strip_excluded_emotions({
-            'sadness': float(sadness),
-            'optimism': float(optimism),
-            'fear': float(fear),
-            'anger': float(anger),
-            'neutral': float(neutral),
-            'worry': float(worry),
-            'love': float(love),
-            'fun': float(fun),
-            'boredom': float(boredom),
-        })
+        out[int(row[0])] = strip_excluded_emotions(queries.profile_to_dict(row[1]))
     return out
 
-async def get_movies_by_genre(genre: str, skip: int, limit: int, session: AsyncSession) -> list[Movie]:
-    """Фильмы с тегом genre_* в поле tags, по убыванию рейтинга."""
-    import json
-    from sqlalchemy import text
-
-    tag = genre if genre.startswith("genre_") else f"genre_{genre}"
-    tag_json = json.dumps([tag])
-
-    deliverable = movie_deliverable_sql()
-    id_query = text(f"""
-        SELECT id
-        FROM movies
-        WHERE kinopoisk_id IS NOT NULL
-          AND tags @> CAST(:tag_json AS jsonb)
-          AND {deliverable}
-        ORDER BY rating DESC NULLS LAST
-        LIMIT :limit OFFSET :skip
-    """)
-
-    id_result = await session.execute(
-        id_query,
-        {"tag_json": tag_json, "limit": limit, "skip": skip},
-    )
-    ordered_ids = [row[0] for row in id_result.all()]
-    if not ordered_ids:
-        return []
+async def get_poster_colors(kinopoisk_movie_id: int, session: AsyncSession) -> dict | None:
+    """Сохранённые цвета постеров фильма; None — фильма нет.
 
-    stmt = select(Movie).where(Movie.id.in_(ordered_ids))
-    result = await session.execute(stmt)
-    by_id = {movie.id: movie for movie in result.scalars().all()}
-    return [by_id[movie_id] for movie_id in ordered_ids if movie_id in by_id]
+    Только то, что уже посчитал бэкфилл (python -m app.services.poster_colors):
+    запрос не качает постеры и не пишет в movies. Цвета постера, который ещё
+    не посчитан или сменился, не отдаются — сайт посчитает их сам.
+    """
+    row = (
+        await session.execute(
+            select(Movie.horizontal_poster_url, Movie.vertical_poster_url, Movie.poster_colors)
+            .where(Movie.kinopoisk_id == kinopoisk_movie_id)
+        )
+    ).first()
+    if row is None:
+        return None
 
+    urls = {"horizontal": row.horizontal_poster_url, "vertical": row.vertical_poster_url}
+    current = {
+        kind: entry
+        for kind, entry in (row.poster_colors or {}).items()
+        if urls.get(kind) and (entry or {}).get("source") == urls[kind]
+    }
+    return poster_colors.public_poster_colors(current) or {}
 
-async def get_movies_by_emotion(emotion: str, skip: int, limit: int, session: AsyncSession) -> list[Movie]:
-    """
-    Получить фильмы, отсортированные по рейтингу указанной эмоции (от большего к меньшему).
-    Возвращает только фильмы с рейтингом эмоции > 0.
+
+async def get_movies_by_genre(
+    genre: str,
+    skip: int,
+    limit: int,
+    session: AsyncSession,
+    after: tuple[float, int] | None = None,
+):
+    """Фильмы с тегом genre_* в поле tags, по убыванию рейтинга.
+
+    Один запрос, возвращает строки с колонками карточки и `sort_key`.
+    after=(sort_key, kinopoisk_id) последней карточки — keyset-страница вместо skip.
     """
-    from sqlalchemy import text
+    params = {"tag_json": queries.genre_tag_json(genre), "limit": limit, "skip": skip}
+    if after is not None:
+        params["after_key"], params["after_id"] = after
 
-    if not is_output_emotion(emotion):
-        return []
+    result = await session.execute(queries.MOVIES_BY_GENRE[after is not None], params)
+    return result.all()
 
-    # Словарь для маппинга названий эмоций на колонки в БД
-    emotion_columns = {
-        'sadness': 'sadness_avg',
-        'optimism': 'optimism_avg',
-        'fear': 'fear_avg',
-        'anger': 'anger_avg',
-        'worry': 'worry_avg',
-        'love': 'love_avg',
-        'fun': 'fun_avg',
-        'boredom': 'boredom_avg',
-    }
 
-    if emotion not in emotion_columns:
+async def get_movies_by_emotion(
+    emotion: str,
+    skip: int,
+    limit: int,
+    session: AsyncSession,
+    after: tuple[float, int] | None = None,
+):
+    """
+    Получить фильмы, отсортированные по рейтингу указанной эмоции (от большего к меньшему).
+    Возвращает только фильмы с рейтингом эмоции > 0; формат — как у get_movies_by_genre.
+    """
+    query = queries.MOVIES_BY_EMOTION.get((emotion, after is not None))
+    if query is None:
         return []
 
-    column_name = emotion_columns[emotion]
-
-    deliverable = movie_deliverable_sql("m")
-    id_query = text(f"""
-        SELECT m.id
-        FROM movies m
-        JOIN ratings r ON m.kinopoisk_id = r.movie_id
-        WHERE m.kinopoisk_id IS NOT NULL
-          AND r.{column_name} > 0
-          AND {deliverable}
-        ORDER BY r.{column_name} DESC
-        LIMIT :limit OFFSET :skip
-    """)
-
-    id_result = await session.execute(id_query, {"limit": limit, "skip": skip})
-    ordered_ids = [r[0] for r in id_result.all()]
-    if not ordered_ids:
-        return []
+    params = {"limit": limit, "skip": skip}
+    if after is not None:
+        params["after_key"], params["after_id"] = after
 
-    stmt = select(Movie).where(Movie.id.in_(ordered_ids))
-    result = await session.execute(stmt)
-    by_id = {m.id: m for m in result.scalars().all()}
-    return [by_id[i] for i in ordered_ids if i in by_id]
+    result = await session.execute(query, params)
+    return result.all()
 
 async def add_review(
     kinopoisk_movie_id: int,
@@ -338,9 +349,22 @@ async def add_review(
                 worry_rating = worry_rating, love_rating = love_rating, fun_rating = fun_rating,
                 boredom_rating = boredom_rating)
     session.add(rev)
+    await session.flush()
+    # Вклад отзыва в профиль эмоций фильма — в той же транзакции, за O(1)
+    # (без пересчёта по всем отзывам фильма); заодно получаем число отзывов.
+    sums, counts = review_totals({
+        emotion: getattr(rev, f"{emotion}_rating") for emotion in EMOTIONS
+    })
+    # Отзыв не сдвигает версию каталога (см. app.services.catalogue).
+    await session.execute(queries.SKIP_CATALOGUE_VERSION)
+    profile = await session.execute(
+        queries.ADD_REVIEW_TO_PROFILE,
+        {"movie_id": kinopoisk_movie_id, "sums": sums, "counts": counts},
+    )
+    review_count = int(profile.scalar_one())
     await session.commit()
     await session.refresh(rev)
-    return rev
+    return rev, review_count
 
 # Функции для лайков
 async def add_like(user_id: str, movie_id: int, session: AsyncSession):
@@ -372,6 +396,7 @@ async def add_like(user_id: str, movie_id: int, session: AsyncSession):
 
         await rebuild_user_recommendation_profile(session, user_id)
         await session.commit()
+        mark_user_write(user_id)
         await session.refresh(fav)
     return fav.liked_movies
 
@@ -404,6 +429,7 @@ async def add_dislike(user_id: str, movie_id: int, session: AsyncSession):
 
         await rebuild_user_recommendation_profile(session, user_id)
         await session.commit()
+        mark_user_write(user_id)
         await session.refresh(fav)
     return fav.disliked_movies
 
@@ -424,6 +450,7 @@ async def remove_like(user_id: str, movie_id: int, session: AsyncSession):
 
         await rebuild_user_recommendation_profile(session, user_id)
         await session.commit()
+        mark_user_write(user_id)
         await session.refresh(fav)
     return fav.liked_movies
 
@@ -444,6 +471,7 @@ async def remove_dislike(user_id: str, movie_id: int, session: AsyncSession):
 
         await rebuild_user_recommendation_profile(session, user_id)
         await session.commit()
+        mark_user_write(user_id)
         await session.refresh(fav)
     return fav.disliked_movies
 
@@ -469,6 +497,7 @@ async def clear_likes(user_id: str, session: AsyncSession):
 
         await rebuild_user_recommendation_profile(session, user_id)
         await session.commit()
+        mark_user_write(user_id)
         await session.refresh(fav)
 
     return fav.liked_movies
@@ -486,6 +515,7 @@ async def clear_dislikes(user_id: str, session: AsyncSession):
 
         await rebuild_user_recommendation_profile(session, user_id)
         await session.commit()
+        mark_user_write(user_id)
         await session.refresh(fav)
 
     return fav.disliked_movies
@@ -0,0 +1,113 @@
+"""
+SQL эмоционального профиля фильма (movie_emotion_profiles).
+
+Профиль хранит по каждой эмоции (порядок app.emotions.EMOTIONS) сумму оценок
+> 0 (emotion_sums) и их число (emotion_counts); emotions — средние из них,
+округлённые до 2 знаков (нет оценок — 0), review_count — число отзывов.
+
+- ADD_REVIEW_TO_PROFILE_SQL — новый отзыв прибавляется к суммам одной
+  строкой за O(1), сколько бы отзывов ни было у фильма. ON CONFLICT DO
+  UPDATE берёт блокировку строки и читает последнюю закоммиченную версию,
+  так что параллельные отзывы одного фильма не теряются.
+- profile_aggregate_sql(where) — полный пересчёт из reviews (первичное
+  заполнение, rating/update_all_ratings.py).
+
+Модуль без зависимостей от движка и моделей: его импортирует и
+rating/update_all_ratings.py (psycopg2), поэтому формула одна. В этих
+строках нет bind-параметров, кроме переданных в where, — годятся и для
+text(), и для psycopg2.
+"""
+
+from app.emotions import EMOTIONS
+
+_POSITIONS = range(1, len(EMOTIONS) + 1)
+
+
+def _array(item_at) -> str:
+    return "ARRAY[" + ", ".join(item_at(i) for i in _POSITIONS) + "]"
+
+
+def _average(sum_sql: str, count_sql: str) -> str:
+    return (
+        f"CASE WHEN {count_sql} > 0 "
+        f"THEN ROUND(({sum_sql})::numeric / ({count_sql}), 2)::float8 ELSE 0 END"
+    )
+
+
+def _emotions_from_totals(sum_at, count_at) -> str:
+    """ARRAY средних; sum_at(i) / count_at(i) — SQL суммы и числа оценок эмоции i."""
+    return _array(lambda i: _average(sum_at(i), count_at(i)))
+
+
+def profile_aggregate_sql(where_sql: str = "") -> str:
+    """Пересчёт профилей из reviews для фильмов, подходящих под where_sql (по movie_id)."""
+    sums = ", ".join(f"COALESCE(SUM({e}_rating) FILTER (WHERE {e}_rating > 0), 0)" for e in EMOTIONS)
+    counts = ", ".join(f"COUNT(*) FILTER (WHERE {e}_rating > 0)" for e in EMOTIONS)
+    emotions = _emotions_from_totals(lambda i: f"agg.sums[{i}]", lambda i: f"agg.counts[{i}]")
+    return f"""
+        INSERT INTO movie_emotion_profiles
+            (kinopoisk_id, emotions, emotion_sums, emotion_counts, review_count, updated_at)
+        SELECT agg.movie_id, {emotions}, agg.sums, agg.counts, agg.review_count, now()
+        FROM (
+            SELECT
+                movie_id,
+                ARRAY[{sums}]::bigint[] AS sums,
+                ARRAY[{counts}]::integer[] AS counts,
+                COUNT(*) AS review_count
+            FROM reviews
+            {where_sql}
+            GROUP BY movie_id
+        ) agg
+        ON CONFLICT (kinopoisk_id) DO UPDATE SET
+            emotions = EXCLUDED.emotions,
+            emotion_sums = EXCLUDED.emotion_sums,
+            emotion_counts = EXCLUDED.emotion_counts,
+            review_count = EXCLUDED.review_count,
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+def _review_sum(i: int) -> str:
+    return f"(CAST(:sums AS bigint[]))[{i}]"
+
+
+def _review_count(i: int) -> str:
+    return f"(CAST(:counts AS integer[]))[{i}]"
+
+
+def _total_sum(i: int) -> str:
+    return f"(p.emotion_sums[{i}] + EXCLUDED.emotion_sums[{i}])"
+
+
+def _total_count(i: int) -> str:
+    return f"(p.emotion_counts[{i}] + EXCLUDED.emotion_counts[{i}])"
+
+
+# :movie_id, :sums (bigint[]) и :counts (integer[]) — оценки нового отзыва
+# (см. review_totals). В DO UPDATE p.* — текущая строка профиля, EXCLUDED.* —
+# вклад отзыва.
+ADD_REVIEW_TO_PROFILE_SQL = f"""
+    INSERT INTO movie_emotion_profiles AS p
+        (kinopoisk_id, emotions, emotion_sums, emotion_counts, review_count, updated_at)
+    VALUES (
+        :movie_id,
+        {_emotions_from_totals(_review_sum, _review_count)},
+        CAST(:sums AS bigint[]),
+        CAST(:counts AS integer[]),
+        1,
+        now()
+    )
+    ON CONFLICT (kinopoisk_id) DO UPDATE SET
+        emotions = {_emotions_from_totals(_total_sum, _total_count)},
+        emotion_sums = {_array(_total_sum)},
+        emotion_counts = {_array(_total_count)},
+        review_count = p.review_count + 1,
+        updated_at = now()
+    RETURNING review_count
+"""
+
+
+def review_totals(ratings: dict[str, int | None]) -> tuple[list[int], list[int]]:
+    """(sums, counts) одного отзыва для ADD_REVIEW_TO_PROFILE_SQL; ключи — эмоции."""
+    values = [int(ratings.get(emotion) or 0) for emotion in EMOTIONS]
+    return [v if v > 0 else 0 for v in values], [1 if v > 0 else 0 for v in values]
@@ -0,0 +1,325 @@
+"""
+Реестр SQL-запросов горячих путей CRUD.
+
+Эмоции фильмов читаются из материализованной таблицы movie_emotion_profiles
+(массив средних оценок в порядке app.emotions.EMOTIONS), а не из ratings.
+
+Раньше каждый вызов get_movies_by_genre / get_movies_by_emotion /
+get_avg_emotion_ratings заново собирал text(...) через f-строки (включая
+movie_deliverable_sql()) и делал ленивые `from sqlalchemy import text`.
+Теперь все запросы собираются один раз при импорте, значения передаются
+только через bind-параметры, а варианты по эмоциям — отдельные готовые
+объекты в словарях.
+
+Стабильный текст запроса важен дважды: SQLAlchemy берёт скомпилированный
+SQL из своего кэша, а asyncpg-адаптер держит prepared statement на каждом
+соединении (кэш по тексту SQL, размер — DB_STATEMENT_CACHE_SIZE), так что
+повторные вызовы идут как EXECUTE уже подготовленного запроса.
+
+Микро-бенчмарк сборки запросов (без БД):
+
+    python -m app.crud.queries
+"""
+
+import json
+from functools import lru_cache
+
+from sqlalchemy import Float, func, literal, select, text
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import TextualSelect
+
+from app.crud.emotion_profile_sql import ADD_REVIEW_TO_PROFILE_SQL, profile_aggregate_sql
+from app.emotions import EMOTIONS, emotion_position, is_output_emotion
+from app.models.models import Movie, MovieEmotionProfile
+from app.movie_filters import movie_deliverable_sql
+from app.services.catalogue import SKIP_CATALOGUE_VERSION_SQL
+
+# Эмоция -> позиция в movie_emotion_profiles.emotions (1-based, как в Postgres).
+EMOTION_POSITIONS: dict[str, int] = {emotion: emotion_position(emotion) for emotion in EMOTIONS}
+# Только эмоции, участвующие в выдаче (без neutral, см. app.emotions).
+OUTPUT_EMOTION_POSITIONS: dict[str, int] = {
+    emotion: position
+    for emotion, position in EMOTION_POSITIONS.items()
+    if is_output_emotion(emotion)
+}
+
+AVG_RATINGS_BY_MOVIE: TextClause = text("""
+    SELECT emotions
+    FROM movie_emotion_profiles
+    WHERE kinopoisk_id = :movie_id
+""")
+
+AVG_RATINGS_BY_MOVIES: TextClause = text("""
+    SELECT kinopoisk_id, emotions
+    FROM movie_emotion_profiles
+    WHERE kinopoisk_id = ANY(:movie_ids)
+""")
+
+# Новый отзыв: O(1)-добавка к суммам и счётчикам профиля (см.
+# app.crud.emotion_profile_sql). RETURNING review_count — POST отзыва отдаёт
+# число отзывов без COUNT(*).
+ADD_REVIEW_TO_PROFILE: TextClause = text(ADD_REVIEW_TO_PROFILE_SQL)
+# Перед ADD_REVIEW_TO_PROFILE: профиль меняется, версия каталога — нет.
+SKIP_CATALOGUE_VERSION: TextClause = text(SKIP_CATALOGUE_VERSION_SQL)
+# Первичное заполнение на старте (no-op, если профили уже есть).
+POPULATE_EMOTION_PROFILES_SQL: str = profile_aggregate_sql(
+    "WHERE NOT EXISTS (SELECT 1 FROM movie_emotion_profiles)"
+)
+# Профили, созданные до колонок emotion_sums / emotion_counts: досчитываем
+# суммы из reviews (профиль без отзывов — нули), чтобы O(1)-добавка работала.
+BACKFILL_EMOTION_PROFILE_TOTALS_SQL: str = f"""
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM movie_emotion_profiles WHERE emotion_sums IS NULL) THEN
+            {profile_aggregate_sql(
+                "WHERE movie_id IN (SELECT kinopoisk_id FROM movie_emotion_profiles "
+                "WHERE emotion_sums IS NULL)"
+            )};
+            UPDATE movie_emotion_profiles
+            SET emotion_sums = array_fill(0::bigint, ARRAY[{len(EMOTIONS)}]),
+                emotion_counts = array_fill(0, ARRAY[{len(EMOTIONS)}])
+            WHERE emotion_sums IS NULL;
+        END IF;
+    END $$
+"""
+
+# B-tree на каждую выдаваемую эмоцию: выдача /by-emotion и keyset по
+# (оценка, kinopoisk_id) читают индекс, а не сортируют таблицу.
+EMOTION_PROFILE_INDEX_STATEMENTS: list[str] = [
+    f"CREATE INDEX IF NOT EXISTS movie_emotion_profiles_{emotion}_idx "
+    f"ON movie_emotion_profiles ((emotions[{position}]) DESC, kinopoisk_id DESC) "
+    f"WHERE emotions[{position}] > 0"
+    for emotion, position in OUTPUT_EMOTION_POSITIONS.items()
+]
+
+# Гистограммы оценок: бакет = целая оценка 1..EMOTION_HISTOGRAM_BINS (выше —
+# в последний бакет). Один проход по отзывам фильмов: LATERAL VALUES
+# разворачивает 9 колонок в строки (эмоция, оценка), GROUP BY сворачивает их
+# в счётчики — не больше 9 * EMOTION_HISTOGRAM_BINS строк на фильм, сколько
+# бы отзывов ни было.
+EMOTION_HISTOGRAM_BINS = 10
+_EMOTION_VALUES_SQL = ", ".join(
+    f"('{emotion}', r.{emotion}_rating)" for emotion in EMOTIONS
+)
+EMOTION_HISTOGRAMS_BY_MOVIES: TextClause = text(f"""
+    SELECT
+        r.movie_id,
+        e.emotion,
+        LEAST(e.value, {EMOTION_HISTOGRAM_BINS}) AS bucket,
+        COUNT(*) AS n,
+        SUM(e.value) AS total
+    FROM reviews r
+    CROSS JOIN LATERAL (VALUES {_EMOTION_VALUES_SQL}) AS e(emotion, value)
+    WHERE r.movie_id = ANY(:movie_ids) AND e.value > 0
+    GROUP BY r.movie_id, e.emotion, bucket
+""")
+
+# Колонки карточки фильма: ровно то, что отдаёт _movie_to_response_dict.
+# embedding (~1024 float) и reviews в списочные запросы не тянем.
+CARD_COLUMNS = (
+    Movie.id,
+    Movie.title,
+    Movie.release_year,
+    Movie.duration,
+    Movie.genre,
+    Movie.director,
+    Movie.writers,
+    Movie.actors,
+    Movie.description,
+    Movie.horizontal_poster_url,
+    Movie.vertical_poster_url,
+    Movie.horizontal_poster_public_url,
+    Movie.vertical_poster_public_url,
+    Movie.poster_colors,
+    Movie.country,
+    Movie.rating,
+    Movie.tmdb_id,
+    Movie.kinopoisk_id,
+    Movie.title_foreign,
+    Movie.tags,
+    Movie.total_reviews,
+)
+_CARD_COLUMNS_SQL = ", ".join(f"m.{column.name}" for column in CARD_COLUMNS)
+
+# Ключ сортировки жанровой выдачи. COALESCE вместо NULLS LAST: так порядок
+# (sort_key DESC, kinopoisk_id DESC) сравним row-comparison'ом для keyset
+# и совпадает с индексом movies_deliverable_rating_idx. ::float8 — потому что
+# колонка rating бывает REAL (таблица парсера) и FLOAT (create_all), а
+# параметр курсора всегда float8: с другим типом индекс не подойдёт.
+GENRE_SORT_KEY_SQL = "COALESCE(m.rating, -1)::float8"
+
+# Частичный индекс под жанровую выдачу (создаётся в init_all_databases).
+# Предикат — тот же фрагмент, что в запросах, иначе планировщик его не возьмёт.
+DELIVERABLE_RATING_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS movies_deliverable_rating_idx "
+    "ON movies ((COALESCE(rating, -1)::float8) DESC, kinopoisk_id DESC) "
+    f"WHERE kinopoisk_id IS NOT NULL AND {movie_deliverable_sql()}"
+)
+
+
+def _card_listing(
+    where_sql: str,
+    sort_key_sql: str,
+    *,
+    keyset: bool,
+    join_sql: str = "",
+    id_sql: str = "m.kinopoisk_id",
+):
+    """Один запрос: колонки карточки + sort_key, уже в нужном порядке.
+
+    keyset=True — страница «после (sort_key, kinopoisk_id)» вместо OFFSET:
+    глубокие страницы не сканируют все предыдущие строки. id_sql — колонка
+    kinopoisk_id той таблицы, по чьему индексу идёт сортировка.
+    """
+    after_sql = (
+        f"AND ({sort_key_sql}, {id_sql}) < (:after_key, :after_id)" if keyset else ""
+    )
+    page_sql = "LIMIT :limit" if keyset else "LIMIT :limit OFFSET :skip"
+    return text(f"""
+        SELECT {_CARD_COLUMNS_SQL}, {sort_key_sql} AS sort_key
+        FROM movies m
+        {join_sql}
+        WHERE m.kinopoisk_id IS NOT NULL
+          AND {where_sql}
+          AND {movie_deliverable_sql("m")}
+          {after_sql}
+        ORDER BY sort_key DESC, {id_sql} DESC
+        {page_sql}
+    """).columns(*CARD_COLUMNS, sort_key=Float)
+
+
+MOVIES_BY_GENRE: dict[bool, TextualSelect] = {
+    keyset: _card_listing(
+        "m.tags @> CAST(:tag_json AS jsonb)", GENRE_SORT_KEY_SQL, keyset=keyset
+    )
+    for keyset in (False, True)
+}
+
+MOVIES_BY_EMOTION: dict[tuple[str, bool], TextualSelect] = {
+    (emotion, keyset): _card_listing(
+        f"p.emotions[{position}] > 0",
+        f"p.emotions[{position}]",
+        keyset=keyset,
+        join_sql="JOIN movie_emotion_profiles p ON p.kinopoisk_id = m.kinopoisk_id",
+        id_sql="p.kinopoisk_id",
+    )
+    for emotion, position in OUTPUT_EMOTION_POSITIONS.items()
+    for keyset in (False, True)
+}
+
+USER_EXISTS: TextClause = text("SELECT 1 FROM favorite WHERE user_id = :user_id LIMIT 1")
+
+
+def normalize_genre_tag(genre: str) -> str:
+    return genre if genre.startswith("genre_") else f"genre_{genre}"
+
+
+@lru_cache(maxsize=256)
+def genre_tag_json(genre: str) -> str:
+    """JSON-параметр для `tags @> ...`; жанров немного — кэшируем по slug."""
+    return json.dumps([normalize_genre_tag(genre)])
+
+
+def tags_contain(tag: str):
+    """`movies.tags @> '["tag"]'` с анонимным bind-параметром (индекс movies_tags_gin_idx).
+
+    В отличие от text(":tag") такие условия можно объединять в одном WHERE
+    (например, OR по нескольким жанрам опроса) без конфликта имён параметров.
+    """
+    return Movie.tags.contains([normalize_genre_tag(tag)])
+
+
+def mood_score_expr(mood: str | None):
+    """Оценка эмоции фильма из профиля (0..10), 0 — если профиля/оценки нет.
+
+    Коррелированный подзапрос по PK movie_emotion_profiles — чтение одной
+    строки на кандидата вместо выгрузки всей таблицы в Python.
+    """
+    position = OUTPUT_EMOTION_POSITIONS.get(mood or "")
+    if position is None:
+        return literal(0.0)
+    return func.coalesce(
+        select(MovieEmotionProfile.emotions[position])
+        .where(MovieEmotionProfile.kinopoisk_id == Movie.kinopoisk_id)
+        .scalar_subquery(),
+        literal(0.0),
+    )
+
+
+def mood_exists(mood: str):
+    """WHERE-условие «у фильма есть ненулевая оценка эмоции» (survey/strict mood)."""
+    return mood_score_expr(mood) > 0
+
+
+def profile_to_dict(emotions) -> dict[str, float]:
+    """movie_emotion_profiles.emotions -> {эмоция: среднее}."""
+    return {
+        emotion: float(value or 0)
+        for emotion, value in zip(EMOTIONS, emotions)
+    }
+
+
+def empty_emotion_stats() -> dict[str, dict]:
+    return {
+        emotion: {"count": 0, "sum": 0, "mean": 0.0, "histogram": [0] * EMOTION_HISTOGRAM_BINS}
+        for emotion in EMOTIONS
+    }
+
+
+def emotion_stats_from_rows(rows) -> dict[int, dict[str, dict]]:
+    """Строки EMOTION_HISTOGRAMS_BY_MOVIES -> {movie_id: {эмоция: статистика}}.
+
+    mean округляется до 2 знаков — как в movie_emotion_profiles.
+    """
+    out: dict[int, dict[str, dict]] = {}
+    for movie_id, emotion, bucket, count, total in rows:
+        stats = out.setdefault(int(movie_id), empty_emotion_stats())[emotion]
+        stats["histogram"][int(bucket) - 1] += int(count)
+        stats["count"] += int(count)
+        stats["sum"] += int(total)
+    for per_movie in out.values():
+        for stats in per_movie.values():
+            if stats["count"]:
+                stats["mean"] = round(stats["sum"] / stats["count"], 2)
+    return out
+
+
+def _benchmark(iterations: int = 20_000) -> None:
+    """Сравнение: сборка text() на каждый вызов (как раньше) vs готовый объект."""
+    import timeit
+
+    from sqlalchemy.dialects import postgresql
+
+    dialect = postgresql.dialect()
+
+    def rebuild_each_call():
+        deliverable = movie_deliverable_sql("m")
+        stmt = text(f"""
+            SELECT m.id
+            FROM movies m
+            JOIN ratings r ON m.kinopoisk_id = r.movie_id
+            WHERE m.kinopoisk_id IS NOT NULL
+              AND r.fun_avg > 0
+              AND {deliverable}
+            ORDER BY r.fun_avg DESC
+            LIMIT :limit OFFSET :skip
+        """)
+        return stmt._generate_cache_key()
+
+    def from_registry():
+        return MOVIES_BY_EMOTION["fun", False]._generate_cache_key()
+
+    for name, fn in (("rebuild", rebuild_each_call), ("registry", from_registry)):
+        seconds = timeit.timeit(fn, number=iterations)
+        print(f"{name:>8}: {seconds / iterations * 1e6:8.2f} мкс/вызов")
+
+    # Полная компиляция (то, что происходит при промахе кэша SQLAlchemy).
+    seconds = timeit.timeit(
+        lambda: MOVIES_BY_EMOTION["fun", False].compile(dialect=dialect),
+        number=iterations // 10,
+    )
+    print(f" compile: {seconds / (iterations // 10) * 1e6:8.2f} мкс/вызов")
+
+
+if __name__ == "__main__":
+    _benchmark()
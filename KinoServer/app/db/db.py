@@ -1,6 +1,10 @@
 import ssl
+import time
+from contextlib import asynccontextmanager
 from urllib.parse import urlparse
 
+from fastapi import Request
+
 from sqlalchemy import MetaData
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
@@ -10,6 +14,7 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.orm import DeclarativeBase
 
 from app.config.config_reader import config
+from app.db.pool_metrics import InstrumentedAsyncPool
 
 DATABASE_URL = config.DATABASE_URL
 
@@ -23,6 +28,33 @@ def _asyncpg_connect_args(database_url: str) -> dict:
         return {"ssl": ssl.create_default_context()}
     return {}
 
+
+def _connect_args(database_url: str) -> dict:
+    args = _asyncpg_connect_args(database_url)
+    if "+asyncpg" in database_url:
+        # statement_cache_size — кэш prepared statements в самом asyncpg,
+        # prepared_statement_cache_size — кэш адаптера SQLAlchemy поверх него.
+        # За pgbouncer в transaction-режиме оба нужно выставить в 0.
+        cache_size = int(config.DB_STATEMENT_CACHE_SIZE)
+        args["statement_cache_size"] = cache_size
+        args["prepared_statement_cache_size"] = cache_size
+    return args
+
+
+def _pool_kwargs(database_url: str) -> dict:
+    """Параметры пула из Settings (для sqlite остаются дефолты SQLAlchemy)."""
+    if database_url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": InstrumentedAsyncPool,
+        "pool_size": int(config.DB_POOL_SIZE),
+        "max_overflow": int(config.DB_MAX_OVERFLOW),
+        "pool_timeout": float(config.DB_POOL_TIMEOUT),
+        "pool_recycle": int(config.DB_POOL_RECYCLE),
+        "pool_pre_ping": bool(config.DB_POOL_PRE_PING),
+    }
+
+
 db_metadata = MetaData()
 
 
@@ -41,11 +73,74 @@ class Base(DeclarativeBase):
 
 db_engine = create_async_engine(
     DATABASE_URL,
-    connect_args=_asyncpg_connect_args(DATABASE_URL),
+    connect_args=_connect_args(DATABASE_URL),
+    **_pool_kwargs(DATABASE_URL),
 )
 db_sessionmaker = async_sessionmaker(db_engine, expire_on_commit=False)
 
+# Read-реплика (опционально): тяжёлые векторные сканы и списки фильмов уходят
+# туда, чтобы не конкурировать с лайками/дизлайками на primary. Без
+# READ_DATABASE_URL read-движок — это тот же db_engine.
+READ_DATABASE_URL = (config.READ_DATABASE_URL or "").strip() or None
+
+if READ_DATABASE_URL:
+    db_read_engine = create_async_engine(
+        READ_DATABASE_URL,
+        connect_args=_connect_args(READ_DATABASE_URL),
+        **_pool_kwargs(READ_DATABASE_URL),
+    )
+    db_read_sessionmaker = async_sessionmaker(db_read_engine, expire_on_commit=False)
+else:
+    db_read_engine = db_engine
+    db_read_sessionmaker = db_sessionmaker
+
+
+# read-your-writes: после реакции пользователя его чтения какое-то время идут
+# на primary, пока реплика не догонит. Состояние локально для процесса — при
+# нескольких воркерах окно покрывает запросы, попавшие в тот же воркер.
+_recent_writers: dict[str, float] = {}
+
+
+def mark_user_write(user_id: str | None) -> None:
+    if not user_id or db_read_engine is db_engine:
+        return
+    now = time.monotonic()
+    _recent_writers[user_id] = now + float(config.READ_YOUR_WRITES_SECONDS)
+    # Ленивая чистка, чтобы словарь не рос бесконечно.
+    if len(_recent_writers) > 10_000:
+        for key in [k for k, deadline in _recent_writers.items() if deadline <= now]:
+            del _recent_writers[key]
+
+
+def _must_read_primary(user_id: str | None) -> bool:
+    if db_read_engine is db_engine:
+        return True
+    if not user_id:
+        return False
+    deadline = _recent_writers.get(user_id)
+    if deadline is None:
+        return False
+    if deadline <= time.monotonic():
+        _recent_writers.pop(user_id, None)
+        return False
+    return True
+
 
 async def get_session() -> AsyncSession: # type: ignore
     async with db_sessionmaker() as session:
+        yield session
+
+
+@asynccontextmanager
+async def read_session_for(user_id: str | None):
+    """Read-only сессия: реплика, либо primary сразу после записи этого пользователя."""
+    maker = db_sessionmaker if _must_read_primary(user_id) else db_read_sessionmaker
+    async with maker() as session:
+        yield session
+
+
+async def get_read_session(request: Request) -> AsyncSession: # type: ignore
+    """Dependency для read-only эндпоинтов; user_id берём из path или query."""
+    user_id = request.path_params.get("user_id") or request.query_params.get("user_id")
+    async with read_session_for(user_id) as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Метрики пула соединений SQLAlchemy.
+
+Пул подменяется на InstrumentedAsyncPool (см. app.db.db): он замеряет, сколько
+запрос ждал свободное соединение при checkout. Время ожидания складывается в
+гистограмму с фиксированными бакетами (как у Prometheus), а текущее состояние
+пула (занято/свободно/overflow) читается на лету из самого пула.
+"""
+
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Верхние границы бакетов ожидания, в миллисекундах. Последний бакет — +Inf.
+WAIT_BUCKETS_MS: tuple[float, ...] = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolMetrics:
+    """Гистограмма времени ожидания checkout + счётчики."""
+
+    def __init__(self, buckets_ms: tuple[float, ...] = WAIT_BUCKETS_MS) -> None:
+        self.buckets_ms = buckets_ms
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts = [0] * (len(self.buckets_ms) + 1)
+            self._wait_sum_ms = 0.0
+            self._checkouts = 0
+            self._timeouts = 0
+
+    def observe_wait(self, wait_ms: float, *, timed_out: bool = False) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets_ms, wait_ms)] += 1
+            self._wait_sum_ms += wait_ms
+            if timed_out:
+                self._timeouts += 1
+            else:
+                self._checkouts += 1
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            cumulative = 0
+            histogram: dict[str, int] = {}
+            for bound, count in zip((*self.buckets_ms, float("inf")), self._counts):
+                cumulative += count
+                histogram["+Inf" if bound == float("inf") else f"{bound:g}"] = cumulative
+            data = {
+                "checkouts": self._checkouts,
+                "checkout_timeouts": self._timeouts,
+                "checkout_wait_ms_sum": round(self._wait_sum_ms, 3),
+                "checkout_wait_ms_bucket": histogram,
+            }
+
+        if pool is not None and hasattr(pool, "checkedout"):
+            data.update(
+                {
+                    "pool_size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "idle": pool.checkedin(),
+                    "overflow": pool.overflow(),
+                }
+            )
+        return data
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool, который меряет ожидание свободного соединения.
+
+    У каждого пула (primary / read-реплика) свои метрики: `pool.metrics`.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            self.metrics.observe_wait((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        self.metrics.observe_wait((time.perf_counter() - started) * 1000)
+        return conn
+
+
+def pool_snapshot(engine) -> dict | None:
+    """Метрики пула AsyncEngine (None, если пул не инструментирован, например sqlite)."""
+    pool = engine.sync_engine.pool
+    metrics = getattr(pool, "metrics", None)
+    if metrics is None:
+        return None
+    return metrics.snapshot(pool)
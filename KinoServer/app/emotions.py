@@ -1,5 +1,13 @@
-"""Эмоции, которые хранятся в БД, но не участвуют в выдаче и рекомендациях."""
+"""Эмоции отзывов и те из них, что не участвуют в выдаче и рекомендациях."""
 
+# Все эмоции модели отзывов. Порядок фиксирован: в нём лежат элементы массива
+# movie_emotion_profiles.emotions (emotions[1] = sadness, ... в нумерации Postgres).
+EMOTIONS: tuple[str, ...] = (
+    "sadness", "optimism", "fear", "anger", "neutral",
+    "worry", "love", "fun", "boredom",
+)
+
+# Хранятся в БД, но не участвуют в выдаче и рекомендациях.
 EXCLUDED_OUTPUT_EMOTIONS: frozenset[str] = frozenset({"neutral"})
 
 
@@ -17,3 +25,8 @@ def strip_excluded_emotions(ratings: dict[str, float]) -> dict[str, float]:
 
 def filter_output_emotions(emotions: list[str]) -> list[str]:
     return [emotion for emotion in emotions if is_output_emotion(emotion)]
+
+
+def emotion_position(emotion: str) -> int:
+    """1-based индекс эмоции в movie_emotion_profiles.emotions."""
+    return EMOTIONS.index(emotion) + 1
@@ -1,11 +1,17 @@
 from sqlalchemy import text
 
 from app.db.db import Base, db_engine
+from app.services.event_partitions import (
+    detach_legacy_recommendation_events,
+    ensure_event_partitions,
+    migrate_legacy_recommendation_events,
+)
 
 from .models import (
     EMBEDDING_DIM,
     Favorite,
     Movie,
+    MovieEmotionProfile,
     RecommendationEvent,
     RecommendationSession,
     Review,
@@ -13,17 +19,56 @@ from .models import (
 )
 
 
+# Ключ pg_advisory_lock для миграций схемы (произвольная константа приложения).
+MIGRATION_LOCK_KEY = 0x4B696E6F
+
+
 async def init_all_databases() -> None:
-    """Create all tables for the application models."""
+    """Create all tables for the application models.
+
+    Несколько процессов могут стартовать одновременно: переименования,
+    перенос данных и DROP в миграциях выполняет только один из них, остальные
+    ждут сессионную advisory-блокировку и затем видят уже готовую схему.
+    """
+    async with db_engine.connect() as lock_conn:
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        # Блокировка сессионная — транзакцию не держим открытой.
+        await lock_conn.commit()
+        try:
+            await _migrate_all_databases()
+        finally:
+            await lock_conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY}
+            )
+            await lock_conn.commit()
+
+
+async def _migrate_all_databases() -> None:
+    # app.crud.queries сам импортирует app.models.models — импорт здесь, а не
+    # на уровне модуля, чтобы не было цикла при `import app.crud.queries`.
+    from app.crud.queries import (
+        DELIVERABLE_RATING_INDEX_SQL,
+        BACKFILL_EMOTION_PROFILE_TOTALS_SQL,
+        EMOTION_PROFILE_INDEX_STATEMENTS,
+        POPULATE_EMOTION_PROFILES_SQL,
+    )
+    from app.services.catalogue import CATALOGUE_VERSION_SQL
 
     # ВАЖНО: CREATE EXTENSION vector делается ДО create_all, иначе при первом
     # запуске SQLAlchemy не сможет создать колонки с типом vector(...).
     async with db_engine.begin() as conn:
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
 
+    # recommendation_events теперь секционирована: старую обычную таблицу
+    # убираем с дороги до create_all, а данные переносим после создания секций.
+    await detach_legacy_recommendation_events()
+
     async with db_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    await ensure_event_partitions()
+    await migrate_legacy_recommendation_events()
+
     # 3. Миграция эмбеддингов JSONB -> vector(EMBEDDING_DIM) для существующих БД.
     # На свежей БД create_all уже создал нужные колонки и эти ALTER'ы no-op.
     # На старой БД с колонкой JSONB конвертируем данные через text -> vector.
@@ -142,7 +187,60 @@ async def init_all_databases() -> None:
         "ALTER TABLE movies DROP COLUMN IF EXISTS screenwriter",
         "ALTER TABLE movies ADD COLUMN IF NOT EXISTS title_foreign BOOLEAN NOT NULL DEFAULT FALSE",
         "ALTER TABLE movies ADD COLUMN IF NOT EXISTS tags JSONB NOT NULL DEFAULT '[]'::jsonb",
+        # Старые БД, созданные create_all, хранили tags как json: приводим к jsonb.
+        # Только если колонка ещё не jsonb — ALTER ... TYPE берёт ACCESS EXCLUSIVE
+        # на movies даже как no-op, а эти statements выполняет каждый воркер на старте.
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                  AND table_name = 'movies'
+                  AND column_name = 'tags'
+                  AND data_type <> 'jsonb'
+            ) THEN
+                ALTER TABLE movies ALTER COLUMN tags TYPE jsonb USING tags::jsonb;
+            END IF;
+        END $$
+        """,
+        # jsonb_path_ops: индекс меньше и быстрее стандартного jsonb_ops,
+        # а нам нужен только оператор @> (фильтры по жанрам).
+        (
+            "CREATE INDEX IF NOT EXISTS movies_tags_gin_idx "
+            "ON movies USING GIN (tags jsonb_path_ops)"
+        ),
         "ALTER TABLE movies ADD COLUMN IF NOT EXISTS total_reviews INTEGER NOT NULL DEFAULT 0",
+        # Публичные URL постеров; заполняет парсер и parser/fix_posters.py.
+        "ALTER TABLE movies ADD COLUMN IF NOT EXISTS horizontal_poster_public_url TEXT",
+        "ALTER TABLE movies ADD COLUMN IF NOT EXISTS vertical_poster_public_url TEXT",
+        # Цвета постеров; заполняет python -m app.services.poster_colors.
+        "ALTER TABLE movies ADD COLUMN IF NOT EXISTS poster_colors JSONB",
+        # Жанровая выдача: ORDER BY COALESCE(rating, -1) DESC, kinopoisk_id DESC
+        # + keyset. Частичный индекс только по «выдаваемым» фильмам.
+        DELIVERABLE_RATING_INDEX_SQL,
+        (
+            "CREATE INDEX IF NOT EXISTS ix_recommendation_sessions_expires_at "
+            "ON recommendation_sessions (expires_at)"
+        ),
+        # movie_emotion_profiles: по индексу на каждую выдаваемую эмоцию и
+        # первичное заполнение из reviews (только если таблица пустая).
+        # Версия каталога для ETag: таблица + триггеры на movies /
+        # movie_emotion_profiles / ratings (после CREATE TABLE ratings выше).
+        *CATALOGUE_VERSION_SQL,
+        *EMOTION_PROFILE_INDEX_STATEMENTS,
+        # Отзывы фильма: пересчёт профиля (add_review, инкрементальный
+        # rating/update_all_ratings.py) и keyset-листинг по id DESC.
+        "CREATE INDEX IF NOT EXISTS reviews_movie_id_id_idx ON reviews (movie_id, id)",
+        # Одноколоночный индекс покрыт составным.
+        "DROP INDEX IF EXISTS reviews_movie_id_idx",
+        # Суммы и число оценок профиля: add_review обновляет профиль за O(1).
+        "ALTER TABLE movie_emotion_profiles ADD COLUMN IF NOT EXISTS emotion_sums BIGINT[]",
+        "ALTER TABLE movie_emotion_profiles ADD COLUMN IF NOT EXISTS emotion_counts INTEGER[]",
+        BACKFILL_EMOTION_PROFILE_TOTALS_SQL,
+        "ALTER TABLE movie_emotion_profiles ALTER COLUMN emotion_sums SET NOT NULL",
+        "ALTER TABLE movie_emotion_profiles ALTER COLUMN emotion_counts SET NOT NULL",
+        POPULATE_EMOTION_PROFILES_SQL,
     ]
 
     for statement in optional_statements:
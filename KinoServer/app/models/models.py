@@ -1,7 +1,8 @@
 from datetime import datetime
 
 from app.db.pgvector_compat import Vector
-from sqlalchemy import DateTime, Integer, JSON, String, Float, BigInteger, Boolean
+from sqlalchemy import DateTime, Index, Integer, JSON, String, Float, BigInteger, Boolean
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql import func
@@ -77,13 +78,21 @@ class Movie(Base):
     description: Mapped[str] = mapped_column(String, nullable=True)
     horizontal_poster_url: Mapped[str] = mapped_column(String, nullable=True)
     vertical_poster_url: Mapped[str] = mapped_column(String, nullable=True)
+    # Публичные пути постеров (TMDB -> наш прокси), считаются при загрузке
+    # парсером / parser/fix_posters.py и отдаются API как есть.
+    horizontal_poster_public_url: Mapped[str | None] = mapped_column(String, nullable=True)
+    vertical_poster_public_url: Mapped[str | None] = mapped_column(String, nullable=True)
+    # Доминантный/акцентный цвет постеров (app.services.poster_colors).
+    poster_colors: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
     country: Mapped[str] = mapped_column(String, nullable=True)
     rating: Mapped[float] = mapped_column(Float, nullable=True)
     tmdb_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
     kinopoisk_id: Mapped[int | None] = mapped_column(Integer, unique=True, nullable=True, index=True)
     title_foreign: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # JSONB (а не JSON): фильтры `tags @> '["genre_x"]'` идут по GIN-индексу
+    # movies_tags_gin_idx без приведения колонки JSON -> JSONB.
     tags: Mapped[list[str]] = mapped_column(
-        CoerceMutableList.as_mutable(JSON), nullable=False, default=list
+        CoerceMutableList.as_mutable(JSONB), nullable=False, default=list
     )
     total_reviews: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     embedding: Mapped[list[float] | None] = mapped_column(
@@ -140,7 +149,11 @@ class RecommendationSession(Base):
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
     )
-    expires_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Выставляется при каждой записи (см. app.services.session_store), по нему
+    # фоновый sweeper удаляет протухшие сессии.
+    expires_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), index=True, nullable=True
+    )
 
 
 class UserRecommendationProfile(Base):
@@ -165,13 +178,47 @@ class UserRecommendationProfile(Base):
 
 
 class RecommendationEvent(Base):
+    # Таблица секционирована по месяцам (RANGE по created_at): секции создаёт
+    # и удаляет app.services.event_partitions. Поэтому created_at входит в PK —
+    # Postgres требует, чтобы ключ секционирования был частью уникальных индексов.
     __tablename__ = "recommendation_events"
+    # Индексов ровно столько, сколько нужно аналитике: история пользователя
+    # (user_id, created_at) и популярность фильмов (movie_id, event_type).
+    # Отдельные индексы по session_id/event_type только замедляли вставку show-событий.
+    __table_args__ = (
+        Index("recommendation_events_user_created_idx", "user_id", "created_at"),
+        Index("recommendation_events_movie_type_idx", "movie_id", "event_type"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[str] = mapped_column(String, index=True, nullable=False)
-    session_id: Mapped[str | None] = mapped_column(String, index=True, nullable=True)
-    movie_id: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
-    event_type: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    user_id: Mapped[str] = mapped_column(String, nullable=False)
+    session_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    movie_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    event_type: Mapped[str] = mapped_column(String, nullable=False)
     score: Mapped[float | None] = mapped_column(Float, nullable=True)
     event_metadata: Mapped[dict | None] = mapped_column(JSON, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
\ No newline at end of file
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), primary_key=True, server_default=func.now(), nullable=False
+    )
+
+class MovieEmotionProfile(Base):
+    """Материализованный эмоциональный профиль фильма.
+
+    emotions — средние оценки по отзывам (0 = оценок нет) в порядке
+    app.emotions.EMOTIONS; emotion_sums / emotion_counts — сумма и число
+    оценок > 0 по каждой эмоции, из них выводятся средние. При добавлении
+    отзыва к ним прибавляется его вклад (app.crud.emotion_profile_sql),
+    полный пересчёт из reviews — rating/update_all_ratings.py.
+    """
+
+    __tablename__ = "movie_emotion_profiles"
+
+    kinopoisk_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    emotions: Mapped[list[float]] = mapped_column(ARRAY(Float, dimensions=1), nullable=False)
+    emotion_sums: Mapped[list[int]] = mapped_column(ARRAY(BigInteger, dimensions=1), nullable=False)
+    emotion_counts: Mapped[list[int]] = mapped_column(ARRAY(Integer, dimensions=1), nullable=False)
+    review_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
+    )
@@ -0,0 +1,53 @@
+"""Публичные URL постеров.
+
+Постеры TMDB отдаются через наш прокси /images/tmdb/{size}/{file}
+(app.api.images.tmdb). Перезапись URL — чистая функция от строки, поэтому
+результат кэшируется: в выдаче одни и те же фильмы встречаются постоянно, и
+urlparse на каждую карточку не нужен.
+
+Обычно переписывать ничего не приходится: парсер сохраняет готовые пути в
+movies.*_poster_public_url (то же правило — parser/movie_data.py
+::public_poster_url), а старые строки дозаполняет parser/fix_posters.py.
+Эта функция — запасной путь для строк, где колонка ещё пустая.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from urllib.parse import urlparse
+
+from app.config.config_reader import config
+
+TMDB_IMAGE_HOST = "image.tmdb.org"
+
+
+def _api_prefix() -> str:
+    return (config.PUBLIC_API_PREFIX or "/api").rstrip("/")
+
+
+@lru_cache(maxsize=65536)
+def proxify_tmdb_image_url(url: str | None) -> str | None:
+    """
+    Если url ведёт на image.tmdb.org — переписываем на наш эндпоинт /images/tmdb/...
+    """
+    if not url:
+        return None
+
+    try:
+        parsed = urlparse(url)
+    except Exception:
+        return url
+
+    if parsed.netloc != TMDB_IMAGE_HOST:
+        return url
+
+    parts = (parsed.path or "").strip("/").split("/")
+    if len(parts) < 4:
+        return url
+    if parts[0] != "t" or parts[1] != "p":
+        return url
+
+    size = parts[2]
+    file_path = "/".join(parts[3:])
+    # Стабильный путь для reverse-proxy (настраивается через PUBLIC_API_PREFIX).
+    return f"{_api_prefix()}/images/tmdb/{size}/{file_path}"
@@ -53,6 +53,35 @@ class ReviewResponse(BaseModel):
         orm_mode = True
 
 
+class ReviewCreatedResponse(BaseModel):
+    """Ответ POST отзыва: только созданный отзыв и число отзывов фильма."""
+
+    review: ReviewResponse
+    review_count: int
+
+
+class EmotionStats(BaseModel):
+    """Агрегат ненулевых оценок одной эмоции по отзывам фильма."""
+
+    count: int
+    sum: int
+    mean: float
+    # histogram[i] — число оценок i + 1 (последний бакет — всё, что выше).
+    histogram: list[int]
+
+
+class PosterColors(BaseModel):
+    """Цвета одного постера, `#rrggbb` (null — не удалось посчитать)."""
+
+    dominant: str | None = None
+    accent: str | None = None
+
+
+class MoviePosterColors(BaseModel):
+    horizontal: PosterColors | None = None
+    vertical: PosterColors | None = None
+
+
 class Movie(BaseModel):
     """Публичный id фильма в API = kinopoisk_id (если есть), иначе внутренний id строки.
 
@@ -79,6 +108,8 @@ class Movie(BaseModel):
     title_foreign: bool = False
     tags: list[str] | None = None
     total_reviews: int = 0
+    # Предпосчитанные цвета постеров; null — ещё не посчитаны.
+    poster_colors: MoviePosterColors | None = None
 
     class Config:
         orm_mode = True
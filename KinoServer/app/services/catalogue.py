@@ -0,0 +1,169 @@
+"""
+Версия каталога и HTTP-кэширование каталожных эндпоинтов.
+
+Каталог (фильмы, профили эмоций, ratings) меняется только при загрузке
+фильмов парсером и пересчёте рейтингов. Каждое такое изменение увеличивает
+счётчик в таблице catalogue_version — это делают триггеры на movies /
+movie_emotion_profiles / ratings (CATALOGUE_VERSION_SQL), поэтому парсеру и
+скриптам rating/ ничего дополнительно делать не нужно.
+
+Отзыв, добавленный через API, тоже обновляет профиль эмоций фильма, но
+версию не трогает (SKIP_CATALOGUE_VERSION_SQL в той же транзакции): иначе
+каждый отзыв сбрасывал бы все ETag, кэш ответов и nginx, а все POST отзывов
+вставали бы в очередь на блокировку строки catalogue_version. Средние по
+новым отзывам попадают в кэшируемые ответы со следующим пересчётом
+рейтингов (rating/update_all_ratings.py).
+
+Процесс держит последнюю прочитанную версию в памяти (фоновый опрос раз в
+CATALOGUE_VERSION_POLL_SECONDS). Из неё строятся сильный ETag и
+Last-Modified; запрос с совпавшим If-None-Match получает 304 ещё до
+обработчика — без обращения к БД. If-Modified-Since не проверяется:
+Last-Modified точен до секунды, а версия может смениться дважды за секунду.
+Cache-Control позволяет браузеру и nginx (docker/nginx.conf) кэшировать
+ответы.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+from fastapi import HTTPException, Request
+from sqlalchemy import text
+
+from app.config.config_reader import config
+from app.db.db import db_read_engine
+
+logger = logging.getLogger(__name__)
+
+# Увеличить при изменении формата ответов: иначе клиенты со старым ETag
+# получат 304 на старое представление.
+RESPONSE_FORMAT_VERSION = 2
+
+# Заголовки для ответа 200 кладём в request.state, middleware добавляет их
+# к готовому ответу (обработчики возвращают собственные Response).
+_STATE_ATTR = "catalogue_cache_headers"
+
+# Статементы для init_all_databases.
+CATALOGUE_VERSION_SQL: list[str] = [
+    """
+    CREATE TABLE IF NOT EXISTS catalogue_version (
+        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    "INSERT INTO catalogue_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING",
+    """
+    CREATE OR REPLACE FUNCTION bump_catalogue_version() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF current_setting('kinoserver.skip_catalogue_version', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        UPDATE catalogue_version SET version = version + 1, updated_at = now() WHERE id = 1;
+        RETURN NULL;
+    END
+    $$
+    """,
+    *(
+        statement
+        for table in ("movies", "movie_emotion_profiles", "ratings")
+        for statement in (
+            f"DROP TRIGGER IF EXISTS {table}_bump_catalogue_version ON {table}",
+            # FOR EACH STATEMENT: пачка из тысячи строк — одно увеличение версии.
+            f"CREATE TRIGGER {table}_bump_catalogue_version "
+            f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION bump_catalogue_version()",
+        )
+    ),
+]
+
+
+# Для транзакции, чьи изменения не должны сдвигать версию каталога
+# (профиль эмоций при добавлении отзыва). Действует до конца транзакции.
+SKIP_CATALOGUE_VERSION_SQL = "SELECT set_config('kinoserver.skip_catalogue_version', 'on', true)"
+
+
+@dataclass
+class CatalogueVersion:
+    version: int | None = None
+    updated_at: datetime | None = None
+
+    @property
+    def etag(self) -> str:
+        return f'"c{RESPONSE_FORMAT_VERSION}-{self.version}"'
+
+    def headers(self) -> dict[str, str]:
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={int(config.CATALOGUE_CACHE_MAX_AGE_SECONDS)}",
+        }
+        if self.updated_at is not None:
+            headers["Last-Modified"] = format_datetime(
+                self.updated_at.astimezone(timezone.utc).replace(microsecond=0), usegmt=True
+            )
+        return headers
+
+
+current = CatalogueVersion()
+
+
+async def refresh_catalogue_version() -> CatalogueVersion:
+    """Читает версию из БД.
+
+    Читаем с того же движка, что и каталожные эндпоинты (read-реплика, если
+    есть): тогда данные на нём уже не старше версии и под новым ETag никогда
+    не окажется старое содержимое.
+    """
+    async with db_read_engine.connect() as conn:
+        row = (
+            await conn.execute(text("SELECT version, updated_at FROM catalogue_version WHERE id = 1"))
+        ).first()
+    if row is not None:
+        current.version, current.updated_at = int(row.version), row.updated_at
+    return current
+
+
+async def catalogue_version_loop() -> None:
+    """Фоновая задача для startup."""
+    interval = max(1.0, float(config.CATALOGUE_VERSION_POLL_SECONDS))
+    while True:
+        try:
+            await refresh_catalogue_version()
+        except Exception:
+            logger.warning("catalogue_version: не удалось прочитать версию", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Слабое сравнение (RFC 9110): W/"x" совпадает с "x" — nginx при gzip
+    # ослабляет ETag.
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+async def catalogue_cache(request: Request) -> None:
+    """Зависимость каталожных эндпоинтов: 304 по версии каталога без похода в БД."""
+    if current.version is None:
+        # Версия ещё не прочитана (или БД недоступна) — отдаём без кэширования.
+        return
+
+    headers = current.headers()
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, current.etag):
+        raise HTTPException(status_code=304, headers=headers)
+    setattr(request.state, _STATE_ATTR, headers)
+
+
+async def catalogue_cache_headers_middleware(request: Request, call_next):
+    """Добавляет ETag / Last-Modified / Cache-Control к успешным каталожным ответам."""
+    response = await call_next(request)
+    headers = getattr(request.state, _STATE_ATTR, None)
+    if headers and response.status_code == 200:
+        for name, value in headers.items():
+            response.headers.setdefault(name, value)
+    return response
@@ -0,0 +1,309 @@
+"""
+Помесячные секции `recommendation_events` и retention.
+
+Таблица объявлена как PARTITION BY RANGE (created_at) (см.
+models.RecommendationEvent). Каждая секция — отдельная таблица
+`recommendation_events_pYYYYMM` со своими (небольшими) индексами, поэтому
+стоимость вставки и VACUUM не растёт вместе с историей, а старые месяцы
+удаляются целиком через DROP/DETACH, без DELETE по миллионам строк.
+
+Модуль можно запускать как разовую задачу (cron):
+
+    python -m app.services.event_partitions
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+from app.config.config_reader import config
+from app.db.db import db_engine
+
+logger = logging.getLogger(__name__)
+
+EVENTS_TABLE = "recommendation_events"
+LEGACY_EVENTS_TABLE = "recommendation_events_legacy"
+DEFAULT_PARTITION = "recommendation_events_default"
+PARTITION_PREFIX = "recommendation_events_p"
+ARCHIVE_PREFIX = "recommendation_events_archive_"
+
+# Колонки, которые переносим из старой несекционированной таблицы и из DEFAULT-секции.
+_EVENT_COLUMNS = (
+    "id, user_id, session_id, movie_id, event_type, score, event_metadata, created_at"
+)
+
+
+def _current_month() -> date:
+    now = datetime.now(timezone.utc)
+    return date(now.year, now.month, 1)
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + (month.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def _partition_month(name: str) -> date | None:
+    """recommendation_events_p202601 -> date(2026, 1, 1); чужие имена -> None."""
+    if not name.startswith(PARTITION_PREFIX):
+        return None
+    suffix = name[len(PARTITION_PREFIX):]
+    if len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+async def _table_state(table_name: str) -> str | None:
+    """'partitioned' / 'plain' / None (таблицы нет)."""
+    async with db_engine.connect() as conn:
+        row = (
+            await conn.execute(
+                text("""
+                    SELECT c.relkind = 'p'
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.relname = :name AND n.nspname = current_schema()
+                """),
+                {"name": table_name},
+            )
+        ).first()
+    if row is None:
+        return None
+    return "partitioned" if row[0] else "plain"
+
+
+async def detach_legacy_recommendation_events() -> bool:
+    """Старую (несекционированную) таблицу переименовываем перед create_all.
+
+    Имя PK-констрейнта тоже переименовываем: имена индексов в схеме общие, и
+    create_all не смог бы создать `recommendation_events_pkey` для новой таблицы.
+    Данные переносит migrate_legacy_recommendation_events() после create_all.
+    """
+    if await _table_state(EVENTS_TABLE) != "plain":
+        return False
+
+    async with db_engine.begin() as conn:
+        await conn.execute(text(f"ALTER TABLE {EVENTS_TABLE} RENAME TO {LEGACY_EVENTS_TABLE}"))
+        await conn.execute(
+            text(
+                f"ALTER TABLE {LEGACY_EVENTS_TABLE} "
+                f"RENAME CONSTRAINT {EVENTS_TABLE}_pkey TO {LEGACY_EVENTS_TABLE}_pkey"
+            )
+        )
+    logger.info("recommendation_events: старая таблица переименована в %s", LEGACY_EVENTS_TABLE)
+    return True
+
+
+async def ensure_event_partitions(
+    since: date | None = None,
+    months_ahead: int | None = None,
+) -> list[str]:
+    """Создаёт секции с месяца `since` (по умолчанию — текущего) и на months_ahead вперёд.
+
+    DEFAULT-секция ловит строки, для которых секция ещё не создана (например,
+    если фоновое обслуживание не запускалось) — вставка никогда не падает.
+    Если в DEFAULT уже лежат строки месяца, секция создаётся через
+    _create_partition_from_default() — строки переезжают в неё.
+    """
+    if months_ahead is None:
+        months_ahead = int(config.RECOMMENDATION_EVENTS_PARTITIONS_AHEAD)
+
+    current = _current_month()
+    month = since or current
+    last = _add_months(current, max(0, months_ahead))
+
+    statements: list[tuple[str, str]] = [
+        (
+            DEFAULT_PARTITION,
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+            f"PARTITION OF {EVENTS_TABLE} DEFAULT",
+        )
+    ]
+    months: dict[str, date] = {}
+    while month <= last:
+        name = partition_name(month)
+        statements.append((name, _create_partition_sql(month)))
+        months[name] = month
+        month = _add_months(month, 1)
+
+    created: list[str] = []
+    for name, statement in statements:
+        try:
+            async with db_engine.begin() as conn:
+                await conn.execute(text(statement))
+            created.append(name)
+            continue
+        except Exception:
+            if name not in months:
+                logger.error("recommendation_events: не удалось создать секцию %s", name, exc_info=True)
+                continue
+        # Чаще всего: в DEFAULT-секции уже лежат строки этого месяца.
+        try:
+            moved = await _create_partition_from_default(months[name])
+        except Exception:
+            logger.error("recommendation_events: не удалось создать секцию %s", name, exc_info=True)
+            continue
+        logger.info("recommendation_events: секция %s создана, из DEFAULT перенесено %s строк", name, moved)
+        created.append(name)
+    return created
+
+
+def _create_partition_sql(month: date) -> str:
+    upper = _add_months(month, 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {EVENTS_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+        f"TO ('{upper.isoformat()} 00:00:00+00')"
+    )
+
+
+async def _create_partition_from_default(month: date) -> int:
+    """Создаёт секцию месяца, перенося его строки из DEFAULT-секции.
+
+    Пока в DEFAULT есть строки месяца, Postgres не даёт создать его секцию.
+    Одной транзакцией: DEFAULT отсоединяется, секция создаётся, строки
+    месяца переезжают в неё, DEFAULT присоединяется обратно. Вставки в
+    recommendation_events на это время ждут блокировку таблицы.
+    """
+    lower = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    upper_month = _add_months(month, 1)
+    upper = datetime(upper_month.year, upper_month.month, 1, tzinfo=timezone.utc)
+    async with db_engine.begin() as conn:
+        await conn.execute(text(f"ALTER TABLE {EVENTS_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+        await conn.execute(text(_create_partition_sql(month)))
+        result = await conn.execute(
+            text(f"""
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION}
+                    WHERE created_at >= :lower AND created_at < :upper
+                    RETURNING {_EVENT_COLUMNS}
+                )
+                INSERT INTO {EVENTS_TABLE} ({_EVENT_COLUMNS})
+                SELECT {_EVENT_COLUMNS} FROM moved
+            """),
+            {"lower": lower, "upper": upper},
+        )
+        await conn.execute(
+            text(f"ALTER TABLE {EVENTS_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+        )
+    return result.rowcount or 0
+
+
+async def migrate_legacy_recommendation_events() -> int:
+    """Переносит события из recommendation_events_legacy в секционированную таблицу."""
+    if await _table_state(LEGACY_EVENTS_TABLE) is None:
+        return 0
+
+    async with db_engine.connect() as conn:
+        oldest = await conn.scalar(text(f"SELECT MIN(created_at) FROM {LEGACY_EVENTS_TABLE}"))
+
+    if oldest is not None:
+        await ensure_event_partitions(since=date(oldest.year, oldest.month, 1))
+
+    async with db_engine.begin() as conn:
+        result = await conn.execute(
+            text(
+                f"INSERT INTO {EVENTS_TABLE} ({_EVENT_COLUMNS}) "
+                f"SELECT {_EVENT_COLUMNS} FROM {LEGACY_EVENTS_TABLE}"
+            )
+        )
+        moved = result.rowcount or 0
+        await conn.execute(
+            text(f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{EVENTS_TABLE}', 'id'),
+                    COALESCE((SELECT MAX(id) FROM {EVENTS_TABLE}), 0) + 1,
+                    false
+                )
+            """)
+        )
+        await conn.execute(text(f"DROP TABLE {LEGACY_EVENTS_TABLE}"))
+
+    logger.info("recommendation_events: перенесено %s событий из старой таблицы", moved)
+    return moved
+
+
+async def apply_event_retention(
+    retention_months: int | None = None,
+    archive: bool | None = None,
+) -> list[str]:
+    """Удаляет (или отсоединяет в архив) секции старше retention_months месяцев."""
+    if retention_months is None:
+        retention_months = int(config.RECOMMENDATION_EVENTS_RETENTION_MONTHS)
+    if archive is None:
+        archive = bool(config.RECOMMENDATION_EVENTS_ARCHIVE)
+    if retention_months <= 0:
+        return []
+
+    cutoff = _add_months(_current_month(), -retention_months)
+
+    async with db_engine.connect() as conn:
+        names = (
+            await conn.execute(
+                text("""
+                    SELECT child.relname
+                    FROM pg_inherits i
+                    JOIN pg_class child ON child.oid = i.inhrelid
+                    JOIN pg_class parent ON parent.oid = i.inhparent
+                    JOIN pg_namespace n ON n.oid = parent.relnamespace
+                    WHERE parent.relname = :parent AND n.nspname = current_schema()
+                """),
+                {"parent": EVENTS_TABLE},
+            )
+        ).scalars().all()
+
+    expired = sorted(
+        name for name in names
+        if (month := _partition_month(name)) is not None and month < cutoff
+    )
+
+    for name in expired:
+        async with db_engine.begin() as conn:
+            if archive:
+                archive_name = ARCHIVE_PREFIX + name[len(PARTITION_PREFIX):]
+                await conn.execute(text(f"ALTER TABLE {EVENTS_TABLE} DETACH PARTITION {name}"))
+                await conn.execute(text(f"ALTER TABLE {name} RENAME TO {archive_name}"))
+            else:
+                await conn.execute(text(f"DROP TABLE {name}"))
+
+    # В DEFAULT-секцию строки попадают только при сбое обслуживания — там обычный DELETE.
+    async with db_engine.begin() as conn:
+        await conn.execute(
+            text(f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff"),
+            {"cutoff": datetime(cutoff.year, cutoff.month, 1, tzinfo=timezone.utc)},
+        )
+
+    if expired:
+        logger.info(
+            "recommendation_events: %s секций %s",
+            len(expired),
+            "отправлено в архив" if archive else "удалено",
+        )
+    return expired
+
+
+async def run_event_partition_maintenance() -> None:
+    """Один проход обслуживания: секции вперёд + retention."""
+    await ensure_event_partitions()
+    await apply_event_retention()
+
+
+async def event_partition_maintenance_loop() -> None:
+    """Фоновая задача для startup: обслуживание раз в N секунд."""
+    interval = max(60, int(config.RECOMMENDATION_EVENTS_MAINTENANCE_INTERVAL_SECONDS))
+    while True:
+        try:
+            await run_event_partition_maintenance()
+        except Exception:
+            logger.exception("recommendation_events: ошибка обслуживания секций")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_event_partition_maintenance())
@@ -0,0 +1,302 @@
+"""
+Индекс дискового кэша картинок.
+
+Раньше после каждого промаха кэш обходился целиком: glob + stat каждого
+файла + сортировка по mtime, т.е. O(N log N) на одно скачивание (десятки
+тысяч stat'ов при кэше постеров на 1 ГБ). Теперь состояние кэша живёт в
+памяти: OrderedDict в порядке последнего обращения + суммарный размер.
+
+- Индекс строится один раз на startup, до приёма запросов (load в потоке),
+  одним проходом по каталогу, порядок — по mtime файлов. Запросы на event
+  loop каталог не обходят: пока индекс не построен, lookup — промах.
+- Попадание — move_to_end, O(1). Вставка — O(1) амортизированно: пока кэш
+  больше лимита, удаляем самый давно использованный файл.
+- TTL проверяется при обращении к записи и в фоновой компактации
+  (compaction_loop): она же подбирает файлы, скачанные другими воркерами
+  uvicorn, забывает удалённые и сохраняет время доступа в mtime, чтобы
+  после рестарта порядок LRU не терялся.
+
+Бенчмарк промаха на 50k файлов в кэше (старый обход каталога vs индекс):
+
+    python -m app.services.image_cache
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from app.config.config_reader import config
+
+logger = logging.getLogger(__name__)
+
+# Незавершённые скачивания (см. app.services.image_upstream.UpstreamDownload).
+TMP_SUFFIX = ".tmp"
+
+
+@dataclass
+class CacheEntry:
+    size: int
+    created_at: float
+    accessed_at: float
+    # Время доступа ещё не записано в mtime файла.
+    dirty: bool = False
+
+
+class ImageCacheIndex:
+    """LRU-индекс файлов одного каталога кэша с лимитом размера и TTL."""
+
+    def __init__(self, root: Path | str, max_bytes: int, max_age_seconds: float = 0) -> None:
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age_seconds = max(0.0, float(max_age_seconds))
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def path_for(self, name: str) -> Path:
+        return self.root / name
+
+    def _scan(self) -> list[tuple[str, int, float]]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        files: list[tuple[str, int, float]] = []
+        with os.scandir(self.root) as it:
+            for item in it:
+                if item.name.endswith(TMP_SUFFIX):
+                    continue
+                try:
+                    if not item.is_file():
+                        continue
+                    st = item.stat()
+                except OSError:
+                    continue
+                files.append((item.name, int(st.st_size), float(st.st_mtime)))
+        files.sort(key=lambda x: x[2])  # старые -> новые
+        return files
+
+    def load(self) -> None:
+        """Один проход по каталогу (на startup, в потоке).
+
+        Записи, добавленные через add() во время обхода, не теряются: они
+        остаются в индексе как самые свежие.
+        """
+        files = self._scan()
+        with self._lock:
+            entries: OrderedDict[str, CacheEntry] = OrderedDict(
+                (name, CacheEntry(size=size, created_at=mtime, accessed_at=mtime))
+                for name, size, mtime in files
+            )
+            for name, entry in self._entries.items():
+                entries.pop(name, None)
+                entries[name] = entry
+            self._entries = entries
+            self._total_bytes = sum(entry.size for entry in entries.values())
+            self._loaded = True
+            evicted = self._evict_over_limit()
+        self._unlink(evicted)
+
+    def _is_expired(self, entry: CacheEntry, now: float) -> bool:
+        return bool(self.max_age_seconds) and now - entry.created_at > self.max_age_seconds
+
+    def _remove(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _evict_over_limit(self, reserve: int = 0) -> list[str]:
+        evicted: list[str] = []
+        while self._total_bytes + reserve > self.max_bytes and self._entries:
+            name, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            evicted.append(name)
+        return evicted
+
+    def _unlink(self, names: list[str]) -> None:
+        for name in names:
+            try:
+                self.path_for(name).unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def lookup(self, name: str) -> Path | None:
+        """Путь к файлу из кэша (и отметка доступа) или None — промах."""
+        now = time.time()
+        expired = False
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if self._is_expired(entry, now):
+                self._remove(name)
+                expired = True
+            else:
+                entry.accessed_at = now
+                entry.dirty = True
+                self._entries.move_to_end(name)
+        if expired:
+            self._unlink([name])
+            return None
+
+        path = self.path_for(name)
+        if not path.exists():
+            # Файл удалил другой воркер (его индекс вытеснил запись).
+            with self._lock:
+                self._remove(name)
+            return None
+        return path
+
+    def add(self, name: str, size: int | None = None) -> None:
+        """Регистрирует только что записанный файл и вытесняет лишнее."""
+        if size is None:
+            try:
+                size = self.path_for(name).stat().st_size
+            except OSError:
+                return
+        size = int(size)
+        now = time.time()
+        with self._lock:
+            self._remove(name)
+            # Место освобождаем до вставки: сам новый файл не вытесняется,
+            # даже если он один больше лимита.
+            evicted = self._evict_over_limit(reserve=size)
+            self._entries[name] = CacheEntry(size=size, created_at=now, accessed_at=now)
+            self._total_bytes += size
+        self._unlink(evicted)
+
+    def compact(self) -> dict[str, int]:
+        """Сверка индекса с диском: TTL, чужие/пропавшие файлы, mtime = время доступа."""
+        if not self._loaded:
+            self.load()
+            return {"removed": 0, "adopted": 0, "forgotten": 0}
+
+        scan_started = time.time()
+        on_disk = {name: (size, mtime) for name, size, mtime in self._scan()}
+        now = time.time()
+        expired: list[str] = []
+        to_touch: list[tuple[str, float]] = []
+        adopted = forgotten = 0
+
+        with self._lock:
+            for name, entry in list(self._entries.items()):
+                # Файлы, добавленные во время обхода, в снимок могли не попасть.
+                if name not in on_disk and entry.created_at < scan_started:
+                    self._remove(name)
+                    forgotten += 1
+            for name, (size, mtime) in on_disk.items():
+                if name not in self._entries:
+                    # Файлы, скачанные другими воркерами, — в конец LRU как
+                    # самые свежие: их скачали после прошлой компактации.
+                    self._entries[name] = CacheEntry(size=size, created_at=mtime, accessed_at=mtime)
+                    self._total_bytes += size
+                    adopted += 1
+            for name, entry in list(self._entries.items()):
+                if self._is_expired(entry, now):
+                    self._remove(name)
+                    expired.append(name)
+                elif entry.dirty:
+                    entry.dirty = False
+                    to_touch.append((name, entry.accessed_at))
+            evicted = self._evict_over_limit()
+
+        self._unlink(expired + evicted)
+        for name, accessed_at in to_touch:
+            try:
+                os.utime(self.path_for(name), (accessed_at, accessed_at))
+            except OSError:
+                pass
+        return {"removed": len(expired) + len(evicted), "adopted": adopted, "forgotten": forgotten}
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# Общий кэш /images/tmdb и /images/proxy (один каталог и один лимит).
+tmdb_image_cache = ImageCacheIndex(
+    root=config.TMDB_IMAGE_CACHE_DIR,
+    max_bytes=config.TMDB_IMAGE_CACHE_MAX_BYTES,
+    max_age_seconds=max(0, int(config.TMDB_IMAGE_CACHE_MAX_AGE_DAYS)) * 86400,
+)
+
+
+async def compaction_loop(index: ImageCacheIndex = tmdb_image_cache) -> None:
+    """Фоновая задача для startup: периодическая компактация (индекс уже построен)."""
+    from anyio import to_thread
+
+    interval = max(10.0, float(config.IMAGE_CACHE_COMPACT_INTERVAL_SECONDS))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stats = await to_thread.run_sync(index.compact)
+            if any(stats.values()):
+                logger.info("image cache %s: компактация %s", index.root, stats)
+        except Exception:
+            logger.exception("image cache %s: ошибка компактации", index.root)
+
+
+def _benchmark(files: int = 50_000, misses: int = 20) -> None:
+    """Промах кэша при `files` файлах: обход каталога (как раньше) vs индекс."""
+    import tempfile
+    import timeit
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        for i in range(files):
+            (root / f"{i:08d}.jpg").write_bytes(b"x" * 100)
+        max_bytes = files * 100  # кэш заполнен до лимита
+
+        def directory_scan() -> None:
+            # Старый _cleanup_cache_if_needed: glob + stat + sort на каждый промах.
+            entries = []
+            total = 0
+            for p in root.glob("*"):
+                if not p.is_file():
+                    continue
+                st = p.stat()
+                entries.append((p, st.st_size, st.st_mtime))
+                total += st.st_size
+            if total <= max_bytes:
+                return
+            entries.sort(key=lambda x: x[2])
+            for p, size, _ in entries:
+                if total <= max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= size
+
+        counter = iter(range(10**9))
+
+        def new_file() -> str:
+            name = f"new-{next(counter)}.jpg"
+            (root / name).write_bytes(b"x" * 100)
+            return name
+
+        scan_seconds = timeit.timeit(lambda: (new_file(), directory_scan()), number=misses)
+
+        index = ImageCacheIndex(root, max_bytes=max_bytes)
+        load_seconds = timeit.timeit(index.load, number=1)
+        index_seconds = timeit.timeit(lambda: index.add(new_file(), 100), number=misses)
+
+    print(f"файлов в кэше: {files}")
+    print(f"  обход каталога: {scan_seconds / misses * 1e3:9.3f} мс/промах")
+    print(f"  индекс:         {index_seconds / misses * 1e3:9.3f} мс/промах")
+    print(f"  построение индекса (один раз): {load_seconds * 1e3:.1f} мс")
+
+
+if __name__ == "__main__":
+    _benchmark()
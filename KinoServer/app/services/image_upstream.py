@@ -0,0 +1,311 @@
+"""
+Асинхронные скачивания картинок с внешних хостов (TMDB, kinopoiskapiunofficial).
+
+Раньше каждая картинка качалась через urllib.urlopen в потоке anyio — новое
+TCP/TLS-соединение на картинку, — а /images/proxy отвечал только после
+полной загрузки тела. Теперь:
+
+- один httpx.AsyncClient на процесс: keep-alive пул, соединения с каждым
+  хостом переиспользуются между запросами;
+- с одного хоста одновременно качается не больше
+  IMAGE_UPSTREAM_MAX_CONCURRENCY_PER_HOST картинок, остальные ждут;
+- UpstreamDownload качает тело в фоновой задаче и раздаёт чанки всем
+  подписчикам по мере прихода, одновременно (tee) записывая их во временный
+  файл кэша. После успешного завершения файл атомарно переносится в кэш.
+  В памяти держится только последний MEMORY_TAIL_BYTES тела: отставшие и
+  поздно подключившиеся подписчики дочитывают начало из файла.
+  Отключение клиента загрузку не прерывает — файл в кэш всё равно попадает.
+- DownloadTable — идущие загрузки по ключу (single-flight): повторный запрос
+  той же картинки подписывается на идущую загрузку. Запись удаляется, как
+  только загрузка завершилась, а размер таблицы ограничен
+  IMAGE_UPSTREAM_MAX_INFLIGHT — при переполнении новые промахи получают 503.
+"""
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import AsyncIterator, Callable
+from urllib.parse import urlparse
+
+import httpx
+from anyio import to_thread
+from fastapi import HTTPException
+
+from app.config.config_reader import config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Хвост тела в памяти для подписчиков, идущих вровень с загрузкой.
+MEMORY_TAIL_BYTES = 4 * CHUNK_SIZE
+
+_client: httpx.AsyncClient | None = None
+# Хосты ограничены ALLOWED_PROXY_HOSTS и TMDB_IMAGE_BASE_URL, словарь не растёт.
+_host_limits: dict[str, asyncio.Semaphore] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Общий клиент процесса (создаётся при первом скачивании)."""
+    global _client
+    if _client is None or _client.is_closed:
+        per_host = max(1, int(config.IMAGE_UPSTREAM_MAX_CONCURRENCY_PER_HOST))
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(config.IMAGE_UPSTREAM_TIMEOUT_SECONDS), connect=5.0),
+            # Число одновременных соединений ограничивают семафоры хостов.
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=per_host * 4,
+                keepalive_expiry=60.0,
+            ),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Для shutdown: закрываем соединения пула."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _host_limit(url: str) -> asyncio.Semaphore:
+    host = urlparse(url).netloc
+    sem = _host_limits.get(host)
+    if sem is None:
+        sem = asyncio.Semaphore(max(1, int(config.IMAGE_UPSTREAM_MAX_CONCURRENCY_PER_HOST)))
+        _host_limits[host] = sem
+    return sem
+
+
+def _write_through(file, chunk: bytes) -> None:
+    # Сразу в ОС: опубликованные байты должны читаться из файла.
+    file.write(chunk)
+    file.flush()
+
+
+class UpstreamDownload:
+    """
+    Одна загрузка картинки, на которую могут подписаться несколько запросов.
+
+    dest_path=None — без записи на диск (только раздача клиентам).
+    on_stored(path, size) вызывается после переноса файла в кэш.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        dest_path: Path | None = None,
+        max_bytes: int,
+        user_agent: str,
+        source: str = "Источник",
+        on_stored: Callable[[Path, int], None] | None = None,
+    ) -> None:
+        self.url = url
+        self.dest_path = dest_path
+        self.max_bytes = int(max_bytes)
+        self.user_agent = user_agent
+        self.source = source
+        self.on_stored = on_stored
+        self.content_type: str | None = None
+        # Статус ответа источника (клиенту любая ошибка источника отдаётся как 404).
+        self.upstream_status: int | None = None
+        self.task: asyncio.Task | None = None
+        # Хвост тела: self._tail[0] — байт с номером self._tail_start.
+        self._tail = bytearray()
+        self._tail_start = 0
+        self._received = 0
+        self._tmp_path: Path | None = None
+        self._done = False
+        self._error: HTTPException | None = None
+        self._ready = asyncio.Event()
+        self._cond = asyncio.Condition()
+
+    def start(self) -> "UpstreamDownload":
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def wait_ready(self) -> None:
+        """Ждёт заголовков ответа; ошибка до отправки тела — HTTPException."""
+        await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    async def wait_done(self) -> None:
+        """Ждёт окончания загрузки (файл уже в кэше); ошибка — HTTPException."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._done)
+        if self._error is not None:
+            raise self._error
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """Тело с самого начала; подписчик может подключиться в любой момент."""
+        sent = 0
+        fd: int | None = None
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: sent < self._received or self._done)
+                    tail_start = self._tail_start
+                    behind = sent < tail_start
+                    batch = b"" if behind else bytes(self._tail[sent - tail_start:])
+                    failed = self._done and self._error is not None
+                if behind:
+                    # Начало уже вытеснено из памяти — читаем из файла.
+                    if fd is None:
+                        fd = await to_thread.run_sync(self._open_written)
+                    size = min(tail_start - sent, MEMORY_TAIL_BYTES)
+                    batch = await to_thread.run_sync(os.pread, fd, size, sent)
+                    if not batch:
+                        raise self._error or HTTPException(
+                            status_code=502, detail="Не удалось скачать изображение"
+                        )
+                if batch:
+                    sent += len(batch)
+                    yield batch
+                    continue
+                if failed:
+                    # Статус уже отправлен — остаётся оборвать ответ.
+                    raise self._error
+                return
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _open_written(self) -> int:
+        """Файл с уже записанным телом: временный, а после переноса — в кэше."""
+        for path in (self._tmp_path, self.dest_path):
+            if path is None:
+                continue
+            try:
+                return os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+        raise self._error or HTTPException(
+            status_code=502, detail="Не удалось скачать изображение"
+        )
+
+    async def _publish(self, chunk: bytes) -> None:
+        async with self._cond:
+            self._tail += chunk
+            self._received += len(chunk)
+            # Без файла (dest_path=None) тело целиком в памяти, его ограничивает max_bytes.
+            excess = len(self._tail) - MEMORY_TAIL_BYTES
+            if self._tmp_path is not None and excess > 0:
+                del self._tail[:excess]
+                self._tail_start += excess
+            self._cond.notify_all()
+
+    async def _run(self) -> None:
+        tmp_path: Path | None = None
+        file = None
+        try:
+            async with _host_limit(self.url):
+                async with get_client().stream(
+                    "GET",
+                    self.url,
+                    headers={"User-Agent": self.user_agent, "Accept": "image/*,*/*;q=0.8"},
+                ) as resp:
+                    self.upstream_status = resp.status_code
+                    if resp.status_code >= 400:
+                        raise HTTPException(
+                            status_code=404,
+                            detail=f"{self.source} вернул ошибку: {resp.status_code}",
+                        )
+                    length = resp.headers.get("content-length", "")
+                    if length.isdigit() and int(length) > self.max_bytes:
+                        raise HTTPException(status_code=413, detail="Файл слишком большой")
+                    self.content_type = resp.headers.get("content-type")
+
+                    if self.dest_path is not None:
+                        self.dest_path.parent.mkdir(parents=True, exist_ok=True)
+                        # pid в имени: тот же файл может качать другой воркер.
+                        tmp_path = self.dest_path.with_name(
+                            f"{self.dest_path.name}.{os.getpid()}.tmp"
+                        )
+                        file = await to_thread.run_sync(open, tmp_path, "wb")
+                        self._tmp_path = tmp_path
+                    self._ready.set()
+
+                    received = 0
+                    async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                        received += len(chunk)
+                        if received > self.max_bytes:
+                            raise HTTPException(status_code=413, detail="Файл слишком большой")
+                        if file is not None:
+                            await to_thread.run_sync(_write_through, file, chunk)
+                        await self._publish(chunk)
+
+            if file is not None:
+                await to_thread.run_sync(file.close)
+                file = None
+                # Атомарная замена: читатели кэша никогда не видят недописанный файл.
+                await to_thread.run_sync(os.replace, tmp_path, self.dest_path)
+                tmp_path = None
+                if self.on_stored is not None:
+                    self.on_stored(self.dest_path, received)
+        except HTTPException as e:
+            self._error = e
+        except httpx.HTTPError as e:
+            logger.warning("image upstream: %s: %r", self.url, e)
+            self._error = HTTPException(
+                status_code=502, detail="Не удалось скачать изображение (ошибка сети)"
+            )
+        except asyncio.CancelledError:
+            self._error = HTTPException(status_code=503, detail="Сервер останавливается")
+            raise
+        except Exception:
+            logger.exception("image upstream: %s", self.url)
+            self._error = HTTPException(status_code=502, detail="Не удалось скачать изображение")
+        finally:
+            if file is not None:
+                file.close()
+            if tmp_path is not None:
+                try:
+                    tmp_path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+            self._ready.set()
+            async with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+
+class DownloadTable:
+    """Ограниченная и самоочищающаяся таблица идущих загрузок (single-flight)."""
+
+    def __init__(self, max_inflight: int) -> None:
+        self.max_inflight = max(1, int(max_inflight))
+        self._inflight: dict[str, UpstreamDownload] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def start(self, key: str, make: Callable[[], UpstreamDownload]) -> UpstreamDownload:
+        """Идущая загрузка по ключу или новая, созданная make()."""
+        download = self._inflight.get(key)
+        if download is not None:
+            return download
+        if len(self._inflight) >= self.max_inflight:
+            # Загрузки сверх лимита всё равно ждали бы семафоров хостов.
+            raise HTTPException(
+                status_code=503,
+                detail="Слишком много одновременных загрузок картинок",
+                headers={"Retry-After": "1"},
+            )
+
+        download = make()
+        self._inflight[key] = download
+
+        def _forget(_task: asyncio.Task) -> None:
+            if self._inflight.get(key) is download:
+                del self._inflight[key]
+
+        download.start().task.add_done_callback(_forget)
+        return download
+
+
+downloads = DownloadTable(config.IMAGE_UPSTREAM_MAX_INFLIGHT)
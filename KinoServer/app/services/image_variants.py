@@ -0,0 +1,173 @@
+"""
+Уменьшенные WebP/AVIF/JPEG-варианты постеров.
+
+/images/tmdb и /images/proxy с параметром `w` отдают не исходный файл, а
+вариант нужной ширины: ширина округляется вверх до корзины WIDTH_BUCKETS (чтобы
+вариантов было конечное число), формат выбирается по заголовку Accept
+(AVIF, если сборка OpenCV умеет его писать, затем WebP, иначе JPEG).
+Мобильная карточка получает ~30 КБ вместо полноразмерного постера Кинопоиска.
+
+Варианты лежат в том же дисковом кэше (app.services.image_cache), что и
+оригиналы, и вытесняются по тому же LRU. Декодирование и кодирование —
+CPU-работа на десятки миллисекунд, поэтому она идёт в пуле процессов
+(IMAGE_VARIANT_WORKERS) и не держит ни event loop, ни GIL. Одновременные
+запросы одного варианта ждут одну задачу кодирования.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable
+
+from app.config.config_reader import config
+
+logger = logging.getLogger(__name__)
+
+WIDTH_BUCKETS = (160, 240, 320, 480, 640, 960, 1280)
+
+# формат -> (расширение файла в кэше, media type)
+FORMATS: dict[str, tuple[str, str]] = {
+    "avif": (".avif", "image/avif"),
+    "webp": (".webp", "image/webp"),
+    "jpeg": (".jpg", "image/jpeg"),
+}
+
+_pool: ProcessPoolExecutor | None = None
+# Идущие кодирования по имени файла варианта; запись удаляется по завершении.
+_rendering: dict[str, asyncio.Future] = {}
+
+
+def width_bucket(width: int) -> int:
+    for bucket in WIDTH_BUCKETS:
+        if width <= bucket:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+
+@lru_cache(maxsize=1)
+def avif_supported() -> bool:
+    try:
+        import cv2
+    except ImportError:
+        return False
+    return hasattr(cv2, "IMWRITE_AVIF_QUALITY") and cv2.haveImageWriter(".avif")
+
+
+def negotiate_format(accept: str | None) -> str:
+    """Формат варианта по Accept; без подходящего — JPEG (понимают все)."""
+    accepted: set[str] = set()
+    for item in (accept or "").lower().split(","):
+        media_type, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q=") and quality[2:].strip() in {"0", "0.0", "0.00", "0.000"}:
+            continue
+        accepted.add(media_type.strip())
+    if "image/avif" in accepted and avif_supported():
+        return "avif"
+    if "image/webp" in accepted:
+        return "webp"
+    return "jpeg"
+
+
+def variant_path(source_path: Path, width: int, fmt: str) -> Path:
+    """Имя варианта в кэше: <имя оригинала>-<ширина>w.<формат>."""
+    return source_path.with_name(f"{source_path.stem}-{width}w{FORMATS[fmt][0]}")
+
+
+def render_variant_file(source: str, dest: str, width: int, fmt: str, quality: int) -> int:
+    """Выполняется в процессе пула: оригинал -> вариант на диске. Возвращает размер."""
+    import cv2
+
+    image = cv2.imread(source, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"не удалось декодировать {source}")
+    height, current = image.shape[:2]
+    if current > width:
+        # INTER_AREA — без муара при уменьшении; увеличивать не будем.
+        image = cv2.resize(
+            image, (width, max(1, round(height * width / current))), interpolation=cv2.INTER_AREA
+        )
+
+    if fmt == "avif":
+        params = [cv2.IMWRITE_AVIF_QUALITY, quality]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    ok, buf = cv2.imencode(FORMATS[fmt][0], image, params)
+    if not ok:
+        raise ValueError(f"не удалось закодировать {fmt}")
+
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, dest)
+    return int(buf.size)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # forkserver, а не fork: в родителе уже работают потоки и event loop.
+        # Процессы форкаются от чистого сервера с уже импортированным модулем.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, int(config.IMAGE_VARIANT_WORKERS)),
+            mp_context=context,
+        )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    """Для shutdown приложения."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _quality(fmt: str) -> int:
+    if fmt == "jpeg":
+        return int(config.IMAGE_VARIANT_JPEG_QUALITY)
+    return int(config.IMAGE_VARIANT_WEBP_QUALITY)
+
+
+async def render_variant(
+    source_path: Path,
+    dest_path: Path,
+    width: int,
+    fmt: str,
+    on_stored: Callable[[Path, int], None],
+) -> None:
+    """Кодирует вариант в пуле процессов (одна задача на вариант)."""
+    key = dest_path.name
+    future = _rendering.get(key)
+    if future is None:
+        if len(_rendering) >= max(1, int(config.IMAGE_UPSTREAM_MAX_INFLIGHT)):
+            raise RuntimeError("очередь кодирования вариантов переполнена")
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            _get_pool(),
+            render_variant_file,
+            str(source_path),
+            str(dest_path),
+            width,
+            fmt,
+            _quality(fmt),
+        )
+        _rendering[key] = future
+
+        def _stored(done: asyncio.Future) -> None:
+            if _rendering.get(key) is done:
+                del _rendering[key]
+            if not done.cancelled() and done.exception() is None:
+                on_stored(dest_path, done.result())
+
+        future.add_done_callback(_stored)
+    # shield: отключение клиента не отменяет кодирование для остальных.
+    await asyncio.shield(future)
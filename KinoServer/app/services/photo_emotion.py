@@ -0,0 +1,184 @@
+"""
+Пул потоков для /movies/emotion-from-photo.
+
+Раньше анализ шёл через общий объект FaceFoundAnalyse, который хранил лица
+и путь к фото в своих полях: два одновременных запроса могли прочитать лица
+друг друга. Теперь анализ без состояния (face_recognition.analyze_photo_bytes),
+а запросы выполняются параллельно в пуле из PHOTO_EMOTION_WORKERS потоков
+(0 — по числу ядер). OpenCV и torch отпускают GIL, так что потоки
+действительно работают параллельно; каскад и YOLO у каждого потока свои и
+загружаются один раз. Ядра делятся между потоками пула
+(set_intra_op_threads): иначе каждый инференс torch занимал бы все ядра, и
+потоков вычислений было бы workers × ядер. Формат модели (PyTorch, ONNX, OpenVINO) —
+PHOTO_EMOTION_MODEL_FORMAT. Сессии ONNX Runtime и OpenVINO сами занимают все
+ядра, а число их потоков ultralytics задать не даёт, поэтому для этих
+форматов пул — один поток, независимо от PHOTO_EMOTION_WORKERS.
+
+Очередь ограничена PHOTO_EMOTION_MAX_PENDING запросами на процесс (вместе с
+выполняющимися): сверх неё — 503, как у загрузок картинок. Счётчик
+уменьшает сама задача пула, когда анализ закончился: отмена запроса не
+останавливает уже идущий анализ, и место в очереди он занимает до конца.
+
+Загрузка читается read_photo_upload без UploadFile-параметра FastAPI: тот
+сначала целиком разбирает форму и сбрасывает файлы больше 1 МБ во временный
+файл на диске. Здесь тело читается потоком с лимитом
+PHOTO_EMOTION_MAX_UPLOAD_BYTES (413 сразу по Content-Length или как только
+лимит превышен по ходу чтения), а файл формы остаётся в памяти.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from app.config.config_reader import config
+
+logger = logging.getLogger(__name__)
+
+# Запас на заголовки и границы multipart сверх самого файла.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+_pool: ThreadPoolExecutor | None = None
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def workers() -> int:
+    if config.PHOTO_EMOTION_MODEL_FORMAT != "pt":
+        # Сессия ONNX Runtime / OpenVINO сама занимает все ядра, а задать ей
+        # число потоков через ultralytics нельзя.
+        return 1
+    return max(1, int(config.PHOTO_EMOTION_WORKERS) or os.cpu_count() or 1)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        from face_recognition.face_recognition import set_intra_op_threads, set_model_format
+
+        set_model_format(config.PHOTO_EMOTION_MODEL_FORMAT)
+        if workers() == 1 and int(config.PHOTO_EMOTION_WORKERS) != 1:
+            logger.info(
+                "photo emotion: формат %s — пул из одного потока (PHOTO_EMOTION_WORKERS не действует)",
+                config.PHOTO_EMOTION_MODEL_FORMAT,
+            )
+        set_intra_op_threads(max(1, (os.cpu_count() or 1) // workers()))
+        _pool = ThreadPoolExecutor(max_workers=workers(), thread_name_prefix="photo-emotion")
+    return _pool
+
+
+def shutdown_pool() -> None:
+    """Для shutdown приложения."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _release() -> None:
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def _analyze_counted(data: bytes) -> dict | None:
+    from face_recognition.face_recognition import analyze_photo_bytes
+
+    try:
+        return analyze_photo_bytes(data)
+    finally:
+        _release()
+
+
+def _released_if_cancelled(job: Future) -> None:
+    # Отменить можно только ещё не начатую задачу — её finally не выполнится.
+    if job.cancelled():
+        _release()
+
+
+async def analyze_photo(data: bytes) -> dict | None:
+    """Эмоция по байтам фото (см. face_recognition.analyze_photo_bytes)."""
+    global _pending
+    with _pending_lock:
+        if _pending >= max(1, int(config.PHOTO_EMOTION_MAX_PENDING)):
+            raise HTTPException(
+                status_code=503,
+                detail="Слишком много фото в обработке, попробуйте позже",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+
+    try:
+        job = _get_pool().submit(_analyze_counted, data)
+    except BaseException:
+        _release()
+        raise
+    job.add_done_callback(_released_if_cancelled)
+    return await asyncio.wrap_future(job)
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Фото больше {max_bytes // 1_000_000} МБ",
+    )
+
+
+async def _limited(stream: AsyncIterator[bytes], limit: int, max_bytes: int) -> AsyncIterator[bytes]:
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > limit:
+            raise _too_large(max_bytes)
+        yield chunk
+
+
+class _InMemoryMultiPartParser(MultiPartParser):
+    """MultiPartParser, у которого файл формы не сбрасывается на диск."""
+
+    def __init__(self, *args, spool_max_size: int, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.spool_max_size = spool_max_size
+
+
+async def read_photo_upload(request: Request, field: str = "file") -> bytes:
+    """Байты фото из multipart-поля field с лимитом размера, без временных файлов."""
+    max_bytes = int(config.PHOTO_EMOTION_MAX_UPLOAD_BYTES)
+    limit = max_bytes + MULTIPART_OVERHEAD_BYTES
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Нужно загрузить изображение")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise _too_large(max_bytes)
+
+    parser = _InMemoryMultiPartParser(
+        request.headers,
+        _limited(request.stream(), limit, max_bytes),
+        max_files=1,
+        max_fields=10,
+        spool_max_size=limit,
+    )
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+    try:
+        upload = form.get(field)
+        if not isinstance(upload, UploadFile) or not (upload.content_type or "").startswith("image/"):
+            raise HTTPException(status_code=400, detail="Нужно загрузить изображение")
+        data = await upload.read()
+    finally:
+        await form.close()
+
+    if not data:
+        raise HTTPException(status_code=400, detail="Файл пустой")
+    if len(data) > max_bytes:
+        raise _too_large(max_bytes)
+    return data
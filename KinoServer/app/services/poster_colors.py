@@ -0,0 +1,285 @@
+"""
+Доминантный и акцентный цвет постеров (темизация карточек на сайте).
+
+Раньше сайт качал каждый постер через /images/proxy только для того, чтобы
+rgbaster посчитал цвет в браузере: двойной трафик картинок и заметная
+задержка отрисовки карточки на слабых телефонах. Теперь цвета считаются
+один раз на сервере и хранятся в movies.poster_colors (JSONB):
+
+    {"horizontal": {"dominant": "#1f2a3b", "accent": "#c0392b", "source": <url>},
+     "vertical":   {...}}
+
+source — исходный URL постера: если парсер поменял постер, цвета считаются
+заново. Карточки отдают поле poster_colors (без source), отдельный
+эндпоинт — GET /movies/{id}/poster-colors.
+
+Расчёт: картинка декодируется сразу уменьшенной (IMREAD_REDUCED_COLOR_4),
+ужимается до COLOR_SAMPLE_SIZE по длинной стороне, затем векторно в NumPy:
+цвета квантуются до 4 бит на канал, np.bincount даёт гистограмму на 4096
+корзин. Доминантный — средний цвет самой частой корзины (почти белые
+пиксели не учитываем, как `ignore: ['rgb(255,255,255)']` у rgbaster на
+сайте); акцентный — частая насыщенная корзина, заметно отличная от
+доминантной.
+
+Массовое заполнение (cron / после загрузки фильмов):
+
+    python -m app.services.poster_colors [--limit N] [--force]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from urllib.parse import urlparse
+
+import numpy as np
+from anyio import to_thread
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from app.config.config_reader import config
+from app.db.db import db_engine
+from app.services.image_upstream import UpstreamDownload
+
+logger = logging.getLogger(__name__)
+
+POSTER_KINDS = ("horizontal", "vertical")
+
+# Длинная сторона картинки для гистограммы: больше не нужно для цвета.
+COLOR_SAMPLE_SIZE = 64
+# TMDB отдаёт любой из размеров — для цвета берём маленький.
+TMDB_COLOR_SIZE = "w185"
+# Сколько фильмов обновлять одним UPDATE при заполнении.
+BACKFILL_BATCH_SIZE = 100
+
+_QUANT_SHIFT = 4
+_BINS = 1 << (3 * (8 - _QUANT_SHIFT))
+
+
+def _hex(rgb) -> str:
+    r, g, b = (int(round(float(c))) for c in rgb)
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def colors_from_pixels(rgb: np.ndarray) -> dict[str, str] | None:
+    """Цвета по массиву пикселей (..., 3) uint8 в RGB."""
+    pixels = rgb.reshape(-1, 3).astype(np.int32)
+    if not len(pixels):
+        return None
+
+    not_white = (pixels < 250).any(axis=1)
+    if not_white.any():
+        pixels = pixels[not_white]
+
+    bins = (
+        (pixels[:, 0] >> _QUANT_SHIFT) << (2 * (8 - _QUANT_SHIFT))
+        | (pixels[:, 1] >> _QUANT_SHIFT) << (8 - _QUANT_SHIFT)
+        | (pixels[:, 2] >> _QUANT_SHIFT)
+    )
+    counts = np.bincount(bins, minlength=_BINS)
+    used = counts > 0
+    means = np.zeros((_BINS, 3))
+    for channel in range(3):
+        means[used, channel] = (
+            np.bincount(bins, weights=pixels[:, channel], minlength=_BINS)[used] / counts[used]
+        )
+
+    dominant_bin = int(counts.argmax())
+    dominant = means[dominant_bin]
+
+    high = means.max(axis=1)
+    low = means.min(axis=1)
+    saturation = np.where(high > 0, (high - low) / np.maximum(high, 1), 0)
+    distance = np.linalg.norm(means - dominant, axis=1)
+    candidates = used & (saturation >= 0.35) & (high >= 60) & (distance >= 60)
+    if candidates.any():
+        score = np.where(candidates, counts * saturation, -1)
+        accent = means[int(score.argmax())]
+    else:
+        accent = dominant
+
+    return {"dominant": _hex(dominant), "accent": _hex(accent)}
+
+
+def extract_colors(data: bytes) -> dict[str, str] | None:
+    """Цвета по байтам картинки; None — не удалось декодировать."""
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = COLOR_SAMPLE_SIZE / max(height, width)
+    if scale < 1:
+        image = cv2.resize(
+            image,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+    return colors_from_pixels(image[..., ::-1])
+
+
+def _color_source_url(url: str) -> str:
+    """Для TMDB качаем маленький вариант постера вместо original."""
+    parsed = urlparse(url)
+    parts = parsed.path.strip("/").split("/")
+    if parsed.netloc == "image.tmdb.org" and len(parts) >= 4 and parts[:2] == ["t", "p"]:
+        parts[2] = TMDB_COLOR_SIZE
+        return parsed._replace(path="/" + "/".join(parts)).geturl()
+    return url
+
+
+# Ответы источника, после которых постер считаем отсутствующим (не временная ошибка).
+MISSING_POSTER_STATUSES = (404, 410)
+
+
+async def _fetch(url: str) -> bytes | None:
+    """Байты постера; None — источник ответил, что постера нет (404/410)."""
+    download = UpstreamDownload(
+        _color_source_url(url),
+        max_bytes=config.TMDB_IMAGE_CACHE_MAX_FILE_BYTES,
+        user_agent="KinoServer/1.0 (poster colors)",
+    ).start()
+    try:
+        await download.wait_ready()
+    except HTTPException:
+        if download.upstream_status in MISSING_POSTER_STATUSES:
+            return None
+        raise
+    return b"".join([chunk async for chunk in download.iter_chunks()])
+
+
+async def colors_for_url(url: str) -> dict | None:
+    """Запись для movies.poster_colors[kind].
+
+    Постера нет (404) или он не декодируется — запись с цветами null (и
+    source), чтобы не качать его при каждом прогоне. Временная ошибка
+    (сеть, 5xx, таймаут, остановка сервера) — None: запись не сохраняется,
+    следующий прогон попробует снова.
+    """
+    try:
+        data = await _fetch(url)
+        colors = None if data is None else await to_thread.run_sync(extract_colors, data)
+    except HTTPException as e:
+        logger.warning("poster colors: %s: %s", url, e.detail)
+        return None
+    except Exception:
+        logger.exception("poster colors: %s", url)
+        return None
+    return {
+        "dominant": colors and colors["dominant"],
+        "accent": colors and colors["accent"],
+        "source": url,
+    }
+
+
+async def compute_poster_colors(stored: dict | None, urls: dict[str, str | None]) -> dict:
+    """Новое значение movies.poster_colors: пересчитываем только устаревшие постеры.
+
+    Постер с временной ошибкой в результат не попадает и остаётся устаревшим.
+    """
+    stored = stored or {}
+    out: dict = {}
+    for kind in POSTER_KINDS:
+        url = urls.get(kind)
+        if not url:
+            continue
+        previous = stored.get(kind) or {}
+        entry = previous if previous.get("source") == url else await colors_for_url(url)
+        if entry is not None:
+            out[kind] = entry
+    return out
+
+
+def public_poster_colors(value: dict | None) -> dict | None:
+    """Поле poster_colors для ответа API (без source)."""
+    if not value:
+        return None
+    out = {
+        kind: {"dominant": entry.get("dominant"), "accent": entry.get("accent")}
+        for kind in POSTER_KINDS
+        if (entry := value.get(kind))
+    }
+    return out or None
+
+
+# Одним UPDATE на пачку: триггер версии каталога срабатывает раз на пачку.
+UPDATE_POSTER_COLORS_SQL = text("""
+    UPDATE movies AS m
+    SET poster_colors = CAST(v.colors AS jsonb)
+    FROM unnest(CAST(:ids AS integer[]), CAST(:colors AS text[])) AS v(kinopoisk_id, colors)
+    WHERE m.kinopoisk_id = v.kinopoisk_id
+""")
+
+_STALE_MOVIES_SQL = """
+    SELECT kinopoisk_id, horizontal_poster_url, vertical_poster_url, poster_colors
+    FROM movies
+    WHERE kinopoisk_id > :after_id
+      AND (horizontal_poster_url IS NOT NULL OR vertical_poster_url IS NOT NULL)
+      {stale}
+    ORDER BY kinopoisk_id
+    LIMIT :limit
+"""
+_STALE_FILTER_SQL = """
+      AND (
+        poster_colors IS NULL
+        OR (horizontal_poster_url IS NOT NULL
+            AND poster_colors #>> '{horizontal,source}' IS DISTINCT FROM horizontal_poster_url)
+        OR (vertical_poster_url IS NOT NULL
+            AND poster_colors #>> '{vertical,source}' IS DISTINCT FROM vertical_poster_url)
+      )
+"""
+
+
+async def backfill_poster_colors(limit: int | None = None, force: bool = False) -> int:
+    """Заполняет movies.poster_colors пачками (keyset по kinopoisk_id). Возвращает число фильмов."""
+    select_sql = text(_STALE_MOVIES_SQL.format(stale="" if force else _STALE_FILTER_SQL))
+    after_id = 0
+    updated = 0
+    while limit is None or updated < limit:
+        batch_size = BACKFILL_BATCH_SIZE if limit is None else min(BACKFILL_BATCH_SIZE, limit - updated)
+        async with db_engine.connect() as conn:
+            rows = (
+                await conn.execute(select_sql, {"after_id": after_id, "limit": batch_size})
+            ).all()
+        if not rows:
+            break
+        after_id = rows[-1].kinopoisk_id
+
+        async def one(row) -> str:
+            urls = {"horizontal": row.horizontal_poster_url, "vertical": row.vertical_poster_url}
+            stored = None if force else row.poster_colors
+            return json.dumps(await compute_poster_colors(stored, urls))
+
+        # Параллелизм ограничивают семафоры хостов в image_upstream.
+        colors = await asyncio.gather(*(one(row) for row in rows))
+        async with db_engine.begin() as conn:
+            await conn.execute(
+                UPDATE_POSTER_COLORS_SQL,
+                {"ids": [row.kinopoisk_id for row in rows], "colors": list(colors)},
+            )
+        updated += len(rows)
+        logger.info("poster colors: обновлено %s (до kinopoisk_id=%s)", updated, after_id)
+    return updated
+
+
+async def _main(limit: int | None, force: bool) -> None:
+    from app.services.image_upstream import close_client
+
+    try:
+        updated = await backfill_poster_colors(limit=limit, force=force)
+    finally:
+        await close_client()
+        await db_engine.dispose()
+    print(f"Цвета постеров посчитаны для {updated} фильмов")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Посчитать цвета постеров фильмов.")
+    parser.add_argument("--limit", type=int, default=None, help="Не больше N фильмов за прогон")
+    parser.add_argument(
+        "--force", action="store_true", help="Пересчитать все фильмы, а не только новые постеры"
+    )
+    args = parser.parse_args()
+    asyncio.run(_main(args.limit, args.force))
@@ -0,0 +1,273 @@
+"""
+Прогрев дискового кэша постеров после загрузки фильмов.
+
+Без прогрева первый пользователь, открывший карточку, ждёт холодное
+скачивание постера с TMDB/Кинопоиска (и перекодирование варианта). Задача
+проходит по выдаваемым фильмам — по рейтингу или по популярности в
+recommendation_events — и запрашивает у запущенного KinoServer те же URL
+постеров, что и сайт:
+
+- десктоп: горизонтальный постер TMDB (/images/tmdb/...);
+- мобильный: вариант вертикального постера (`?w=`, см.
+  app.services.image_variants) для каждой ширины из --widths и каждого
+  Accept из --accept.
+
+Запросы идут через сам сервер, поэтому работают его single-flight, лимиты
+на хост, пул перекодирования и учёт размера кэша. Чтобы прогрев не вытеснял
+горячие записи, перед каждой пачкой проверяется заполненность кэша
+(GET /metrics/image-cache): выше --max-fill от TMDB_IMAGE_CACHE_MAX_BYTES
+задача останавливается.
+
+Прогресс (последняя пройденная позиция) сохраняется в --state после каждой
+пачки: повторный запуск продолжает с того же места, --reset — с начала.
+
+    python -m app.services.poster_warmup --order popularity --limit 2000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+import httpx
+from sqlalchemy import text
+
+from app.config.config_reader import config
+from app.db.db import db_read_engine
+from app.movie_filters import movie_deliverable_sql
+from app.posters import proxify_tmdb_image_url
+from app.services.image_variants import WIDTH_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+WARMUP_BATCH_SIZE = 50
+# Популярность — показы и лайки за последние дни.
+POPULARITY_DAYS = 30
+
+# Порядок обхода: (sort_key, kinopoisk_id) по убыванию. Список id небольшой
+# (десятки тысяч int), поэтому читаем его целиком, а постеры — пачками.
+ORDER_SQL: dict[str, str] = {
+    "rating": f"""
+        SELECT COALESCE(m.rating, -1)::float8 AS sort_key, m.kinopoisk_id
+        FROM movies m
+        WHERE m.kinopoisk_id IS NOT NULL AND {movie_deliverable_sql("m")}
+        ORDER BY sort_key DESC, m.kinopoisk_id DESC
+    """,
+    "popularity": f"""
+        WITH popularity AS (
+            SELECT movie_id, COUNT(*)::float8 AS score
+            FROM recommendation_events
+            WHERE created_at >= now() - make_interval(days => :days)
+              AND event_type IN ('show', 'like')
+              AND movie_id IS NOT NULL
+            GROUP BY movie_id
+        )
+        SELECT COALESCE(p.score, 0) AS sort_key, m.kinopoisk_id
+        FROM movies m
+        LEFT JOIN popularity p ON p.movie_id = m.kinopoisk_id
+        WHERE m.kinopoisk_id IS NOT NULL AND {movie_deliverable_sql("m")}
+        ORDER BY sort_key DESC, m.kinopoisk_id DESC
+    """,
+}
+
+POSTERS_SQL = text("""
+    SELECT kinopoisk_id,
+           horizontal_poster_url, horizontal_poster_public_url,
+           vertical_poster_url, vertical_poster_public_url
+    FROM movies
+    WHERE kinopoisk_id = ANY(:ids)
+""")
+
+
+def _server_path(public_url: str | None) -> str | None:
+    """Публичный путь /api/images/... -> путь на самом сервере (без префикса)."""
+    if not public_url:
+        return None
+    prefix = (config.PUBLIC_API_PREFIX or "/api").rstrip("/")
+    if public_url.startswith(prefix + "/images/"):
+        return public_url[len(prefix):]
+    if public_url.startswith("/images/"):
+        return public_url
+    return None
+
+
+def poster_requests(row, widths: list[int]) -> list[tuple[str, dict]]:
+    """(путь, query-параметры), которые запросит сайт для карточки фильма."""
+    out: list[tuple[str, dict]] = []
+
+    horizontal = row.horizontal_poster_public_url or proxify_tmdb_image_url(row.horizontal_poster_url)
+    path = _server_path(horizontal)
+    if path:
+        out.append((path, {}))
+
+    vertical = row.vertical_poster_public_url or proxify_tmdb_image_url(row.vertical_poster_url)
+    path = _server_path(vertical)
+    for width in widths:
+        if path:
+            out.append((path, {"w": width}))
+        elif vertical and vertical.startswith("https://kinopoiskapiunofficial.tech/"):
+            out.append(("/images/proxy", {"url": vertical, "w": width}))
+    return out
+
+
+def _load_state(path: Path, order: str) -> dict | None:
+    try:
+        return json.loads(path.read_text(encoding="utf-8")).get(order)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(path: Path, order: str, state: dict | None) -> None:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        data = {}
+    data[order] = state
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    tmp.replace(path)
+
+
+async def _cache_fill(client: httpx.AsyncClient) -> float:
+    snapshot = (await client.get("/metrics/image-cache")).raise_for_status().json()
+    return snapshot["total_bytes"] / max(1, snapshot["max_bytes"])
+
+
+async def warm_posters(
+    api_url: str,
+    *,
+    order: str = "rating",
+    limit: int | None = None,
+    widths: list[int],
+    accepts: list[str],
+    concurrency: int = 4,
+    max_fill: float = 0.8,
+    state_path: Path,
+    reset: bool = False,
+) -> dict:
+    """Прогревает кэш; возвращает счётчики прогона."""
+    async with db_read_engine.connect() as conn:
+        params = {"days": POPULARITY_DAYS} if order == "popularity" else {}
+        ordered = (await conn.execute(text(ORDER_SQL[order]), params)).all()
+
+    state = None if reset else _load_state(state_path, order)
+    if state is not None:
+        after = (state["sort_key"], state["kinopoisk_id"])
+        # Порядок по убыванию: продолжаем с первой позиции «после» сохранённой.
+        ordered = [row for row in ordered if (row.sort_key, row.kinopoisk_id) < after]
+    if limit is not None:
+        ordered = ordered[:limit]
+
+    stats = {"movies": 0, "requests": 0, "failed": 0, "stopped_by_budget": False}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async with httpx.AsyncClient(base_url=api_url.rstrip("/"), timeout=60.0) as client:
+
+        async def fetch(path: str, params: dict, accept: str) -> None:
+            async with semaphore:
+                for attempt in range(3):
+                    try:
+                        response = await client.get(path, params=params, headers={"Accept": accept})
+                    except httpx.HTTPError as e:
+                        logger.warning("warmup %s %s: %r", path, params, e)
+                        break
+                    if response.status_code == 503 and attempt < 2:
+                        # Очередь загрузок сервера заполнена — подождём.
+                        await asyncio.sleep(1.0)
+                        continue
+                    if response.status_code != 200:
+                        logger.warning("warmup %s %s: HTTP %s", path, params, response.status_code)
+                        break
+                    stats["requests"] += 1
+                    return
+                stats["failed"] += 1
+
+        for start in range(0, len(ordered), WARMUP_BATCH_SIZE):
+            if await _cache_fill(client) >= max_fill:
+                stats["stopped_by_budget"] = True
+                logger.info("warmup: кэш заполнен на >= %.0f%%, останавливаемся", max_fill * 100)
+                break
+
+            batch = ordered[start:start + WARMUP_BATCH_SIZE]
+            async with db_read_engine.connect() as conn:
+                rows = (
+                    await conn.execute(POSTERS_SQL, {"ids": [row.kinopoisk_id for row in batch]})
+                ).all()
+
+            jobs = []
+            for row in rows:
+                for path, params in poster_requests(row, widths):
+                    # Оригинал один на все Accept; варианты — на каждый.
+                    for accept in (accepts if "w" in params else accepts[:1]):
+                        jobs.append(fetch(path, params, accept))
+            await asyncio.gather(*jobs)
+
+            stats["movies"] += len(batch)
+            last = batch[-1]
+            _save_state(
+                state_path, order, {"sort_key": last.sort_key, "kinopoisk_id": last.kinopoisk_id}
+            )
+            logger.info("warmup: %s фильмов, %s запросов", stats["movies"], stats["requests"])
+
+    return stats
+
+
+async def _main(**kwargs) -> None:
+    try:
+        stats = await warm_posters(**kwargs)
+    finally:
+        await db_read_engine.dispose()
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Прогреть дисковый кэш постеров KinoServer.")
+    parser.add_argument("--order", choices=sorted(ORDER_SQL), default="rating")
+    parser.add_argument("--limit", type=int, default=None, help="Не больше N фильмов за прогон")
+    parser.add_argument(
+        "--api-url",
+        default=f"http://127.0.0.1:{config.APP_PORT}",
+        help="Адрес запущенного KinoServer (без PUBLIC_API_PREFIX)",
+    )
+    parser.add_argument(
+        "--widths",
+        default="960,1280",
+        help=f"Ширины мобильных вариантов через запятую (корзины: {WIDTH_BUCKETS})",
+    )
+    parser.add_argument(
+        "--accept",
+        action="append",
+        default=None,
+        help="Accept, под который греть варианты (можно несколько раз)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--max-fill",
+        type=float,
+        default=0.8,
+        help="Остановиться, когда кэш заполнен на эту долю TMDB_IMAGE_CACHE_MAX_BYTES",
+    )
+    parser.add_argument("--state", type=Path, default=Path("data/poster_warmup.json"))
+    parser.add_argument("--reset", action="store_true", help="Начать обход с начала")
+    args = parser.parse_args()
+
+    asyncio.run(
+        _main(
+            api_url=args.api_url,
+            order=args.order,
+            limit=args.limit,
+            widths=[int(w) for w in args.widths.split(",") if w.strip()],
+            accepts=args.accept or ["image/avif,image/webp,*/*", "image/webp,*/*"],
+            concurrency=args.concurrency,
+            max_fill=args.max_fill,
+            state_path=args.state,
+            reset=args.reset,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,10 +10,9 @@
 итоговый score собирается через `case`/`func`/арифметику SQLAlchemy.
 """
 
-import json
 from dataclasses import dataclass
 
-from sqlalchemy import case, func, literal, or_, select, text
+from sqlalchemy import case, func, literal, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.pgvector_compat import Vector
@@ -22,27 +21,27 @@ from app.models.models import (
     Favorite,
     Movie,
     RecommendationEvent,
-    RecommendationSession,
     UserRecommendationProfile,
 )
+from app.config.config_reader import config
+from app.crud import queries
 from app.crud.crud import build_title_search_filter_and_score
+from app.db.db import mark_user_write
 from app.emotions import EXCLUDED_OUTPUT_EMOTIONS
 from app.movie_filters import is_movie_deliverable, movie_deliverable_filter
 from app.schemas.schemas import RecommendationEventCreate, RecommendationRequest
+from app.services.session_store import (
+    SessionState,
+    create_session_state,
+    load_session_state,
+    save_session_state,
+    session_store,
+)
 from embedding.embedding import to_embedding
 
 
-VALID_MOODS = {
-    "sadness": "sadness_avg",
-    "optimism": "optimism_avg",
-    "fear": "fear_avg",
-    "anger": "anger_avg",
-    "worry": "worry_avg",
-    "love": "love_avg",
-    "fun": "fun_avg",
-    "boredom": "boredom_avg",
-}
-# neutral_avg остаётся в БД, но не используется в рекомендациях (см. app.emotions).
+VALID_MOODS = queries.OUTPUT_EMOTION_POSITIONS
+# neutral остаётся в профиле, но не используется в рекомендациях (см. app.emotions).
 if EXCLUDED_OUTPUT_EMOTIONS & set(VALID_MOODS):
     raise RuntimeError("VALID_MOODS must not include excluded output emotions")
 
@@ -83,7 +82,7 @@ def _to_list(value) -> list[float] | None:
 def _normalize_genre_tag(genre: str | None) -> str | None:
     if not genre:
         return None
-    return genre if genre.startswith("genre_") else f"genre_{genre}"
+    return queries.normalize_genre_tag(genre)
 
 
 def _cosine_similarity_expr(embedding_col, query_vec: list[float] | None):
@@ -198,32 +197,9 @@ async def rebuild_user_recommendation_profile(
     return profile
 
 
-async def get_mood_scores(session: AsyncSession, mood: str | None) -> dict[int, float]:
-    """Нормализованный (0..1) рейтинг указанной эмоции из таблицы ratings.
-
-    Можно было бы и это перенести в JOIN внутри основного запроса, но таблица
-    ratings обычно меньше movies, и dict-lookup в Python тут уже не bottleneck.
-    """
-    if not mood or mood not in VALID_MOODS:
-        return {}
-
-    column_name = VALID_MOODS[mood]
-    query = text(f"""
-        SELECT movie_id, {column_name}
-        FROM ratings
-        WHERE {column_name} IS NOT NULL AND {column_name} > 0
-    """)
-
-    try:
-        rows = (await session.execute(query)).all()
-    except Exception:
-        return {}
-
-    return {
-        int(movie_id): max(0.0, min(float(score) / 10.0, 1.0))
-        for movie_id, score in rows
-        if movie_id is not None
-    }
+def normalize_mood_score(score) -> float:
+    """Оценка эмоции 0..10 из movie_emotion_profiles -> 0..1."""
+    return max(0.0, min(float(score or 0.0) / 10.0, 1.0))
 
 
 def build_recommendation_reason(details: dict[str, float], mood: str | None) -> str:
@@ -276,7 +252,7 @@ async def recommend_movies(
 
     query_embedding = _to_list(to_embedding(query_text)) if query_text else None
 
-    mood_scores = await get_mood_scores(session, request.mood)
+    mood_score_raw = queries.mood_score_expr(request.mood)
     genre_tag = _normalize_genre_tag(request.genre)
     survey_genres = [
         _normalize_genre_tag(genre) or genre
@@ -311,8 +287,9 @@ async def recommend_movies(
     )
 
     # Финальный score: та же линейная комбинация, что и раньше, но в SQL.
-    # mood_score добавим в Python (он берётся из dict mood_scores уже после
-    # выборки — это дешевле, чем JOIN-ить ratings внутри ORDER BY).
+    # mood_score добавим в Python: он читается подзапросом по PK
+    # movie_emotion_profiles только для отобранных кандидатов, а не для всей
+    # таблицы и не внутри ORDER BY.
     rating_score = func.coalesce(Movie.rating, literal(0.0)) / literal(10.0)
     title_search = (request.title_search or "").strip()
 
@@ -356,6 +333,7 @@ async def recommend_movies(
                 sim_session_like.label("sim_session_like"),
                 sim_session_dislike.label("sim_session_dislike"),
                 rating_score.label("rating_score"),
+                mood_score_raw.label("mood_score"),
                 score.label("base_score"),
             )
             .where(Movie.kinopoisk_id.isnot(None))
@@ -366,54 +344,23 @@ async def recommend_movies(
         )
 
         if genre_tag:
-            query_stmt = query_stmt.where(
-                text("tags @> CAST(:genre_tags AS jsonb)").bindparams(
-                    genre_tags=json.dumps([genre_tag])
-                )
-            )
+            query_stmt = query_stmt.where(queries.tags_contain(genre_tag))
 
         if survey_genres:
-            survey_genre_filters = [
-                text("tags @> CAST(:survey_genre_tag AS jsonb)").bindparams(
-                    survey_genre_tag=json.dumps([survey_genre])
-                )
-                for survey_genre in survey_genres
-            ]
-            query_stmt = query_stmt.where(or_(*survey_genre_filters))
+            query_stmt = query_stmt.where(
+                or_(*(queries.tags_contain(survey_genre) for survey_genre in survey_genres))
+            )
 
         if survey_emotions:
-            survey_emotion_filters = [
-                text(
-                    f"""
-                    EXISTS (
-                        SELECT 1
-                        FROM ratings r
-                        WHERE r.movie_id = movies.kinopoisk_id
-                          AND r.{VALID_MOODS[survey_emotion]} > 0
-                    )
-                    """
-                )
-                for survey_emotion in survey_emotions
-            ]
-            query_stmt = query_stmt.where(or_(*survey_emotion_filters))
+            query_stmt = query_stmt.where(
+                or_(*(queries.mood_exists(survey_emotion) for survey_emotion in survey_emotions))
+            )
 
         if title_filter is not None:
             query_stmt = query_stmt.where(title_filter)
 
         if request.strict_mood_filter and request.mood and request.mood in VALID_MOODS:
-            mood_column = VALID_MOODS[request.mood]
-            query_stmt = query_stmt.where(
-                text(
-                    f"""
-                    EXISTS (
-                        SELECT 1
-                        FROM ratings r
-                        WHERE r.movie_id = movies.kinopoisk_id
-                          AND r.{mood_column} > 0
-                    )
-                    """
-                )
-            )
+            query_stmt = query_stmt.where(queries.mood_exists(request.mood))
 
         if excluded_ids:
             query_stmt = query_stmt.where(
@@ -442,7 +389,7 @@ async def recommend_movies(
         if not is_movie_deliverable(movie):
             continue
 
-        mood_score = mood_scores.get(int(movie.kinopoisk_id), 0.0) if movie.kinopoisk_id else 0.0
+        mood_score = normalize_mood_score(row.mood_score)
         final_score = float(row.base_score) + DEFAULT_WEIGHTS["mood_score"] * mood_score
 
         details = {
@@ -470,36 +417,43 @@ async def recommend_movies(
     return scored[: max(1, min(request.limit, 100))]
 
 
+async def _commit_session_change(session: AsyncSession, session_id: str | None) -> None:
+    """Коммит после изменения сессии рекомендаций, которое кэш уже применил."""
+    try:
+        await session.commit()
+    except Exception:
+        # При откате кэш врёт — сбрасываем запись, следующий запрос прочитает БД.
+        if session_id:
+            session_store.discard(session_id)
+        raise
+
+
 async def get_or_create_recommendation_session(
     session: AsyncSession,
     session_id: str,
     user_id: str,
     mood: str | None = None,
     query: str | None = None,
-) -> RecommendationSession:
-    rec_session = await session.scalar(
-        select(RecommendationSession).where(RecommendationSession.session_id == session_id)
-    )
-    if rec_session:
-        rec_session.mood = mood
-        rec_session.query = query
-        await session.commit()
-        await session.refresh(rec_session)
-        return rec_session
-
-    rec_session = RecommendationSession(
-        session_id=session_id,
-        user_id=user_id,
-        mood=mood,
-        query=query,
-        shown_movies=[],
-        liked_movies=[],
-        disliked_movies=[],
-    )
-    session.add(rec_session)
-    await session.commit()
-    await session.refresh(rec_session)
-    return rec_session
+) -> SessionState:
+    """Сессия из кэша; в БД пишем только новую сессию или изменившиеся mood/query."""
+    state = await load_session_state(session, session_id)
+    if state is None:
+        state = await create_session_state(session, session_id, user_id, mood, query)
+        await _commit_session_change(session, session_id)
+        return state
+
+    def set_mood_and_query(current: SessionState) -> bool:
+        changed = current.mood != mood or current.query != query
+        current.mood = mood
+        current.query = query
+        return changed
+
+    if state.mood == mood and state.query == query:
+        return state
+
+    saved = await save_session_state(session, state, set_mood_and_query)
+    await _commit_session_change(session, session_id)
+    return saved or state
 
 
 async def create_recommendation_event(
@@ -507,22 +461,14 @@ async def create_recommendation_event(
     event: RecommendationEventCreate,
 ) -> RecommendationEvent:
     if event.session_id and event.movie_id:
-        rec_session = await session.scalar(
-            select(RecommendationSession).where(RecommendationSession.session_id == event.session_id)
-        )
-        if rec_session:
-            if event.event_type == "show" and event.movie_id not in rec_session.shown_movies:
-                rec_session.shown_movies.append(event.movie_id)
-            elif event.event_type == "like":
-                if event.movie_id not in rec_session.liked_movies:
-                    rec_session.liked_movies.append(event.movie_id)
-                if event.movie_id in rec_session.disliked_movies:
-                    rec_session.disliked_movies.remove(event.movie_id)
-            elif event.event_type == "dislike":
-                if event.movie_id not in rec_session.disliked_movies:
-                    rec_session.disliked_movies.append(event.movie_id)
-                if event.movie_id in rec_session.liked_movies:
-                    rec_session.liked_movies.remove(event.movie_id)
+        state = await load_session_state(session, event.session_id)
+        if state is not None:
+            max_shown = int(config.RECOMMENDATION_SESSION_MAX_SHOWN)
+            await save_session_state(
+                session,
+                state,
+                lambda current: current.apply_event(event.event_type, event.movie_id, max_shown),
+            )
 
     db_event = RecommendationEvent(
         user_id=event.user_id,
@@ -533,6 +479,9 @@ async def create_recommendation_event(
         event_metadata=event.metadata,
     )
     session.add(db_event)
-    await session.commit()
-    await session.refresh(db_event)
+    await _commit_session_change(session, event.session_id)
+    if event.event_type in {"like", "dislike"}:
+        mark_user_write(event.user_id)
+    # id приходит через RETURNING при INSERT, refresh не нужен
+    # (expire_on_commit=False в db_sessionmaker).
     return db_event
@@ -0,0 +1,171 @@
+"""
+In-process кэш готовых ответов для горячих неперсонализированных списков.
+
+Первые страницы /movies/by-genre и /movies/by-emotion одинаковы для всех
+пользователей и запрашиваются чаще всего. Кэш хранит уже сериализованное
+тело ответа (bytes) и нужные заголовки (X-Next-Cursor).
+
+Ключ — (маршрут, параметры, версия каталога): после загрузки фильмов или
+пересчёта рейтингов версия меняется (app.services.catalogue) и старые записи
+просто перестают находиться, а затем вытесняются по TTL/LRU. Поэтому кэши
+разных воркеров uvicorn не расходятся по содержимому и общий стор не
+обязателен — общим слоем служит proxy_cache nginx.
+
+Одновременные промахи по одному ключу схлопываются: запрос в БД делает
+только первый, остальные ждут его результат. Статистика по маршрутам —
+GET /metrics/response-cache.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Hashable
+
+from fastapi import Response
+
+from app.config.config_reader import config
+from app.services import catalogue
+
+# Заголовки ответа, которые нужно сохранить вместе с телом.
+_CACHED_HEADERS = ("x-next-cursor",)
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    media_type: str
+    headers: dict[str, str]
+
+    @classmethod
+    def from_response(cls, response: Response) -> "CachedResponse":
+        return cls(
+            body=bytes(response.body),
+            media_type=response.media_type or "application/json",
+            headers={
+                name: response.headers[name]
+                for name in _CACHED_HEADERS
+                if name in response.headers
+            },
+        )
+
+    def to_response(self) -> Response:
+        return Response(content=self.body, media_type=self.media_type, headers=self.headers)
+
+
+@dataclass
+class RouteStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+
+    def snapshot(self) -> dict:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            # Схлопнутые запросы тоже не ходили в БД.
+            "hit_ratio": round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+        }
+
+
+class _LeaderCancelled(Exception):
+    """Запрос, который считал значение, отменили — ждущие пробуют сами."""
+
+
+class ResponseCache:
+    """LRU с TTL + схлопывание одновременных промахов (single-flight)."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self.ttl = max(0.0, float(ttl_seconds))
+        self.max_entries = max(1, int(max_entries))
+        self._items: OrderedDict[Hashable, tuple[float, CachedResponse]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._stats: dict[str, RouteStats] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _get(self, key: Hashable) -> CachedResponse | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def _put(self, key: Hashable, value: CachedResponse) -> None:
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        route: str,
+        params: Hashable,
+        compute: Callable[[], Awaitable[Response]],
+    ) -> Response:
+        if self.ttl <= 0:
+            return await compute()
+
+        key = (route, params, catalogue.current.version)
+        stats = self._stats.setdefault(route, RouteStats())
+
+        while True:
+            cached = self._get(key)
+            if cached is not None:
+                stats.hits += 1
+                return cached.to_response()
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            stats.coalesced += 1
+            try:
+                # shield: отмена ждущего запроса не должна отменять общий future.
+                return (await asyncio.shield(inflight)).to_response()
+            except _LeaderCancelled:
+                stats.coalesced -= 1
+                continue
+
+        stats.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await compute()
+            value = CachedResponse.from_response(response)
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            if response.status_code == 200:
+                self._put(key, value)
+            future.set_result(value)
+            return response
+        finally:
+            self._inflight.pop(key, None)
+            if future.done() and not future.cancelled():
+                # Помечаем исключение полученным, даже если ждущих не было.
+                future.exception()
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self._items),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "routes": {route: stats.snapshot() for route, stats in sorted(self._stats.items())},
+        }
+
+
+response_cache = ResponseCache(
+    ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS,
+    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+)
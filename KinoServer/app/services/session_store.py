@@ -0,0 +1,302 @@
+"""
+Кэш состояния рекомендательных сессий с TTL.
+
+Раньше каждое событие (show/like/dislike) делало SELECT сессии + commit +
+refresh, а `shown_movies` рос бесконечно. Теперь состояние сессии живёт в
+памяти процесса (множества id), в Postgres пишется только при реальном
+изменении (write-through), а `expires_at` выставляется при каждой записи.
+
+Postgres остаётся общим источником правды для нескольких воркеров uvicorn:
+промах кэша читает строку из БД, а запись идёт с optimistic-проверкой по
+`updated_at` — если сессию успел поменять другой воркер, перечитываем и
+применяем изменение заново.
+
+Фоновый sweeper (sweep_loop) выкидывает протухшие сессии из памяти и пачками
+удаляет их из таблицы.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.config_reader import config
+from app.db.db import db_sessionmaker
+from app.models.models import RecommendationSession
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class SessionState:
+    session_id: str
+    user_id: str
+    mood: str | None = None
+    query: str | None = None
+    # dict вместо set: нужен порядок показа, чтобы обрезать самые старые id.
+    shown: dict[int, None] = field(default_factory=dict)
+    liked: set[int] = field(default_factory=set)
+    disliked: set[int] = field(default_factory=set)
+    expires_at: datetime | None = None
+    # updated_at строки в БД на момент последнего чтения/записи.
+    version: datetime | None = None
+
+    def is_expired(self, now: datetime | None = None) -> bool:
+        return self.expires_at is not None and self.expires_at <= (now or _utcnow())
+
+    def apply_event(self, event_type: str, movie_id: int, max_shown: int) -> bool:
+        """Применяет событие к множествам. Возвращает True, если что-то поменялось."""
+        if event_type == "show":
+            if movie_id in self.shown:
+                return False
+            self.shown[movie_id] = None
+            while len(self.shown) > max_shown:
+                del self.shown[next(iter(self.shown))]
+            return True
+
+        if event_type == "like":
+            changed = movie_id not in self.liked or movie_id in self.disliked
+            self.liked.add(movie_id)
+            self.disliked.discard(movie_id)
+            return changed
+
+        if event_type == "dislike":
+            changed = movie_id not in self.disliked or movie_id in self.liked
+            self.disliked.add(movie_id)
+            self.liked.discard(movie_id)
+            return changed
+
+        return False
+
+    @classmethod
+    def from_row(cls, row: RecommendationSession) -> "SessionState":
+        return cls(
+            session_id=row.session_id,
+            user_id=row.user_id,
+            mood=row.mood,
+            query=row.query,
+            shown=dict.fromkeys(int(x) for x in (row.shown_movies or [])),
+            liked={int(x) for x in (row.liked_movies or [])},
+            disliked={int(x) for x in (row.disliked_movies or [])},
+            expires_at=row.expires_at,
+            version=row.updated_at,
+        )
+
+
+class RecommendationSessionStore:
+    """In-memory LRU с TTL поверх SessionState."""
+
+    def __init__(self, ttl_seconds: int, max_entries: int) -> None:
+        self.ttl = timedelta(seconds=max(1, int(ttl_seconds)))
+        self.max_entries = max(1, int(max_entries))
+        self._items: OrderedDict[str, SessionState] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, session_id: str) -> SessionState | None:
+        state = self._items.get(session_id)
+        if state is None:
+            return None
+        if state.is_expired():
+            del self._items[session_id]
+            return None
+        self._items.move_to_end(session_id)
+        return state
+
+    def put(self, state: SessionState) -> None:
+        self._items[state.session_id] = state
+        self._items.move_to_end(state.session_id)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def discard(self, session_id: str) -> None:
+        self._items.pop(session_id, None)
+
+    def evict_expired(self) -> int:
+        now = _utcnow()
+        expired = [key for key, state in self._items.items() if state.is_expired(now)]
+        for key in expired:
+            del self._items[key]
+        return len(expired)
+
+    def next_expiry(self) -> datetime:
+        return _utcnow() + self.ttl
+
+
+session_store = RecommendationSessionStore(
+    ttl_seconds=config.RECOMMENDATION_SESSION_TTL_SECONDS,
+    max_entries=config.RECOMMENDATION_SESSION_CACHE_MAX_ENTRIES,
+)
+
+
+async def load_session_state(session: AsyncSession, session_id: str) -> SessionState | None:
+    """Состояние из кэша, при промахе — из БД. Протухшие сессии считаем отсутствующими."""
+    state = session_store.get(session_id)
+    if state is not None:
+        return state
+
+    row = await session.scalar(
+        select(RecommendationSession).where(RecommendationSession.session_id == session_id)
+    )
+    if row is None:
+        return None
+
+    state = SessionState.from_row(row)
+    if state.is_expired():
+        return None
+    session_store.put(state)
+    return state
+
+
+async def create_session_state(
+    session: AsyncSession,
+    session_id: str,
+    user_id: str,
+    mood: str | None,
+    query: str | None,
+) -> SessionState:
+    """Новая сессия (или перезапуск протухшей с тем же session_id). Без commit."""
+    state = SessionState(
+        session_id=session_id,
+        user_id=user_id,
+        mood=mood,
+        query=query,
+        expires_at=session_store.next_expiry(),
+    )
+
+    row = await session.scalar(
+        select(RecommendationSession).where(RecommendationSession.session_id == session_id)
+    )
+    if row is None:
+        row = RecommendationSession(session_id=session_id, user_id=user_id)
+        session.add(row)
+
+    row.user_id = user_id
+    row.mood = mood
+    row.query = query
+    row.shown_movies = []
+    row.liked_movies = []
+    row.disliked_movies = []
+    row.expires_at = state.expires_at
+    # updated_at ставим сами: так версия известна без refresh после flush.
+    row.updated_at = state.version = _utcnow()
+    await session.flush()
+    session_store.put(state)
+    return state
+
+
+def _state_values(state: SessionState) -> dict:
+    return {
+        "mood": state.mood,
+        "query": state.query,
+        "shown_movies": list(state.shown),
+        "liked_movies": sorted(state.liked),
+        "disliked_movies": sorted(state.disliked),
+        "expires_at": state.expires_at,
+    }
+
+
+async def save_session_state(
+    session: AsyncSession,
+    state: SessionState,
+    mutate: Callable[[SessionState], bool],
+) -> SessionState | None:
+    """Write-through: применяет mutate и пишет в БД, только если состояние изменилось.
+
+    UPDATE идёт с условием `updated_at = version`: если строку успел поменять
+    другой воркер, перечитываем её и применяем mutate повторно. Без commit.
+    Возвращает актуальное состояние (None — сессии больше нет).
+    """
+    for attempt in range(2):
+        if not mutate(state):
+            return state
+
+        state.expires_at = session_store.next_expiry()
+        stmt = (
+            update(RecommendationSession)
+            .where(RecommendationSession.session_id == state.session_id)
+            .values(**_state_values(state), updated_at=_utcnow())
+            .returning(RecommendationSession.updated_at)
+        )
+        if state.version is not None and attempt == 0:
+            stmt = stmt.where(RecommendationSession.updated_at == state.version)
+
+        new_version = await session.scalar(stmt)
+        if new_version is not None:
+            state.version = new_version
+            session_store.put(state)
+            return state
+
+        # Конфликт версий (или строку уже удалил sweeper) — перечитываем.
+        session_store.discard(state.session_id)
+        fresh = await load_session_state(session, state.session_id)
+        if fresh is None:
+            return None
+        state = fresh
+
+    return state
+
+
+async def sweep_expired_sessions(batch_size: int | None = None) -> int:
+    """Удаляет протухшие сессии пачками; у старых строк без expires_at смотрим на updated_at."""
+    if batch_size is None:
+        batch_size = int(config.RECOMMENDATION_SESSION_SWEEP_BATCH_SIZE)
+    batch_size = max(1, batch_size)
+
+    session_store.evict_expired()
+
+    now = _utcnow()
+    stale_before = now - session_store.ttl
+    expired_ids = (
+        select(RecommendationSession.id)
+        .where(
+            or_(
+                RecommendationSession.expires_at <= now,
+                (RecommendationSession.expires_at.is_(None))
+                & (RecommendationSession.updated_at <= stale_before),
+            )
+        )
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+
+    total = 0
+    while True:
+        async with db_sessionmaker() as session:
+            result = await session.execute(
+                delete(RecommendationSession)
+                .where(RecommendationSession.id.in_(expired_ids))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        deleted = result.rowcount or 0
+        total += deleted
+        if deleted < batch_size:
+            break
+        # Отдаём event loop между пачками, чтобы не занимать его надолго.
+        await asyncio.sleep(0)
+
+    if total:
+        logger.info("recommendation_sessions: удалено протухших сессий: %s", total)
+    return total
+
+
+async def sweep_loop() -> None:
+    """Фоновая задача для startup."""
+    interval = max(1, int(config.RECOMMENDATION_SESSION_SWEEP_INTERVAL_SECONDS))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_expired_sessions()
+        except Exception:
+            logger.exception("recommendation_sessions: ошибка sweeper'а")
@@ -0,0 +1,158 @@
+"""
+Экспорт модели эмоций (best.pt) для CPU: ONNX (onnxruntime) или OpenVINO.
+
+PyTorch-путь ultralytics на CPU — самый медленный эндпоинт сервера. Экспорт
+кладёт модель рядом с best.pt (best.onnx / best_openvino_model/), сервер
+переключается на неё настройкой PHOTO_EMOTION_MODEL_FORMAT. Вход —
+динамический (батч лиц + кадр разного размера), размер картинки — тот же,
+с которым обучалась best.pt.
+
+    python -m face_recognition.export --format onnx
+    python -m face_recognition.export --format onnx --check photo1.jpg photo2.jpg --repeat 20
+
+--check сверяет экспорт с .pt на тех же батчах, что и сервер (лица + кадр):
+одинаковые results.names, одинаковые классы в каждом элементе батча,
+уверенность лучшего бокса отличается не больше --conf-tolerance, и
+одинаковая итоговая эмоция приложения. Затем печатает пропускную
+способность обоих вариантов. Код выхода 1 — если есть расхождения.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from face_recognition.face_recognition import (
+    MODEL_FORMATS,
+    decode_image,
+    detect_faces,
+    emotion_batch,
+    load_model,
+    model_path,
+    summarize_emotions,
+)
+
+EXPORT_FORMATS = sorted(set(MODEL_FORMATS) - {'pt'})
+
+
+def export_model(model_format: str) -> str:
+    """Экспортирует best.pt в model_format, возвращает путь к результату."""
+    from ultralytics import YOLO
+
+    kwargs = {'format': model_format, 'dynamic': True}
+    if model_format == 'onnx':
+        kwargs['simplify'] = True
+    exported = str(YOLO(model_path('pt')).export(**kwargs))
+    if os.path.abspath(exported) != os.path.abspath(model_path(model_format)):
+        print(f"Внимание: экспорт сохранён в {exported}, сервер ищет {model_path(model_format)}")
+    return exported
+
+
+def _load_batches(paths: list[str]) -> list[tuple[str, list]]:
+    batches = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            image = decode_image(f.read())
+        if image is None:
+            print(f"{path}: не удалось прочитать")
+            continue
+        batches.append((path, emotion_batch(image, detect_faces(image))))
+    return batches
+
+
+def _predictions(model, batch: list) -> list[list[tuple[str, float]]]:
+    """Для каждого элемента батча — (класс, уверенность) по убыванию уверенности."""
+    out = []
+    for result in model.predict(batch, verbose=False):
+        boxes = []
+        if result.boxes is not None:
+            boxes = [
+                (result.names[cls], conf)
+                for cls, conf in zip(result.boxes.cls.int().tolist(), result.boxes.conf.tolist())
+            ]
+        out.append(sorted(boxes, key=lambda item: item[1], reverse=True))
+    return out
+
+
+def _emotions(predictions: list[list[tuple[str, float]]]) -> list[str]:
+    unique_emotions: list[str] = []
+    for boxes in predictions:
+        for name, _ in boxes:
+            if name not in unique_emotions:
+                unique_emotions.append(name)
+    return unique_emotions
+
+
+def check_parity(model_format: str, paths: list[str], conf_tolerance: float) -> int:
+    """Сверка экспорта с .pt; возвращает число расхождений."""
+    reference = load_model('pt')
+    candidate = load_model(model_format)
+    mismatches = 0
+    if reference.names != candidate.names:
+        print(f"results.names различаются: pt={reference.names} {model_format}={candidate.names}")
+        mismatches += 1
+
+    for path, batch in _load_batches(paths):
+        expected = _predictions(reference, batch)
+        actual = _predictions(candidate, batch)
+        for i, (want, got) in enumerate(zip(expected, actual)):
+            what = 'кадр' if i == len(batch) - 1 else f'лицо {i}'
+            if {name for name, _ in want} != {name for name, _ in got}:
+                print(f"{path}, {what}: классы pt={want} {model_format}={got}")
+                mismatches += 1
+            elif want and abs(want[0][1] - got[0][1]) > conf_tolerance:
+                print(f"{path}, {what}: уверенность pt={want[0][1]:.3f} {model_format}={got[0][1]:.3f}")
+                mismatches += 1
+
+        want_summary = summarize_emotions(_emotions(expected))
+        got_summary = summarize_emotions(_emotions(actual))
+        want_emotion = want_summary and want_summary['emotion']
+        got_emotion = got_summary and got_summary['emotion']
+        if want_emotion != got_emotion:
+            print(f"{path}: эмоция pt={want_emotion} {model_format}={got_emotion}")
+            mismatches += 1
+        else:
+            print(f"{path}: ок ({want_emotion})")
+    return mismatches
+
+
+def benchmark(model_format: str, paths: list[str], repeat: int) -> None:
+    """Пропускная способность .pt и экспорта на одних и тех же батчах."""
+    batches = [batch for _, batch in _load_batches(paths)]
+    if not batches:
+        return
+    frames = sum(len(batch) for batch in batches)
+    for fmt in ('pt', model_format):
+        model = load_model(fmt)
+        for batch in batches:  # прогрев: первая загрузка и инициализация рантайма
+            model.predict(batch, verbose=False)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for batch in batches:
+                model.predict(batch, verbose=False)
+        elapsed = time.perf_counter() - started
+        print(
+            f"  {fmt:<9} {len(batches) * repeat / elapsed:7.2f} фото/с, "
+            f"{frames * repeat / elapsed:7.2f} кадров/с, "
+            f"{elapsed / (len(batches) * repeat) * 1e3:8.2f} мс/фото"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт модели эмоций для CPU и сверка с best.pt.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="onnx")
+    parser.add_argument("--skip-export", action="store_true", help="Только сверка/замер готового экспорта")
+    parser.add_argument("--check", nargs="+", metavar="IMAGE", help="Фото для сверки и замера")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--conf-tolerance", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        print(f"Экспорт: {export_model(args.format)}")
+    if args.check:
+        mismatches = check_parity(args.format, args.check, args.conf_tolerance)
+        print(f"Пропускная способность ({args.repeat} повторов):")
+        benchmark(args.format, args.check, args.repeat)
+        if mismatches:
+            print(f"Расхождений с best.pt: {mismatches}")
+            sys.exit(1)
@@ -1,10 +1,64 @@
+"""
+Эмоция по фото: лица ищет каскад Хаара, эмоции определяет YOLO (best.pt).
+
+Путь анализа за один проход:
+
+- каскад загружается один раз на поток;
+- детекция — один вызов detectMultiScale2 с минимальным порогом соседей
+  FALLBACK_MIN_NEIGHBORS. Число соседей у каждого лица — его «уверенность»:
+  берём лица с порогом STRICT_MIN_NEIGHBORS, а если таких нет — все найденные,
+  по убыванию уверенности (раньше это были до пяти проходов каскада с разными
+  minNeighbors);
+- YOLO вызывается один раз на батч: все вырезанные лица плюс кадр целиком.
+
+Фото декодируется из байтов загрузки (cv2.imdecode на np.frombuffer, без
+временных файлов) и сразу ужимается до ANALYSIS_MAX_SIDE по длинной стороне:
+у JPEG с телефона размер читается из заголовка, и декодер сразу отдаёт
+картинку в 2/4/8 раз меньше (IMREAD_REDUCED_*), остальное — cv2.resize.
+Каскад на 12-мегапиксельном кадре в разы медленнее, а YOLO всё равно
+работает на 640 px.
+
+API без состояния: analyze_photo_bytes(data) / analyze_image(image) можно
+вызывать из нескольких потоков одновременно. Ни CascadeClassifier, ни
+предиктор ultralytics не потокобезопасны (предиктор хранит батч и
+препроцессинг между вызовами), поэтому у каждого потока свой экземпляр —
+они создаются один раз и дальше только читаются. Пул потоков — в
+KinoServer (app.services.photo_emotion).
+
+Сколько потоков torch берёт один инференс, задаёт set_intra_op_threads:
+по умолчанию torch занимает все ядра, и N потоков пула дали бы N × ядер
+вычислительных потоков. KinoServer делит ядра между потоками пула.
+
+Формат модели выбирается set_model_format: 'pt' (PyTorch, по умолчанию),
+'onnx' или 'openvino' — экспорт и сверка с .pt в face_recognition.export.
+Имена классов экспорт сохраняет в метаданных модели, так что results.names
+и отображение в FACE_TO_APP_EMOTION не меняются.
+
+Замер задержки на своих фото:
+
+    python -m face_recognition.face_recognition photo1.jpg photo2.jpg --repeat 10
+"""
+
+import logging
 import os
+import threading
 
 import cv2
-from ultralytics import YOLO
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 _MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
-_MODEL_PATH = os.path.join(_MODEL_DIR, 'best.pt')
+
+# Формат -> файл (каталог) модели рядом с best.pt, как их называет экспорт ultralytics.
+MODEL_FORMATS = {
+    'pt': 'best.pt',
+    'onnx': 'best.onnx',
+    'openvino': 'best_openvino_model',
+}
+_model_format = 'pt'
+# Потоков torch на инференс (0 — не менять, torch берёт все ядра).
+_intra_op_threads = 0
 
 FACE_TO_APP_EMOTION = {
     'Anger': 'anger',
@@ -17,92 +71,133 @@ FACE_TO_APP_EMOTION = {
     'Surprise': 'worry',
 }
 
+CASCADE_SCALE_FACTOR = 1.1
+CASCADE_MIN_SIZE = (30, 30)
+# Лицо, найденное с таким числом соседей, считаем уверенным.
+STRICT_MIN_NEIGHBORS = 5
+# Запасной порог, если уверенных лиц нет.
+FALLBACK_MIN_NEIGHBORS = 2
+# Больше лиц в батч YOLO не отправляем (групповые фото).
+MAX_FACES = 8
+# Длинная сторона кадра для анализа.
+ANALYSIS_MAX_SIDE = 1280
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# SOF-маркеры JPEG, в которых лежат размеры кадра (кроме DHT/JPG/DAC).
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+# Каскад и YOLO — свои на каждый поток (см. docstring модуля).
+_local = threading.local()
+
+
+def _cascade():
+    cascade = getattr(_local, 'cascade', None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        if cascade.empty():
+            raise RuntimeError("Не удалось загрузить haarcascade_frontalface_default.xml")
+        _local.cascade = cascade
+    return cascade
+
+
+def model_path(model_format: str) -> str:
+    return os.path.join(_MODEL_DIR, MODEL_FORMATS[model_format])
 
-class FaceFoundAnalyse:
-  def __init__(self) -> None:
-     self.model = YOLO(_MODEL_PATH)
-     self.faces = []
-     self.img=0
-
-  def detect_and_extract_faces(self, image_path):
-      # Загружаем изображение
-      self.img=image_path
-      image = cv2.imread(image_path)
-      if image is None:
-          print("Ошибка: Изображение не найдено")
-          return []
-
-      # Конвертируем в RGB (для вывода) и серый (для детекции)
-      image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-      gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-      # Инициализируем классификатор
-      face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-
-      # Ищем лица
-      faces_coords = face_cascade.detectMultiScale(
-          gray,
-          scaleFactor=1.1,
-          minNeighbors=5,
-          minSize=(30, 30)
-      )
-
-      extracted_faces = []
-      for (x, y, w, h) in faces_coords:
-          # Вырезаем лицо из RGB оригинала
-          face_img = image_rgb[y:y+h, x:x+w]
-          extracted_faces.append(face_img)
-
-      # блок для попытки найти лица, если не нашлись
-      if extracted_faces == []:
-        for i in range(2,6):
-          faces_coords = face_cascade.detectMultiScale(
-          gray,
-          scaleFactor=1.1,
-          minNeighbors=i,  # Меняем, может быть найдёт
-          minSize=(30, 30))
-
-          for (x, y, w, h) in faces_coords:
-            # Вырезаем лицо из RGB оригинала
-            face_img = image_rgb[y:y+h, x:x+w]
-            extracted_faces.append(face_img)
-
-          if extracted_faces != []:
-            self.faces=extracted_faces
-            return
-
-      self.faces=extracted_faces
-      return
-
-  def emotion_analysis(self):
-    emotions_list = []
-
-    # Анализируем каждое лицо отдельно
-    #  ДЛЯ АНАЛИЗА ОТДЕЛЬНЫХ ЛИЦ
-    for face in self.faces:
-      results = self.model(face)[0]
-      if results.boxes is not None:
-        for cls in results.boxes.cls.int().tolist():
-          emotions_list.append(results.names[cls])
-
-    # Анализируем всё изображение целиком
-    #  ДЛЯ ТОГО ЧТОБЫ ХОТЬ ЧТО-ТО ТОЧНО ПОЙМАЛО
-    results_full = self.model(self.img)[0]
-    if results_full.boxes is not None:
-      for cls in results_full.boxes.cls.int().tolist():
-        emotions_list.append(results_full.names[cls])
-
-    # Убираем дубликаты
-    unique_emotions = []
-    for emotion in emotions_list:
-      if emotion not in unique_emotions:
-        unique_emotions.append(emotion)
-
-    self.faces = []
-    self.img = 0
-    return unique_emotions
 
-FFA = FaceFoundAnalyse()
+def set_model_format(model_format: str) -> None:
+    """Формат модели для потоков, которые ещё не загрузили YOLO."""
+    global _model_format
+    if model_format not in MODEL_FORMATS:
+        raise ValueError(f"Неизвестный формат модели: {model_format!r}, есть {sorted(MODEL_FORMATS)}")
+    _model_format = model_format
+
+
+def set_intra_op_threads(threads: int) -> None:
+    """Потоков torch на один инференс; действует на модели, загруженные после вызова.
+
+    Только для 'pt': сессии ONNX Runtime / OpenVINO ultralytics создаёт сам,
+    и они занимают все ядра (KinoServer для них держит один поток пула).
+    """
+    global _intra_op_threads
+    _intra_op_threads = max(0, int(threads))
+
+
+def load_model(model_format: str):
+    """YOLO в нужном формате; если экспорта нет — .pt."""
+    # ultralytics (и torch) тянем только при первом анализе.
+    from ultralytics import YOLO
+
+    if _intra_op_threads:
+        import torch
+
+        # Пул intra-op у torch общий на процесс.
+        torch.set_num_threads(_intra_op_threads)
+
+    path = model_path(model_format)
+    if not os.path.exists(path):
+        logger.warning(
+            "Модель %s не найдена, используем best.pt (экспорт: python -m face_recognition.export --format %s)",
+            path, model_format,
+        )
+        path = model_path('pt')
+    return YOLO(path, task='detect')
+
+
+def _model():
+    model = getattr(_local, 'model', None)
+    if model is None:
+        model = load_model(_model_format)
+        _local.model = model
+    return model
+
+
+def detect_faces(image: np.ndarray) -> list[tuple[int, int, int, int]]:
+    """Рамки лиц (x, y, w, h) на BGR-изображении, самые уверенные первыми."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    rects, neighbors = _cascade().detectMultiScale2(
+        gray,
+        scaleFactor=CASCADE_SCALE_FACTOR,
+        minNeighbors=FALLBACK_MIN_NEIGHBORS,
+        minSize=CASCADE_MIN_SIZE,
+    )
+    if len(rects) == 0:
+        return []
+
+    ranked = sorted(
+        zip(np.ravel(neighbors).tolist(), (tuple(r) for r in np.asarray(rects).tolist())),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+    # Как у detectMultiScale: группа проходит порог, если соседей строго больше.
+    confident = [rect for count, rect in ranked if count > STRICT_MIN_NEIGHBORS]
+    faces = confident or [rect for _, rect in ranked]
+    return faces[:MAX_FACES]
+
+
+def emotion_batch(image: np.ndarray, faces: list[tuple[int, int, int, int]]) -> list[np.ndarray]:
+    """Батч для YOLO: вырезанные лица, затем кадр целиком."""
+    # YOLO ждёт BGR, как и cv2 — вырезаем лица прямо из исходного кадра.
+    batch = [image[y:y + h, x:x + w] for x, y, w, h in faces]
+    batch.append(image)
+    return batch
+
+
+def detect_emotions(image: np.ndarray, faces: list[tuple[int, int, int, int]]) -> list[str]:
+    """Эмоции YOLO (без повторов): сначала по лицам, затем по всему кадру."""
+    unique_emotions: list[str] = []
+    for result in _model().predict(emotion_batch(image, faces), verbose=False):
+        if result.boxes is None:
+            continue
+        for cls in result.boxes.cls.int().tolist():
+            emotion = result.names[cls]
+            if emotion not in unique_emotions:
+                unique_emotions.append(emotion)
+    return unique_emotions
 
 
 def map_face_emotion_to_app(raw_emotion: str) -> str | None:
@@ -121,10 +216,8 @@ def map_face_emotion_to_app(raw_emotion: str) -> str | None:
     } else None
 
 
-def analyze_photo_emotion(image_path: str) -> dict | None:
-    """Определяет основную эмоцию на фото и возвращает id для фильтра рекомендаций."""
-    FFA.detect_and_extract_faces(image_path)
-    detected = FFA.emotion_analysis()
+def summarize_emotions(detected: list[str]) -> dict | None:
+    """Основная эмоция по сырым меткам YOLO и id для фильтра рекомендаций."""
     if not detected:
         return None
 
@@ -143,3 +236,152 @@ def analyze_photo_emotion(image_path: str) -> dict | None:
         'detected_emotions': detected,
         'mapped_emotions': mapped,
     }
+
+
+def _jpeg_size(data: bytes) -> tuple[int, int] | None:
+    """(ширина, высота) из заголовка JPEG без декодирования; None — не JPEG."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # заполнитель перед маркером
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # маркеры без длины
+            i += 2
+            continue
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def _downscale(image: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(
+        image,
+        (max(1, round(width * scale)), max(1, round(height * scale))),
+        interpolation=cv2.INTER_AREA,
+    )
+
+
+def decode_image(data: bytes, max_side: int = ANALYSIS_MAX_SIDE) -> np.ndarray | None:
+    """BGR-изображение из байтов файла, не больше max_side; None — не картинка."""
+    flag = cv2.IMREAD_COLOR
+    size = _jpeg_size(data)
+    if size is not None:
+        # Самое сильное уменьшение в декодере, после которого кадр не меньше max_side.
+        for factor, reduced in _REDUCED_FLAGS:
+            if max(size) // factor >= max_side:
+                flag = reduced
+                break
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if image is None:
+        return None
+    return _downscale(image, max_side)
+
+
+def analyze_image(image: np.ndarray) -> dict | None:
+    """Эмоция на BGR-изображении; общего состояния между вызовами нет."""
+    return summarize_emotions(detect_emotions(image, detect_faces(image)))
+
+
+def analyze_photo_bytes(data: bytes) -> dict | None:
+    """Эмоция по байтам загруженного фото (None — не картинка или эмоции нет)."""
+    image = decode_image(data)
+    if image is None:
+        return None
+    return analyze_image(image)
+
+
+def analyze_photo_emotion(image_path: str) -> dict | None:
+    """Определяет основную эмоцию на фото и возвращает id для фильтра рекомендаций."""
+    image = cv2.imread(image_path)
+    if image is None:
+        return None
+    return analyze_image(_downscale(image, ANALYSIS_MAX_SIDE))
+
+
+def _benchmark(paths: list[str], repeat: int = 10) -> None:
+    """Задержка на фото: прежний путь (несколько проходов каскада, YOLO на каждое лицо) vs новый."""
+    import timeit
+
+    def legacy_detect(image: np.ndarray) -> list[np.ndarray]:
+        # Старый detect_and_extract_faces: каскад на каждый вызов, две конвертации,
+        # при неудаче — ещё проходы с minNeighbors 2..5.
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        for min_neighbors in (5, 2, 3, 4, 5):
+            coords = cascade.detectMultiScale(
+                gray, scaleFactor=1.1, minNeighbors=min_neighbors, minSize=(30, 30)
+            )
+            if len(coords):
+                return [image_rgb[y:y + h, x:x + w] for x, y, w, h in coords]
+        return []
+
+    def row(label: str, seconds: float) -> None:
+        print(f"  {label + ':':<44}{seconds * 1e3:9.2f} мс")
+
+    try:
+        model = _model()
+    except Exception as e:  # нет ultralytics/best.pt — меряем только детекцию
+        print(f"YOLO недоступна ({e!r}), замеряем только детекцию")
+        model = None
+
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"{path}: не удалось прочитать")
+            continue
+        _cascade()  # загрузка каскада — разовая, в замер не входит
+
+        legacy_seconds = timeit.timeit(lambda: legacy_detect(image), number=repeat) / repeat
+        single_seconds = timeit.timeit(lambda: detect_faces(image), number=repeat) / repeat
+        faces = detect_faces(image)
+        print(f"{path}: {image.shape[1]}x{image.shape[0]}, лиц: {len(faces)}")
+        row("детекция, несколько проходов", legacy_seconds)
+        row("детекция, один проход", single_seconds)
+
+        with open(path, "rb") as f:
+            data = f.read()
+        buffer = np.frombuffer(data, np.uint8)
+        full_seconds = timeit.timeit(
+            lambda: detect_faces(cv2.imdecode(buffer, cv2.IMREAD_COLOR)), number=repeat
+        ) / repeat
+        reduced_seconds = timeit.timeit(lambda: detect_faces(decode_image(data)), number=repeat) / repeat
+        row("декодирование + детекция, полный кадр", full_seconds)
+        row(f"декодирование + детекция, до {ANALYSIS_MAX_SIDE} px", reduced_seconds)
+
+        if model is None:
+            continue
+        crops = legacy_detect(image)
+
+        def per_face() -> None:
+            for crop in crops:
+                model(crop, verbose=False)
+            model(image, verbose=False)
+
+        per_face_seconds = timeit.timeit(per_face, number=repeat) / repeat
+        batched_seconds = timeit.timeit(lambda: detect_emotions(image, faces), number=repeat) / repeat
+        row("YOLO, вызов на каждое лицо", per_face_seconds)
+        row("YOLO, один батч", batched_seconds)
+        print(f"  эмоции: {detect_emotions(image, faces)}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Замер задержки анализа эмоций по фото.")
+    parser.add_argument("images", nargs="+", help="Пути к фото")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    _benchmark(args.images, args.repeat)
@@ -123,6 +123,8 @@ class Database:
                         description TEXT,
                         horizontal_poster_url TEXT,
                         vertical_poster_url TEXT,
+                        horizontal_poster_public_url TEXT,
+                        vertical_poster_public_url TEXT,
                         country TEXT,
                         rating REAL,
                         tmdb_id INTEGER,
@@ -134,6 +136,13 @@ class Database:
                         embedding vector(1024)
                     )
                 """)
+                # Публичные пути постеров (считаются один раз при вставке,
+                # API отдаёт их как есть). Для таблиц, созданных раньше.
+                cursor.execute("""
+                    ALTER TABLE movies
+                        ADD COLUMN IF NOT EXISTS horizontal_poster_public_url TEXT,
+                        ADD COLUMN IF NOT EXISTS vertical_poster_public_url TEXT
+                """)
                 self.conn.commit()
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS reviews (
@@ -241,9 +250,10 @@ class Database:
                     INSERT INTO movies (
                         title, release_year, duration, genre, director, writers,
                         actors, description, horizontal_poster_url, vertical_poster_url,
+                        horizontal_poster_public_url, vertical_poster_public_url,
                         country, rating, tmdb_id, kinopoisk_id, title_foreign, tags,
                         total_reviews, reviews, embedding
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
                     md["title"],
                     md["release_year"],
@@ -255,6 +265,8 @@ class Database:
                     md["description"],
                     md["horizontal_poster_url"],
                     md["vertical_poster_url"],
+                    md["horizontal_poster_public_url"],
+                    md["vertical_poster_public_url"],
                     md["country"],
                     round(float(md["rating"]), 1),
                     tmdb,
@@ -1,41 +1,138 @@
-import os
+"""
+Массовое обновление постеров в таблице movies.
+
+Что делает:
+- заполняет horizontal_poster_public_url / vertical_poster_public_url
+  (публичные пути, которые KinoServer отдаёт как есть, см.
+  movie_data.public_poster_url) для всех фильмов, где они устарели;
+- с --film-data дополнительно перечитывает horizontal_poster_url из
+  _film_data/kp_films/entity_{id}.json (coverUrl / logoUrl / posterUrl).
+
+Запись идёт пачками: один UPDATE ... FROM (VALUES ...) на --batch-size
+фильмов вместо UPDATE на каждый фильм.
+
+    python parser/fix_posters.py
+    python parser/fix_posters.py --film-data /path/to/_film_data
+"""
+import argparse
 import json
-import psycopg2
-
-AAA = "C:/Users/Admin/PycharmProjects/movies_parse/data"  # тут путь до папки _film_data
-
-conn = psycopg2.connect(
-    dbname="vibemovie",
-    user="postgres",
-    password="postgres",
-    host="localhost",
-    port=5432
-)
-
-cur = conn.cursor(name="stream_cursor")
-cur.execute("SELECT kinopoisk_id FROM movies")
-update_cur = conn.cursor()
-
-def load_json(p: str):
-    if os.path.exists(p):
-        with open(p, "r", encoding="utf-8") as f:
-                return json.load(f)
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+ROOT = SCRIPT_DIR.parent
+
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+load_dotenv(ROOT / ".env")
+load_dotenv(SCRIPT_DIR / ".env")
+
+from database import Database  # noqa: E402
+from movie_data import public_poster_url  # noqa: E402
+
+UPDATE_POSTERS_SQL = """
+    UPDATE movies AS m SET
+        horizontal_poster_url = v.horizontal_poster_url,
+        horizontal_poster_public_url = v.horizontal_poster_public_url,
+        vertical_poster_public_url = v.vertical_poster_public_url
+    FROM (VALUES %s) AS v(
+        kinopoisk_id, horizontal_poster_url,
+        horizontal_poster_public_url, vertical_poster_public_url
+    )
+    WHERE m.kinopoisk_id = v.kinopoisk_id
+"""
+
+
+def load_json(path: Path) -> dict:
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
     return {}
 
-for kp_id in cur:
-    # твоя логика
-    path = f"{AAA}/kp_films/entity_{kp_id[0]}.json"
-    data = load_json(path)
 
-    new_value = data.get("coverUrl") or data.get("logoUrl") or data.get("posterUrl") or ""
+def horizontal_poster_from_film_data(film_data: Path, kinopoisk_id: int) -> str:
+    data = load_json(film_data / "kp_films" / f"entity_{kinopoisk_id}.json")
+    return data.get("coverUrl") or data.get("logoUrl") or data.get("posterUrl") or ""
+
+
+def fix_posters(film_data: Path | None = None, batch_size: int = 1000) -> int:
+    """Возвращает число обновлённых фильмов."""
+    db = Database()
+    conn = db.conn
+    updated = 0
+    try:
+        # Именованный (серверный) курсор: таблицу читаем потоком, не целиком.
+        with conn.cursor(name="fix_posters_stream") as read_cur:
+            read_cur.itersize = batch_size
+            read_cur.execute("""
+                SELECT kinopoisk_id, horizontal_poster_url, vertical_poster_url,
+                       horizontal_poster_public_url, vertical_poster_public_url
+                FROM movies
+                WHERE kinopoisk_id IS NOT NULL
+            """)
+
+            batch: list[tuple] = []
+            with conn.cursor() as write_cur:
+                for kp_id, horizontal, vertical, horizontal_public, vertical_public in read_cur:
+                    new_horizontal = horizontal
+                    if film_data is not None:
+                        new_horizontal = horizontal_poster_from_film_data(film_data, kp_id)
+
+                    row = (
+                        kp_id,
+                        new_horizontal,
+                        public_poster_url(new_horizontal),
+                        public_poster_url(vertical),
+                    )
+                    if row[1:] == (horizontal, horizontal_public, vertical_public):
+                        continue
+
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        execute_values(write_cur, UPDATE_POSTERS_SQL, batch, page_size=batch_size)
+                        updated += len(batch)
+                        batch.clear()
 
-    update_cur.execute(
-        "UPDATE movies SET horizontal_poster_url = %s WHERE kinopoisk_id = %s",
-        (new_value, kp_id[0])
+                if batch:
+                    execute_values(write_cur, UPDATE_POSTERS_SQL, batch, page_size=batch_size)
+                    updated += len(batch)
+
+        conn.commit()
+        return updated
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Пересчитать публичные URL постеров (и при желании horizontal_poster_url)."
     )
+    parser.add_argument(
+        "--film-data",
+        type=Path,
+        default=None,
+        help="Путь к _film_data: перечитать horizontal_poster_url из kp_films/entity_*.json",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("FIX_POSTERS_BATCH_SIZE") or 1000),
+        help="Сколько фильмов обновлять одним UPDATE",
+    )
+    args = parser.parse_args()
+
+    updated = fix_posters(film_data=args.film_data, batch_size=max(1, args.batch_size))
+    print(f"Обновлено фильмов: {updated}")
+    return 0
 
-conn.commit()
 
-#cur.close()
-update_cur.close()
-conn.close()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,11 @@
 """
 from __future__ import annotations
 
+import os
 from typing import Any, TypedDict
+from urllib.parse import urlparse
+
+TMDB_IMAGE_HOST = "image.tmdb.org"
 
 
 class MovieData(TypedDict, total=False):
@@ -28,6 +32,9 @@ class MovieData(TypedDict, total=False):
     description: str
     horizontal_poster_url: str
     vertical_poster_url: str
+    # Публичные пути постеров (TMDB -> прокси KinoServer), см. public_poster_url().
+    horizontal_poster_public_url: str | None
+    vertical_poster_public_url: str | None
     country: str
     rating: float
     tags: list[str]
@@ -42,6 +49,35 @@ class MovieData(TypedDict, total=False):
     embedding: list[float] | None
 
 
+def public_poster_url(url: str | None, prefix: str | None = None) -> str | None:
+    """
+    URL постера, который API отдаёт как есть (колонки *_poster_public_url).
+
+    image.tmdb.org/t/p/{size}/{file} -> {PUBLIC_API_PREFIX}/images/tmdb/{size}/{file}
+    (прокси KinoServer), остальные URL — без изменений. Правило то же, что у
+    KinoServer app/posters.py::proxify_tmdb_image_url.
+    """
+    url = (url or "").strip()
+    if not url:
+        return None
+
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return url
+
+    if parsed.netloc != TMDB_IMAGE_HOST:
+        return url
+
+    parts = (parsed.path or "").strip("/").split("/")
+    if len(parts) < 4 or parts[0] != "t" or parts[1] != "p":
+        return url
+
+    if prefix is None:
+        prefix = os.getenv("PUBLIC_API_PREFIX") or "/api"
+    return f"{prefix.rstrip('/')}/images/tmdb/{parts[2]}/{'/'.join(parts[3:])}"
+
+
 def normalize_movie_data(raw: dict[str, Any]) -> dict[str, Any]:
     """
     Приводит произвольный dict к полям, ожидаемым при INSERT (совместимость со старыми JSON).
@@ -60,6 +96,9 @@ def normalize_movie_data(raw: dict[str, Any]) -> dict[str, Any]:
     except (TypeError, ValueError):
         total_reviews = 0
 
+    horizontal_poster_url = raw.get("horizontal_poster_url") or ""
+    vertical_poster_url = raw.get("vertical_poster_url") or ""
+
     kinopoisk_id = raw.get("kinopoisk_id")
     if kinopoisk_id is None:
         raise ValueError("movie_data: обязательное поле kinopoisk_id отсутствует")
@@ -75,8 +114,10 @@ def normalize_movie_data(raw: dict[str, Any]) -> dict[str, Any]:
         "writers": str(writers),
         "actors": raw.get("actors") or "",
         "description": raw.get("description") or "",
-        "horizontal_poster_url": raw.get("horizontal_poster_url") or "",
-        "vertical_poster_url": raw.get("vertical_poster_url") or "",
+        "horizontal_poster_url": horizontal_poster_url,
+        "vertical_poster_url": vertical_poster_url,
+        "horizontal_poster_public_url": public_poster_url(horizontal_poster_url),
+        "vertical_poster_public_url": public_poster_url(vertical_poster_url),
         "country": raw.get("country") or "",
         "rating": float(raw.get("rating") or 0),
         "tags": [str(x) for x in tags if x is not None and str(x).strip()],
@@ -2,8 +2,12 @@ import requests
 from emotions_rating_db import EmotionRatingsDB
 
 
-def get_emotion_ratings(movie_id: str, api_url: str = "") -> str:
-    """movie_id — kinopoisk_id (как в ответе GET /movies/all)."""
+def get_emotion_stats(movie_id: str, api_url: str = "") -> dict:
+    """movie_id — kinopoisk_id (как в ответе GET /movies/all).
+
+    Сервер сам считает count/sum/mean по каждой эмоции, поэтому ответ имеет
+    постоянный размер, а не список всех оценок фильма.
+    """
     try:
         if not api_url:
             import os
@@ -11,7 +15,7 @@ def get_emotion_ratings(movie_id: str, api_url: str = "") -> str:
             if not api_url:
                 raise RuntimeError("Не задан API_URL. Укажите базовый URL бэкенда, например 'https://<HOST>/api'.")
         response = requests.get(
-            f"{api_url}/movies/{movie_id}/emotion-ratings",
+            f"{api_url}/movies/{movie_id}/emotion-stats",
             timeout=60  # Таймаут 60 секунд на случай долгой обработки
         )
         response.raise_for_status()
@@ -24,18 +28,9 @@ def get_emotion_ratings(movie_id: str, api_url: str = "") -> str:
         raise
 
 def calculate_avg_ratings(movie_id: str):
-    ratings = get_emotion_ratings(movie_id)
-    avg_ratings = {}
-
-    for emotion, ratings in ratings.items():
-        if len(ratings)>0:
-            avg_rating = round((sum(ratings)/len(ratings)), 2)
-        else:
-            avg_rating = 0
-
-        avg_ratings[emotion] = avg_rating
-    
-    return avg_ratings
+    stats = get_emotion_stats(movie_id)
+    # mean уже округлён до 2 знаков (0 — если оценок нет).
+    return {emotion: values["mean"] for emotion, values in stats.items()}
 
 def update_avg_ratings(movie_id):
     ratings = calculate_avg_ratings(movie_id)
@@ -1,4 +1,5 @@
 
+import argparse
 import os
 import sys
 from pathlib import Path
@@ -10,6 +11,14 @@ from dotenv import load_dotenv
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 load_dotenv(PROJECT_ROOT / ".env", override=False)
 
+# SQL профиля эмоций — общий с KinoServer (модуль без зависимостей от движка).
+KINOSERVER_DIR = PROJECT_ROOT / "KinoServer"
+if str(KINOSERVER_DIR) not in sys.path:
+    sys.path.insert(0, str(KINOSERVER_DIR))
+
+from app.crud.emotion_profile_sql import profile_aggregate_sql  # noqa: E402
+from app.emotions import EMOTIONS  # noqa: E402
+
 
 def _get_database_url() -> str:
     """DATABASE_URL для подключения к Postgres (поддерживаем оба имени)."""
@@ -23,10 +32,9 @@ def _get_database_url() -> str:
     return db_url.replace("+asyncpg", "")
 
 
-# Логика повторяет старый calculate_avg_ratings: учитываем только значения > 0
-# (NULL и 0 трактуем как "оценки нет"), округляем до 2 знаков, при полном
-# отсутствии данных по эмоции — 0.
-UPDATE_RATINGS_SQL = """
+# Таблицы, индекс и состояние инкрементального режима. reviews_movie_id_id_idx
+# нужен, чтобы пересчёт одного фильма читал только его отзывы.
+SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS ratings (
     movie_id INTEGER PRIMARY KEY,
     sadness_avg FLOAT DEFAULT 0,
@@ -40,53 +48,166 @@ CREATE TABLE IF NOT EXISTS ratings (
     boredom_avg FLOAT DEFAULT 0
 );
 
-INSERT INTO ratings (
-    movie_id,
-    sadness_avg, optimism_avg, fear_avg, anger_avg, neutral_avg,
-    worry_avg, love_avg, fun_avg, boredom_avg
+CREATE TABLE IF NOT EXISTS movie_emotion_profiles (
+    kinopoisk_id INTEGER PRIMARY KEY,
+    emotions DOUBLE PRECISION[] NOT NULL,
+    emotion_sums BIGINT[] NOT NULL,
+    emotion_counts INTEGER[] NOT NULL,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Таблица профилей старой схемы (до запуска новой версии сервера).
+ALTER TABLE movie_emotion_profiles ADD COLUMN IF NOT EXISTS emotion_sums BIGINT[];
+ALTER TABLE movie_emotion_profiles ADD COLUMN IF NOT EXISTS emotion_counts INTEGER[];
+
+CREATE TABLE IF NOT EXISTS rating_aggregation_state (
+    name VARCHAR PRIMARY KEY,
+    last_review_id BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS reviews_movie_id_id_idx ON reviews (movie_id, id);
+"""
+
+# Ключ строки в rating_aggregation_state.
+WATERMARK_NAME = "update_all_ratings"
+
+# id отзыва выдаётся при INSERT, а виден он становится при COMMIT: отзыв с id
+# меньше прочитанного MAX(id), чья транзакция закоммитилась позже (парсер,
+# долгая транзакция), водяной знак бы пропустил. Поэтому каждый прогон
+# заново смотрит столько id ниже водяного знака — пересчёт идемпотентен.
+WATERMARK_SAFETY_MARGIN = 1000
+
+# Фильмы, у которых есть отзывы с id в (since, upto]. Инкрементальный
+# прогон пересчитывает только их — время зависит от числа новых отзывов, а не
+# от размера всей таблицы reviews.
+# {column} — movie_id (reviews) или kinopoisk_id (movie_emotion_profiles).
+CHANGED_MOVIES_FILTER = """
+WHERE {column} IN (
+    SELECT DISTINCT movie_id FROM reviews
+    WHERE id > %(since)s AND id <= %(upto)s
+)
+"""
+
+# Прогон без новых отзывов: есть ли в окне margin фильм, чей профиль не
+# учитывает часть отзывов (review_count расходится с числом отзывов) — значит,
+# там закоммитился опоздавший отзыв.
+LATE_REVIEWS_SQL = """
+SELECT 1
+FROM (
+    SELECT DISTINCT movie_id FROM reviews
+    WHERE id > %(since)s AND id <= %(upto)s
+) w
+LEFT JOIN movie_emotion_profiles p ON p.kinopoisk_id = w.movie_id
+WHERE p.review_count IS DISTINCT FROM (
+    SELECT COUNT(*) FROM reviews r WHERE r.movie_id = w.movie_id
 )
+LIMIT 1
+"""
+
+# Старая таблица ratings — копия средних из только что пересчитанных
+# профилей: формула одна (app.crud.emotion_profile_sql), копии не
+# расходятся. {where} — пусто (все фильмы) или CHANGED_MOVIES_FILTER по
+# kinopoisk_id.
+UPDATE_RATINGS_SQL = f"""
+INSERT INTO ratings (movie_id, {", ".join(f"{e}_avg" for e in EMOTIONS)})
 SELECT
-    movie_id,
-    COALESCE(ROUND(AVG(NULLIF(sadness_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(optimism_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(fear_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(anger_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(neutral_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(worry_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(love_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(fun_rating, 0))::numeric, 2), 0),
-    COALESCE(ROUND(AVG(NULLIF(boredom_rating, 0))::numeric, 2), 0)
-FROM reviews
-GROUP BY movie_id
+    kinopoisk_id,
+    {", ".join(f"emotions[{i}]" for i in range(1, len(EMOTIONS) + 1))}
+FROM movie_emotion_profiles
+{{where}}
 ON CONFLICT (movie_id) DO UPDATE SET
-    sadness_avg  = EXCLUDED.sadness_avg,
-    optimism_avg = EXCLUDED.optimism_avg,
-    fear_avg     = EXCLUDED.fear_avg,
-    anger_avg    = EXCLUDED.anger_avg,
-    neutral_avg  = EXCLUDED.neutral_avg,
-    worry_avg    = EXCLUDED.worry_avg,
-    love_avg     = EXCLUDED.love_avg,
-    fun_avg      = EXCLUDED.fun_avg,
-    boredom_avg  = EXCLUDED.boredom_avg;
+    {", ".join(f"{e}_avg = EXCLUDED.{e}_avg" for e in EMOTIONS)};
 """
 
 
-def update_all_ratings() -> int:
-    """Один SQL-проход вместо тысячи HTTP-запросов. Возвращает число затронутых фильмов."""
+def update_all_ratings(full: bool = False, margin: int = WATERMARK_SAFETY_MARGIN) -> int:
+    """Пересчёт средних. Возвращает число затронутых фильмов.
+
+    По умолчанию — инкрементально: только фильмы с отзывами, добавленными
+    после прошлого прогона (водяной знак — максимальный reviews.id, хранится в
+    rating_aggregation_state), плюс margin id ниже водяного знака — для
+    отзывов, закоммиченных позже прочитанного MAX(id). Первый прогон и
+    full=True — по всей таблице. Водяной знак сдвигается в той же транзакции,
+    что и пересчёт.
+    """
     conn = psycopg2.connect(_get_database_url())
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(UPDATE_RATINGS_SQL)
+            cur.execute(SCHEMA_SQL)
+            # FOR UPDATE: два параллельных прогона не сдвинут водяной знак наперегонки.
+            cur.execute(
+                "SELECT last_review_id FROM rating_aggregation_state "
+                "WHERE name = %(name)s FOR UPDATE",
+                {"name": WATERMARK_NAME},
+            )
+            row = cur.fetchone()
+            watermark = None if (full or row is None) else int(row[0])
+
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM reviews")
+            upto = int(cur.fetchone()[0])
+
+            since = None if watermark is None else max(0, watermark - max(0, margin))
+            params = {"since": since, "upto": upto}
+
+            # Без новых и опоздавших отзывов не пишем ничего: иначе триггеры
+            # сдвинут версию каталога.
+            if watermark is not None and upto <= watermark:
+                cur.execute(LATE_REVIEWS_SQL, params)
+                if cur.fetchone() is None:
+                    print("Новых отзывов нет — пересчёт не нужен")
+                    return 0
+
+            def where(column: str) -> str:
+                return "" if since is None else CHANGED_MOVIES_FILTER.format(column=column)
+
+            # movie_emotion_profiles — из неё читает KinoServer. Сервер
+            # прибавляет к профилю каждый новый отзыв сам; здесь — полный
+            # пересчёт сумм и средних (отзывы в обход API: парсер, ручные правки).
+            cur.execute(profile_aggregate_sql(where("movie_id")), params)
+            updated_profiles = cur.rowcount
+            cur.execute(UPDATE_RATINGS_SQL.format(where=where("kinopoisk_id")), params)
             updated_rows = cur.rowcount
+
+            cur.execute(
+                """
+                INSERT INTO rating_aggregation_state (name, last_review_id, updated_at)
+                VALUES (%(name)s, %(upto)s, now())
+                ON CONFLICT (name) DO UPDATE SET
+                    last_review_id = EXCLUDED.last_review_id,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                {"name": WATERMARK_NAME, "upto": upto},
+            )
+        mode = "полный" if since is None else f"инкрементальный (reviews.id > {since})"
+        print(f"Режим: {mode}")
         print(f"Обновлено строк в `ratings`: {updated_rows}")
+        print(f"Обновлено строк в `movie_emotion_profiles`: {updated_profiles}")
         return updated_rows
     finally:
         conn.close()
 
 
 def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Пересчитать средние эмоциональные оценки фильмов по отзывам."
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Пересчитать все фильмы, а не только с новыми отзывами",
+    )
+    parser.add_argument(
+        "--margin",
+        type=int,
+        default=WATERMARK_SAFETY_MARGIN,
+        help="Сколько id ниже водяного знака пересматривать (отзывы из поздно закоммиченных транзакций)",
+    )
+    args = parser.parse_args()
+
     try:
-        update_all_ratings()
+        update_all_ratings(full=args.full, margin=args.margin)
         return 0
     except Exception as e:
         print(f"Ошибка при обновлении рейтингов: {e}")
@@ -178,10 +178,21 @@ export function createApi({ apiUrl }) {
       }
     },
 
-    /** @param {number|string} movieId — kinopoisk_id (поле id в ответе API). */
-    async getReviews({ movieId, tmdbId }) {
+    /**
+     * Страница отзывов (новые сверху).
+     * @param {number|string} movieId — kinopoisk_id (поле id в ответе API).
+     * @param {string|null} cursor — X-Next-Cursor предыдущей страницы (null — первая).
+     * @returns {{ reviews: object[], nextCursor: string|null }} nextCursor = null — страниц больше нет.
+     */
+    async getReviews({ movieId, tmdbId, cursor = null }) {
       const id = movieId ?? tmdbId;
-      return await fetchJson(`${apiUrl}/movies/${encodeURIComponent(id)}/reviews`);
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const resp = await fetch(`${apiUrl}/movies/${encodeURIComponent(id)}/reviews${query}`);
+      if (!resp.ok) throw new Error(`Network error: ${resp.status}`);
+      return {
+        reviews: await resp.json(),
+        nextCursor: resp.headers.get('X-Next-Cursor'),
+      };
     },
 
     async getAvgEmotionRatings({ movieId, tmdbId }) {
@@ -1,4 +1,4 @@
-import { MOBILE_WIDTH_BREAKPOINT } from './config.js';
+import { API_URL, MOBILE_WIDTH_BREAKPOINT } from './config.js';
 import { extractColors } from './colors.js';
 import { displayEmotionRatings, displayTopEmotionsText } from './ui_emotions.js';
 import {
@@ -8,6 +8,24 @@ import {
   resetEmotionInterface,
 } from './ui_reviews.js';
 
+// URL уменьшенного постера под ширину экрана: сервер отдаёт WebP/AVIF нужной
+// ширины (`?w=` у /images/tmdb и /images/proxy) вместо полноразмерного файла.
+function posterVariantUrl(url, cssWidth) {
+  if (!url) return url;
+  const width = Math.round(cssWidth * (window.devicePixelRatio || 1));
+  if (url.includes('/images/tmdb/')) {
+    return `${url}${url.includes('?') ? '&' : '?'}w=${width}`;
+  }
+  try {
+    if (new URL(url).hostname === 'kinopoiskapiunofficial.tech') {
+      return `${API_URL}/images/proxy?url=${encodeURIComponent(url)}&w=${width}`;
+    }
+  } catch {
+    // Относительный или некорректный URL — отдаём как есть.
+  }
+  return url;
+}
+
 // Контроллер карточек: отрисовка, свайпы, открытие/закрытие, лайк/дизлайк, отзывы.
 export function createCardsController({
   state,
@@ -196,14 +214,31 @@ export function createCardsController({
     if (card.dataset.reviewsLoaded === 'true') return;
 
     try {
-      const reviews = await api.getReviews({ movieId });
-      displayReviews(card, reviews);
+      const { reviews, nextCursor } = await api.getReviews({ movieId });
+      displayReviews(card, reviews, { nextCursor });
       card.dataset.reviewsLoaded = 'true';
     } catch (e) {
       console.error('Ошибка загрузки отзывов:', e);
     }
   }
 
+  // Следующая страница отзывов по курсору из X-Next-Cursor (кнопка «Показать ещё»).
+  async function loadMoreMovieReviews(card, movieId, button) {
+    const cursor = card.dataset.reviewsCursor;
+    if (!cursor || button.disabled) return;
+
+    button.disabled = true;
+    button.textContent = 'Загрузка...';
+    try {
+      const { reviews, nextCursor } = await api.getReviews({ movieId, cursor });
+      displayReviews(card, reviews, { append: true, nextCursor });
+    } catch (e) {
+      console.error('Ошибка загрузки отзывов:', e);
+      button.disabled = false;
+      button.textContent = 'Показать ещё';
+    }
+  }
+
   async function loadMovieEmotionRatings(card, movieId) {
     if (card.dataset.emotionsLoaded === 'true') return;
     try {
@@ -237,7 +272,10 @@ export function createCardsController({
     card.dataset.tmdbId = movie.tmdb_id ?? '';
 
     const isMobile = state.width <= MOBILE_WIDTH_BREAKPOINT;
-    const bgImage = isMobile ? movie.vertical_poster_url : movie.horizontal_poster_url;
+    const bgImage = isMobile
+      ? posterVariantUrl(movie.vertical_poster_url, state.width)
+      : movie.horizontal_poster_url;
+    const posterColors = movie.poster_colors?.[isMobile ? 'vertical' : 'horizontal'] ?? null;
     const cardFace = card.querySelector('.card-face');
     if (cardFace) {
       cardFace.style.backgroundImage = `url(${bgImage})`;
@@ -256,7 +294,7 @@ export function createCardsController({
     card.querySelector('.additional_info__genres').textContent = movie.genre || '—';
     card.querySelector('.additional_info__rating').textContent = movie.rating || '—';
 
-    return { card, bgImage };
+    return { card, bgImage, posterColors };
   }
 
   // Финальная карточка-заглушка "фильмы закончились".
@@ -301,7 +339,7 @@ export function createCardsController({
       return;
     }
 
-    const { card, bgImage } = buildMovieCardFromTemplate(movie);
+    const { card, bgImage, posterColors } = buildMovieCardFromTemplate(movie);
     card.classList.add(type);
     card.dataset.index = index;
 
@@ -309,7 +347,7 @@ export function createCardsController({
     state.currentMovieId = movie.id;
 
     wrapper.appendChild(card);
-    extractColors(bgImage, card);
+    extractColors(bgImage, card, posterColors);
 
     // Подгружаем отзывы и эмоции для active/next.
     if (type === 'active' || type === 'next') {
@@ -386,8 +424,10 @@ export function createCardsController({
               emotionData,
             }),
             {
-              onSuccess: (updatedReviews) => {
-                displayReviews(card, updatedReviews);
+              // POST отдаёт только созданный отзыв — перечитываем первую страницу.
+              onSuccess: () => {
+                card.dataset.reviewsLoaded = 'false';
+                loadMovieReviews(card, movieId);
               },
             },
           );
@@ -411,6 +451,9 @@ export function createCardsController({
           reviewText.classList.add('collapsed');
           btn.textContent = 'Развернуть';
         }
+      } else if (e.target.classList.contains('reviews-more-btn')) {
+        e.stopPropagation();
+        void loadMoreMovieReviews(card, card.dataset.movieId, e.target);
       }
     });
 
@@ -790,12 +833,12 @@ export function createCardsController({
   function openMovieFromFavorites(movie, options = {}) {
     if (!movie) return;
 
-    const { card, bgImage } = buildMovieCardFromTemplate(movie);
+    const { card, bgImage, posterColors } = buildMovieCardFromTemplate(movie);
     card.dataset.fromFavorites = 'true';
     card.style.opacity = '0';
 
     wrapper.appendChild(card);
-    extractColors(bgImage, card);
+    extractColors(bgImage, card, posterColors);
     setupCardEvents(card);
 
     const animated = Boolean(options.startRect);
@@ -1,10 +1,27 @@
-// Темизация карточек по доминантному цвету (анализатор из `rgbaster.umd.js` в `window`).
+// Темизация карточек по доминантному цвету: посчитанному сервером
+// (movie.poster_colors) или, если его нет, анализатором из `rgbaster.umd.js`.
 
 function isColorTooLight(r, g, b, threshold = 200) {
   const brightness = 0.299 * r + 0.587 * g + 0.114 * b;
   return brightness > threshold;
 }
 
+function hexToRgbString(hex) {
+  const match = /^#([0-9a-f]{6})$/i.exec(hex || '');
+  if (!match) return null;
+  const value = parseInt(match[1], 16);
+  return `${(value >> 16) & 255}, ${(value >> 8) & 255}, ${value & 255}`;
+}
+
+function applyThemeColor(cardElement, rgbString) {
+  const [r, g, b] = rgbString.split(',').map((val) => parseInt(val.trim(), 10));
+  if (isColorTooLight(r, g, b)) {
+    cardElement.style.setProperty('--theme-color-rgb', '0, 0, 0');
+  } else {
+    cardElement.style.setProperty('--theme-color-rgb', rgbString);
+  }
+}
+
 function canAnalyzeImage(imagePath) {
   if (!imagePath || typeof imagePath !== 'string') return false;
 
@@ -21,7 +38,14 @@ function canAnalyzeImage(imagePath) {
   }
 }
 
-export async function extractColors(imagePath, cardElement) {
+export async function extractColors(imagePath, cardElement, posterColors = null) {
+  // Цвет с сервера — постер не нужно скачивать второй раз для анализа.
+  const serverRgb = hexToRgbString(posterColors?.dominant);
+  if (serverRgb) {
+    applyThemeColor(cardElement, serverRgb);
+    return;
+  }
+
   const analyze = window.rgbaster || window.RGBaster;
   if (!analyze || !canAnalyzeImage(imagePath)) return;
 
@@ -30,14 +54,7 @@ export async function extractColors(imagePath, cardElement) {
     if (result?.[0]?.color) {
       const match = result[0].color.match(/\d+,\s*\d+,\s*\d+/);
       if (match) {
-        const rgbString = match[0];
-        const [r, g, b] = rgbString.split(',').map((val) => parseInt(val.trim(), 10));
-
-        if (isColorTooLight(r, g, b)) {
-          cardElement.style.setProperty('--theme-color-rgb', '0, 0, 0');
-        } else {
-          cardElement.style.setProperty('--theme-color-rgb', rgbString);
-        }
+        applyThemeColor(cardElement, match[0]);
       }
     }
   } catch (e) {
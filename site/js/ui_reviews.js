@@ -1,12 +1,18 @@
 // UI для отзывов и формы выбора эмоций.
 
-export function displayReviews(card, reviews) {
+/**
+ * Рисует страницу отзывов. append — дописать к уже показанным (следующая
+ * страница), nextCursor — курсор следующей страницы: если он есть, под
+ * списком показывается кнопка «Показать ещё».
+ */
+export function displayReviews(card, reviews, { append = false, nextCursor = null } = {}) {
   const reviewsList = card.querySelector('.reviews-section__list');
   if (!reviewsList) return;
 
-  reviewsList.innerHTML = '';
+  if (!append) reviewsList.innerHTML = '';
 
   card.dataset.reviewsLoaded = 'true';
+  updateMoreReviewsButton(card, reviewsList, nextCursor);
 
   if (reviews && reviews.length > 0) {
     reviews.forEach((review) => {
@@ -57,7 +63,7 @@ export function displayReviews(card, reviews) {
 
       reviewsList.appendChild(reviewItem);
     });
-  } else {
+  } else if (!append) {
     const noReviewsItem = document.createElement('li');
     noReviewsItem.className = 'reviews-section__item';
     noReviewsItem.innerHTML = `
@@ -67,6 +73,25 @@ export function displayReviews(card, reviews) {
   }
 }
 
+function updateMoreReviewsButton(card, reviewsList, nextCursor) {
+  let moreBtn = card.querySelector('.reviews-more-btn');
+  if (!nextCursor) {
+    delete card.dataset.reviewsCursor;
+    moreBtn?.remove();
+    return;
+  }
+
+  card.dataset.reviewsCursor = nextCursor;
+  if (!moreBtn) {
+    moreBtn = document.createElement('button');
+    moreBtn.type = 'button';
+    moreBtn.className = 'reviews-more-btn';
+    reviewsList.after(moreBtn);
+  }
+  moreBtn.textContent = 'Показать ещё';
+  moreBtn.disabled = false;
+}
+
 export function collectEmotionData(card) {
   const emotionGroups = card.querySelectorAll('.emotion-input-group');
   const emotionData = {